@@ -1,7 +1,11 @@
-from orderbook import *
-from order import *
-from events import *
-import random
+import os
+import numpy
+from order import Order
+from orderbook import OrderBook
+from trade import Trade, ExecutionReport, MatchStats
+from events import EventOrder, EventOrderBatch, EventRequestOrderbook
+from rng import RandomStream
+from rolling import RollingWindow
 
 # This class defines a trader on a stock exchange. 
 class Agent:
@@ -13,6 +17,9 @@ class Agent:
         self.name: str = name
         self.simulation: 'Simulation' = simulation
 
+        # Index of the agent in the simulation's agents, set when the simulation is loaded; identifies the agent in trade tapes
+        self.agentID: int = -1
+
         # When set, market data will be ignored until the simulation time equals this variable's time
         self.orderBlockTime: float = -1
 
@@ -21,22 +28,14 @@ class Agent:
         self.canceledOrders: int = 0
         self.matchedOrders: int = 0
      
-        # Prices at which this agent matched
-        # List of floats
-        self.pricesMatched: list = list()
-        self.pricesMatchedBuy: list = list()
-        self.pricesMatchedSell: list = list()
-
-        # How many times this agent matched with other agents
-        # Key: agent group name, Value: number of times matched
-        self.agentsMatched: dict = dict()
-        self.agentsMatchedBuy: dict = dict()
-        self.agentsMatchedSell: dict = dict()
-        
-        # Prices at which this agent matched, per agent
-        # Key: agent group name, Value: a list, storing the prices at which it matched
-        self.agentPricesMatchedBuy: dict = dict()
-        self.agentPricesMatchedSell: dict = dict()
+        # Index of the agent's group in the simulation's agentGroups, set along with groupName
+        self.groupID: int = -1
+
+        # Statistics of the prices and amounts this agent matched at, in total and per agent group it matched with
+        self.matchStats: MatchStats = None
+
+        if simulation is not None:
+            self.matchStats = MatchStats(len(simulation.agentGroups))
 
         # How much of each share this agent owns
         # Key: symbol (str), Value: amount (int)
@@ -49,6 +48,19 @@ class Agent:
         self.algorithm = None
         self.latencyFunction = None
 
+        # The agent's own random stream, used by the agent and its algorithm
+        self.random: RandomStream = None
+
+        if simulation is not None:
+            self.random = simulation.rng.stream("algorithm", name)
+
+        # When set, the exchange sends this agent an execution report whenever one of its orders fills or is canceled
+        self.executionReports: bool = False
+
+        # When set, this agent receives heartbeats (market data with an empty trade) while the market is idle
+        # Agents which only act upon receiving market data need this to keep going
+        self.heartbeat: bool = False
+
     # Parses an agent from a json dictionary
     # Takes: a json dictionary, a simulation, and an index integer
     # The same json dictionary can define multiple identical agents - the index integer is used to differentiate them
@@ -62,8 +74,10 @@ class Agent:
     # shares (dict: str -> int) - how many of each share this agent starts with, Key: symbol (str), Value: amount (int)
     # algtype (str) - the agent's algorithm type
     # algargs (str) - additional arguments specific to the algorithm type - see each algorithm's class to see its type args
-    # latency (str) - a latency function, like "linear" or "normal"
+    # latency (str) - a latency function, like "linear", "normal" or "empirical"
     # latencyargs (dict) - additional arguments specific to the latency function - see each latency function's class to see its args
+    # heartbeat (bool, optional) - overrides whether the agent receives heartbeats while the market is idle (by default, only agents driven by market data do)
+    # population (bool, optional) - if true, the group is stored as one PopulationZI instead of separate agents (only for poisson agents with the zi algorithm)
     def fromJson(j: dict, simulation: 'Simulation', index: int) -> 'Agent':
         # Multiple agents created from 1 json dictionary will be named like "agent0", "agent1", "agent2", etc.
         name: str = j["name"] + index
@@ -92,6 +106,10 @@ class Agent:
 
         # Agents created from the same json dictionary will be grouped together
         agent.groupName = j["name"]
+        agent.groupID = simulation.agentGroups.index(j["name"])
+
+        if "heartbeat" in j:
+            agent.heartbeat = j["heartbeat"]
 
         algtype: str = j["algorithm"]
         algargs: dict = j["algorithmargs"]
@@ -122,17 +140,7 @@ class Agent:
             algorithm = AlgorithmStaleQuoteArbitrage(agent, algargs)
         agent.algorithm = algorithm
 
-        latency: LatencyFunction = None
-        lattype: str = j["latency"]
-        latargs: str = j["latencyargs"]
-
-        if lattype == "linear":
-            latency = LatencyFunctionLinear(agent, latargs)
-        elif lattype == "normal":
-            latency = LatencyFunctionNormal(agent, latargs)
-            
-
-        agent.latencyFunction = latency
+        agent.latencyFunction = LatencyFunction.fromJson(j, agent)
 
         return agent
 
@@ -140,18 +148,96 @@ class Agent:
     def inputData(self, trade: Trade, timestamp: float):
         raise NotImplementedError
 
-    # Attempts to create and submit an order. Fails if insufficient cash or shares.
-    # Used by some agents which do not want to go in the negatives. Others submit directly.
-    def attemptCreateOrder(self, timestamp: float, order: Order, symbol: str) -> bool:
+    # Checks whether the agent has enough cash (for a buy order) or shares (for a sell order) to send an order
+    def canCreateOrder(self, order: Order, symbol: str) -> bool:
         if order.buy and self.balance < order.amount * self.sharePrices[symbol]:
             return False
         
         if not order.buy and self.shares[symbol] < order.amount:
             return False
 
+        return True
+
+    # Attempts to create and submit an order. Fails if insufficient cash or shares.
+    # Used by some agents which do not want to go in the negatives. Others submit directly.
+    def attemptCreateOrder(self, timestamp: float, order: Order, symbol: str) -> bool:
+        if not self.canCreateOrder(order, symbol):
+            return False
+
         self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), order, self.simulation.orderbooks[symbol]))
         return True
 
+    # Like attemptCreateOrder, but for a list of orders. Returns the new orders which were submitted (without cancel orders).
+    # Cancel orders are always sent. When a replace order fails the checks, a cancel for the order it replaces is sent instead,
+    # so the old order doesn't stay in the book. The algorithm is told about the orders which were not sent (see Algorithm's rejected()).
+    def attemptCreateOrders(self, timestamp: float, orders: list, symbol: str) -> list:
+        sent: list = list()
+        submitted: list = list()
+        rejected: list = list()
+
+        for order in orders:
+            if order.cancel:
+                sent.append(order)
+            elif self.canCreateOrder(order, symbol):
+                sent.append(order)
+                submitted.append(order)
+            else:
+                rejected.append(order)
+
+                if order.replaceID is not None:
+                    sent.append(self.simulation.makeCancelOrder(self, order.replaceID, timestamp))
+
+        self.submitOrders(timestamp, sent, symbol)
+
+        if len(rejected) > 0 and self.algorithm is not None:
+            self.algorithm.rejected(rejected)
+
+        return submitted
+
+    # Sends orders (including cancel and replace orders) to the exchange without any checks.
+    # If the simulation batches orders, all of them are sent as one batch message; otherwise each is sent on its own.
+    def submitOrders(self, timestamp: float, orders: list, symbol: str):
+        book: OrderBook = self.simulation.orderbooks[symbol]
+
+        if self.simulation.batchOrders and len(orders) > 1:
+            self.simulation.pushEvent(EventOrderBatch(timestamp + self.latencyFunction.getLatency(), orders, book))
+        else:
+            for order in orders:
+                self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), order, book))
+
+    # Called whenever an execution report (fill, partial fill or cancel confirmation) for one of this agent's orders is received.
+    # Only called if executionReports is set.
+    def inputExecutionReport(self, report: 'ExecutionReport', timestamp: float):
+        pass
+
+    # Sends cancel orders for the orders in "orders" which were sent at least "lifespan" ago, and removes them from "orders".
+    # "orders" maps orderID to Order, in the order they were sent, so only the expired orders and one more are looked at.
+    def cancelOldOrders(self, timestamp: float, orders: dict, lifespan: float):
+        expired: list = list()
+
+        for order in orders.values():
+            if timestamp - order.timestamp < lifespan:
+                break
+            expired.append(order)
+
+        cancels: dict = dict()
+
+        for order in expired:
+            del orders[order.orderID]
+
+            if not (order.symbol in cancels):
+                cancels[order.symbol] = list()
+
+            cancels[order.symbol].append(self.simulation.makeCancelOrder(self, order.orderID, timestamp))
+
+        for symbol in cancels:
+            self.submitOrders(timestamp, cancels[symbol], symbol)
+
+    # Forgets orders which have fully matched or have been canceled, as reported by the exchange
+    def removeFinishedOrder(self, report: 'ExecutionReport', orders: dict):
+        if report.remaining == 0:
+            orders.pop(report.order.orderID, None)
+
 # A very simple agent which simply sends in a new order when it receives market data.
 # Does not take any further args
 
@@ -160,13 +246,12 @@ class Agent:
 class BasicAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
+        self.heartbeat = True
 
     def inputData(self, trade: 'Trade', timestamp: float):
         self.sharePrices[trade.symbol] = trade.price
         orders: list = self.algorithm.getOrders(trade.symbol, timestamp)
-
-        for order in orders:
-            self.attemptCreateOrder(timestamp, order, trade.symbol)
+        self.attemptCreateOrders(timestamp, orders, trade.symbol)
 
 # A slightly more complex version of the Basic Agent
 # This agent will cancel its orders a certain amount of time after thay're sent, if they haven't matched
@@ -176,56 +261,67 @@ class BasicAgent(Agent):
 # orderlifespan: float - how long each order can stay in the order book before being canceled
 # orderchance: float - value from 0-1 indicating probability of submitting a new order upon receiving new market data
 # ordercooldown: float - time waited after sending an order before again accepting more market data
+# engineexpiry: bool (optional, default false) - if true, orders are sent with an expiry time and the order book removes them itself, instead of the agent sending cancel orders
 class CancelingAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
 
-        # Orders sent which haven't been canceled yet
-        self.activeOrders: list = list()
+        # Orders sent which haven't matched or been canceled yet, Key: orderID (uuid), Value: Order
+        # Kept in the order they were sent, and pruned using execution reports
+        self.activeOrders: dict = dict()
         self.orderLifespan: float = args["orderlifespan"]
+        self.engineExpiry: bool = args.get("engineexpiry", False)
+
+        # With engine expiry, orders don't need to be tracked at all
+        self.executionReports = not self.engineExpiry
         self.orderChance: float = args["orderchance"]
         self.orderCooldown: float = args["ordercooldown"]
-        self.orderBlockTime = random.random() * self.orderCooldown
+        self.orderBlockTime = self.random.random() * self.orderCooldown
+        self.heartbeat = True
         #todo - make this block for multiple books
 
     def inputData(self, trade: 'Trade', timestamp: float):
         self.sharePrices[trade.symbol] = trade.price
 
         # Cancel old orders
-        for order in self.activeOrders:
-            if timestamp - order.timestamp >= self.orderLifespan:
-                self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), self.simulation.makeCancelOrder(self, order.orderID, timestamp), self.simulation.orderbooks[trade.symbol]))
+        if not self.engineExpiry:
+            self.cancelOldOrders(timestamp, self.activeOrders, self.orderLifespan)
         
-        if random.random() >= self.orderChance:
+        if self.random.random() >= self.orderChance:
             return
 
         orders = self.algorithm.getOrders(trade.symbol, timestamp)
         
-        for order in orders:
-            if self.attemptCreateOrder(timestamp, order, trade.symbol):
-                self.activeOrders.append(order)
+        if self.engineExpiry:
+            for order in orders:
+                order.expireTime = timestamp + self.orderLifespan
+
+            self.attemptCreateOrders(timestamp, orders, trade.symbol)
+        else:
+            for order in self.attemptCreateOrders(timestamp, orders, trade.symbol):
+                self.activeOrders[order.orderID] = order
         
         self.orderBlockTime = timestamp + self.orderCooldown
 
+    def inputExecutionReport(self, report: 'ExecutionReport', timestamp: float):
+        self.removeFinishedOrder(report, self.activeOrders)
+
 # An agent which sends orders on its own on times based on a poisson distribution
+# The arrival times are generated by the simulation, which merges the agents of a group into one arrival process (see PoissonArrivals)
 # Arguments: reentryrate (float) - rate at which the agent sends orders
 class PoissonAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
         self.rate: float = args["reentryrate"]
-        self.simulation.pushEvent(EventScheduleAgent(-numpy.log(random.random()) / self.rate, self))
 
     def inputData(self, trade: 'Trade', timestamp: float):
         self.sharePrices[trade.symbol] = trade.price
 
+    # Called by the agent's arrival process at each arrival
     def inputOrders(self, timestamp: float):
-        self.simulation.pushEvent(EventScheduleAgent(-numpy.log(random.random()) / self.rate + timestamp, self))
-        
         for s in self.simulation.orderbooks:
             orders = self.algorithm.getOrders(s, timestamp)
-
-            for order in orders:
-                self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), order, self.simulation.orderbooks[s]))
+            self.submitOrders(timestamp, orders, s)
 
 # Agent which saves past prices of transactions, for a certain time interval; useful for mean reversion traders
 
@@ -233,44 +329,52 @@ class PoissonAgent(Agent):
 # orderlifespan: float - how long each order can stay in the order book before being canceled
 # orderchance: float - value from 0-1 indicating probability of submitting a new order upon receiving new market data
 # timeinterval: float - prices of transactions older than this value are discarded
+# engineexpiry: bool (optional, default false) - if true, orders are sent with an expiry time and the order book removes them itself, instead of the agent sending cancel orders
 class RecordingAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
        
-        # Orders sent which haven't been canceled yet
-        self.activeOrders: list = list()
+        # Orders sent which haven't matched or been canceled yet, Key: orderID (uuid), Value: Order
+        # Kept in the order they were sent, and pruned using execution reports
+        self.activeOrders: dict = dict()
         self.orderLifespan: float = args["orderlifespan"]
+        self.engineExpiry: bool = args.get("engineexpiry", False)
+
+        # With engine expiry, orders don't need to be tracked at all
+        self.executionReports = not self.engineExpiry
         self.orderChance: float = args["orderchance"]
         self.timeInterval: float = args["timeinterval"]
+        self.heartbeat = True
 
-        self.pastPrices: list = list()
-        self.pastPriceTimes: list = list()
+        # Prices of the transactions of the last time interval
+        self.pastPrices: RollingWindow = RollingWindow(self.timeInterval)
 
     def inputData(self, trade: 'Trade', timestamp: float):
         # Save transaction price
         self.sharePrices[trade.symbol] = trade.price
-        self.pastPrices.append(trade.price)
-        self.pastPriceTimes.append(timestamp)
-
-        # Purge old transaction prices
-        while len(self.pastPriceTimes) > 0 and timestamp - self.pastPriceTimes[0] > self.timeInterval:
-            self.pastPriceTimes.remove(self.pastPriceTimes[0])
-            self.pastPrices.remove(self.pastPrices[0])
+        self.pastPrices.add(timestamp, trade.price)
 
         # Cancel old orders
-        for order in self.activeOrders:
-            if timestamp - order.timestamp >= self.orderLifespan:
-                self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), self.simulation.makeCancelOrder(self, order.orderID, timestamp), self.simulation.orderbooks[trade.symbol]))
+        if not self.engineExpiry:
+            self.cancelOldOrders(timestamp, self.activeOrders, self.orderLifespan)
         
-        if random.random() >= self.orderChance:
+        if self.random.random() >= self.orderChance:
             return
 
         # Send orders
         orders = self.algorithm.getOrders(trade.symbol, timestamp)
         
-        for order in orders:
-            if self.attemptCreateOrder(timestamp, order, trade.symbol):
-                self.activeOrders.append(order)
+        if self.engineExpiry:
+            for order in orders:
+                order.expireTime = timestamp + self.orderLifespan
+
+            self.attemptCreateOrders(timestamp, orders, trade.symbol)
+        else:
+            for order in self.attemptCreateOrders(timestamp, orders, trade.symbol):
+                self.activeOrders[order.orderID] = order
+
+    def inputExecutionReport(self, report: 'ExecutionReport', timestamp: float):
+        self.removeFinishedOrder(report, self.activeOrders)
 
 # Simple market maker agent which saves the last buy and sell prices and reacts to new market data
 # No arguments  
@@ -279,6 +383,7 @@ class BasicMarketMakerAgent(Agent):
         super().__init__(name, simulation, balance, shares)
         self.lastBuy: dict = dict()
         self.lastSell: dict = dict()
+        self.heartbeat = True
 
     def inputData(self, trade: 'Trade', timestamp: float):
         if trade.buyOrder is not None and trade.sellOrder is not None:
@@ -289,9 +394,7 @@ class BasicMarketMakerAgent(Agent):
         
         self.sharePrices[trade.symbol] = trade.price
         orders = self.algorithm.getOrders(trade.symbol, timestamp)
-
-        for order in orders:
-            self.attemptCreateOrder(timestamp, order, trade.symbol)
+        self.attemptCreateOrders(timestamp, orders, trade.symbol)
 
 # Agent which trades every certain time interval
 # Arguments: interval (float)
@@ -299,19 +402,16 @@ class RegularTradingAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
         self.interval: float = args["interval"]
-        self.simulation.pushEvent(EventScheduleAgent(self.interval, self))
+        self.simulation.timerWheel.register(self, self.interval, self.interval)
 
     def inputData(self, trade: 'Trade', timestamp: float):
         self.sharePrices[trade.symbol] = trade.price
 
+    # Called by the simulation's timer wheel every interval
     def inputOrders(self, timestamp: float):
-        self.simulation.pushEvent(EventScheduleAgent(self.interval + timestamp, self))
-
         for s in self.simulation.orderbooks:
             orders = self.algorithm.getOrders(s, timestamp)
-
-            for order in orders:
-                self.attemptCreateOrder(timestamp, order, s)
+            self.attemptCreateOrders(timestamp, orders, s)
 
 # An agent which requests the order book regularly and saves the 10 best deals on both sides
 # Agent which trades every certain time interval
@@ -319,24 +419,34 @@ class RegularTradingAgent(Agent):
 class StaleQuoteArbitrageAgent(Agent):
     def __init__(self, name: str, simulation: 'Simulation', balance: float, shares: dict, args: dict):
         super().__init__(name, simulation, balance, shares)
-        self.activeOrders: list = list()
+
+        # Orders sent in the last cycle which may still be resting in the book, Key: orderID (uuid), Value: Order
+        # Immediate-or-cancel and fill-or-kill orders never rest, so they are not tracked
+        self.activeOrders: dict = dict()
+        self.executionReports = True
         self.interval: float = args["interval"]
         self.symbol: str = args["symbol"]
-        self.simulation.pushEvent(EventScheduleAgent(self.interval, self))
+        self.simulation.timerWheel.register(self, self.interval, self.interval)
 
     def inputData(self, trade: 'Trade', timestamp: float):
         pass
 
+    # Called by the simulation's timer wheel every interval
     def inputOrders(self, timestamp: float):
-        self.simulation.pushEvent(EventScheduleAgent(self.interval + timestamp, self))
         self.simulation.pushEvent(EventRequestOrderbook(self.latencyFunction.getLatency() + timestamp, self, self.symbol, 10))
 
     def inputOrderBooks(self, timestamp: float, buybook: list, sellbook: list):
         self.lastBuyBook: list = buybook
         self.lastSellBook: list = sellbook
 
-        for o in self.activeOrders:
-            self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), self.simulation.makeCancelOrder(self, o.orderID, timestamp), self.simulation.orderbooks[o.symbol]))
+        # Orders from the last cycle which may still be resting are canceled, and sent together with the new ones
+        cancels: dict = dict()
+
+        for o in self.activeOrders.values():
+            if not (o.symbol in cancels):
+                cancels[o.symbol] = list()
+
+            cancels[o.symbol].append(self.simulation.makeCancelOrder(self, o.orderID, timestamp))
 
         self.activeOrders.clear()
 
@@ -344,15 +454,282 @@ class StaleQuoteArbitrageAgent(Agent):
             orders = self.algorithm.getOrders(s, timestamp)
 
             for o in orders:
-                self.activeOrders.append(o)
+                if o.timeInForce == "gtc":
+                    self.activeOrders[o.orderID] = o
+
+            self.submitOrders(timestamp, cancels.get(s, []) + orders, s)
+
+    def inputExecutionReport(self, report: 'ExecutionReport', timestamp: float):
+        self.removeFinishedOrder(report, self.activeOrders)
+
+# A group of Poisson agents using the Zero Intelligence algorithm, stored as one object instead of one Agent per member.
+# Cash, shares, order counters and private value tables are NumPy arrays indexed by member, so very large groups fit in memory.
+# Behaves like the same group made of PoissonAgents with AlgorithmZI: with the same seed, each member draws the same private values and makes
+# the same choices as the agent it stands for. The population receives market data once for all of its members, though, and has one latency stream
+# for all of them, while agents also draw a latency for each market data message they receive. So latencies, and through them the results, are only
+# the same as for separate agents when latencies are constant.
+# Created for agent groups with "population": true (see Simulation's loadFile), from the same json properties as Agent's fromJson()
+class PopulationZI:
+    def __init__(self, j: dict, simulation: 'Simulation'):
+        if j["type"] != "poisson" or j["algorithm"] != "zi":
+            raise Exception("Populations only support poisson agents with the zi algorithm, not " + j["type"] + "/" + j["algorithm"])
+
+        count: int = j.get("count", 1)
+        args: dict = j["algorithmargs"]
+
+        self.name: str = j["name"]
+        self.groupID: int = simulation.agentGroups.index(self.name)
+        self.simulation: 'Simulation' = simulation
 
-            for order in orders:
-                self.simulation.pushEvent(EventOrder(timestamp + self.latencyFunction.getLatency(), order, self.simulation.orderbooks[s]))
+        self.rate: float = j["typeargs"]["reentryrate"]
+        self.offsetMin: float = args["offsetmin"]
+        self.offsetMax: float = args["offsetmax"]
+        self.maxPos: int = args["positionmax"]
+
+        # Column of each symbol in the shares array
+        # Key: symbol (str), Value: column (int)
+        self.symbols: dict = dict()
+
+        for s in simulation.orderbooks:
+            self.symbols[s] = len(self.symbols)
+
+        # Per member state, indexed by member (and symbol column for shares)
+        self.balance: numpy.ndarray = numpy.full(count, j["balance"], dtype=float)
+        self.shares: numpy.ndarray = numpy.zeros((count, len(self.symbols)), dtype=numpy.int64)
+        self.sentOrders: numpy.ndarray = numpy.zeros(count, dtype=numpy.int64)
+        self.canceledOrders: numpy.ndarray = numpy.zeros(count, dtype=numpy.int64)
+        self.matchedOrders: numpy.ndarray = numpy.zeros(count, dtype=numpy.int64)
+
+        self.startingBalance: float = j["balance"]
+        self.startingShares: dict = j["shares"]
+
+        for s in j["shares"]:
+            self.shares[:, self.symbols[s]] = j["shares"][s]
+
+        # Members whose cash, shares or order counts changed since the last snapshot, per order book
+        # Key: symbol (str), Value: set of member indices
+        self.changed: dict = dict()
+
+        for s in self.symbols:
+            self.changed[s] = set()
+
+        # Number of uniform draws each member has taken from its algorithm stream (see memberRandom)
+        self.draws: numpy.ndarray = numpy.zeros(count, dtype=numpy.int64)
+
+        # The order each member sent last, which its next order replaces
+        self.lastOrders: list = [None] * count
+
+        # Shared by all members, as the population receives market data once
+        self.sharePrices: dict = dict()
+
+        self.orderBlockTime: float = -1
+        self.executionReports: bool = False
+        self.heartbeat: bool = False
+        self.latencyFunction: LatencyFunction = LatencyFunction.fromJson(j, self)
+
+        # Multiple members will be named like "agent0", "agent1", "agent2", etc., like agents created by Agent's fromJson()
+        self.members: list = list()
+
+        for i in range(count):
+            p: str = ""
+
+            if count > 1:
+                p = str(i)
+
+            self.members.append(PopulationMember(self, i, self.name + p))
+
+        # One row of private values per member, drawn from the member's own stream like PrivateValue does (which keeps them in reverse order of drawing)
+        self.privateValues: numpy.ndarray = numpy.zeros((count, self.maxPos * 2))
+
+        for i in range(count):
+            self.privateValues[i] = simulation.rng.stream("privatevalues", self.members[i].name).generator.normal(0, args["variation"], self.maxPos * 2)[::-1]
+
+    def inputData(self, trade: 'Trade', timestamp: float):
+        self.sharePrices[trade.symbol] = trade.price
+
+    # Called whenever the cash, shares or an order count of a member is changed
+    def markChanged(self, index: int):
+        for s in self.changed:
+            self.changed[s].add(index)
+
+    # Returns the members which changed since the last snapshot for the symbol, and their cash, shares of the symbol, and sent, matched and canceled order counts
+    # Snapshots are stored by the data points of the symbol's order book, which only need to keep what changed between them
+    def snapshot(self, symbol: str) -> tuple:
+        indices: numpy.ndarray = numpy.array(list(self.changed[symbol]), dtype=numpy.int64)
+        self.changed[symbol] = set()
+
+        return (indices, self.balance[indices], self.shares[indices, self.symbols[symbol]], self.sentOrders[indices], self.matchedOrders[indices], self.canceledOrders[indices])
+
+    # Returns the members' values from before the first snapshot: cash, shares of the symbol, and sent, matched and canceled order counts
+    def startingValues(self, symbol: str) -> list:
+        count: int = len(self.members)
+        return [numpy.full(count, self.startingBalance, dtype=float), numpy.full(count, self.startingShares.get(symbol, 0), dtype=numpy.int64),
+                numpy.zeros(count, dtype=numpy.int64), numpy.zeros(count, dtype=numpy.int64), numpy.zeros(count, dtype=numpy.int64)]
+
+    # Applies a snapshot to values, as returned by startingValues
+    def applySnapshot(self, values: list, snapshot: tuple):
+        for i in range(len(values)):
+            values[i][snapshot[0]] = snapshot[i + 1]
+
+    # Returns the algorithm stream of a member, where it left off, with blocks of the given size
+    # Keeping a stream per member would take too much memory for large populations, so the member's generator is made again
+    # and advanced past the draws it has taken. Only uniform draws are counted, which is all AlgorithmZI.makeOrder takes.
+    def memberRandom(self, index: int, blockSize: int) -> RandomStream:
+        bitGenerator: numpy.random.PCG64 = numpy.random.PCG64(self.simulation.rng.streamSeed("algorithm", self.members[index].name))
+        bitGenerator.advance(int(self.draws[index]))
+        return RandomStream(numpy.random.Generator(bitGenerator), blockSize)
+
+    # Called by the population's arrival process when the member with the given index sends orders
+    def inputOrders(self, index: int, timestamp: float):
+        member: PopulationMember = self.members[index]
+
+        # makeOrder takes 2 uniform draws per order, so all draws come from one block, and the block's position is the number of draws taken
+        random: RandomStream = self.memberRandom(index, 2 * len(self.symbols))
+
+        for s in self.simulation.orderbooks:
+            order: Order = AlgorithmZI.makeOrder(member, random, s, timestamp, int(self.shares[index, self.symbols[s]]), self.privateValues[index], self.maxPos, self.offsetMin, self.offsetMax)
+            orders: list = [order]
+
+            # The new order replaces the previous one
+            if self.lastOrders[index] is not None:
+                orders = [self.simulation.makeReplaceOrder(order, self.lastOrders[index].orderID)]
+
+            self.lastOrders[index] = order
+            Agent.submitOrders(self, timestamp, orders, s)
+
+        self.draws[index] += random.uniformIndex
+
+# One member of a population. Stands in for an Agent wherever the exchange needs one (as the owner of orders and trades, and in statistics),
+# while its cash, shares and order counters live in the population's arrays.
+class PopulationMember:
+    __slots__ = ("population", "index", "name", "agentID", "matchStats")
+
+    executionReports: bool = False
+    heartbeat: bool = False
+    orderBlockTime: float = -1
+
+    def __init__(self, population: PopulationZI, index: int, name: str):
+        self.population: PopulationZI = population
+        self.index: int = index
+        self.name: str = name
+        self.agentID: int = -1
+
+    # Match statistics are only created once they are used, usually when a member trades
+    def __getattr__(self, name: str):
+        if name != "matchStats":
+            raise AttributeError(name)
+
+        self.matchStats = MatchStats(len(self.population.simulation.agentGroups))
+        return self.matchStats
+
+    @property
+    def simulation(self) -> 'Simulation':
+        return self.population.simulation
+
+    @property
+    def groupName(self) -> str:
+        return self.population.name
+
+    @property
+    def groupID(self) -> int:
+        return self.population.groupID
+
+    @property
+    def latencyFunction(self) -> 'LatencyFunction':
+        return self.population.latencyFunction
+
+    @property
+    def sharePrices(self) -> dict:
+        return self.population.sharePrices
+
+    @property
+    def rate(self) -> float:
+        return self.population.rate
+
+    @property
+    def shares(self) -> 'PopulationShares':
+        return PopulationShares(self.population, self.index)
+
+    @property
+    def balance(self) -> float:
+        return float(self.population.balance[self.index])
+
+    @balance.setter
+    def balance(self, value: float):
+        self.population.balance[self.index] = value
+        self.population.markChanged(self.index)
+
+    @property
+    def sentOrders(self) -> int:
+        return int(self.population.sentOrders[self.index])
+
+    @sentOrders.setter
+    def sentOrders(self, value: int):
+        self.population.sentOrders[self.index] = value
+        self.population.markChanged(self.index)
+
+    @property
+    def canceledOrders(self) -> int:
+        return int(self.population.canceledOrders[self.index])
+
+    @canceledOrders.setter
+    def canceledOrders(self, value: int):
+        self.population.canceledOrders[self.index] = value
+        self.population.markChanged(self.index)
+
+    @property
+    def matchedOrders(self) -> int:
+        return int(self.population.matchedOrders[self.index])
+
+    @matchedOrders.setter
+    def matchedOrders(self, value: int):
+        self.population.matchedOrders[self.index] = value
+        self.population.markChanged(self.index)
+
+    # Called by the population's arrival process at each arrival belonging to this member
+    def inputOrders(self, timestamp: float):
+        self.population.inputOrders(self.index, timestamp)
+
+# A member's shares, used like an Agent's shares dictionary
+# Key: symbol (str), Value: amount (int)
+class PopulationShares:
+    def __init__(self, population: PopulationZI, index: int):
+        self.population: PopulationZI = population
+        self.index: int = index
+
+    def __getitem__(self, symbol: str) -> int:
+        return int(self.population.shares[self.index, self.population.symbols[symbol]])
+
+    def __setitem__(self, symbol: str, value: int):
+        self.population.shares[self.index, self.population.symbols[symbol]] = value
+        self.population.markChanged(self.index)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.population.symbols
+
+# The cash, shares and order counts of a list of agents, which are taken and restored like those of a population (see PopulationZI)
+class AgentAccounts:
+    def __init__(self, agents: list):
+        self.agents: list = agents
+
+    # Returns the agents' cash, shares of the symbol, and sent, matched and canceled order counts
+    def snapshot(self, symbol: str) -> tuple:
+        return (numpy.array([a.balance for a in self.agents], dtype=float), numpy.array([a.shares[symbol] for a in self.agents], dtype=numpy.int64),
+                numpy.array([a.sentOrders for a in self.agents], dtype=numpy.int64), numpy.array([a.matchedOrders for a in self.agents], dtype=numpy.int64),
+                numpy.array([a.canceledOrders for a in self.agents], dtype=numpy.int64))
+
+    def startingValues(self, symbol: str) -> list:
+        return [numpy.zeros(len(self.agents)) for i in range(5)]
+
+    # Snapshots of agents are complete, so they replace the values
+    def applySnapshot(self, values: list, snapshot: tuple):
+        for i in range(len(values)):
+            values[i] = snapshot[i]
 
 # A factor used by the Zero Intelligence algorithm
-# Args: max position, variation
+# Args: max position, variation, random stream to draw the values from
 class PrivateValue:
-    def __init__(self, m: int, var: float):
+    def __init__(self, m: int, var: float, random: RandomStream):
 
         # Maximum number of shares that can be owned (positive and negative)
         self.maxPos: int = m
@@ -361,16 +738,20 @@ class PrivateValue:
         self.values: list = list()
 
         for i in range(m * 2):
-            self.values.append(numpy.random.normal(0, var))
+            self.values.append(random.normal(0, var))
 
         numpy.sort(self.values)
         self.values.reverse()
     
     def getValue(self, pos: int, buy: bool):
+        return PrivateValue.lookup(self.values, self.maxPos, pos, buy)
+
+    # Looks up the value for a position in a list of private values; also used for the private value tables of populations
+    def lookup(values, maxPos: int, pos: int, buy: bool) -> float:
         if buy:
-            return self.values[max(pos + self.maxPos, 0)]
+            return float(values[max(pos + maxPos, 0)])
         else:
-            return self.values[min(pos + self.maxPos - 1, len(self.values) - 1)]
+            return float(values[min(pos + maxPos - 1, len(values) - 1)])
 
 # This class defines an algorithm that can be used by an agent 
 class Algorithm:
@@ -381,6 +762,27 @@ class Algorithm:
     def getOrders(self, symbol: str, timestamp: float):
         raise NotImplementedError
 
+    # Called with orders returned by getOrders which the agent did not send, as it could not afford them
+    # Algorithms which keep track of their orders forget these
+    def rejected(self, orders: list):
+        pass
+
+    # Used by algorithms which requote: returns the orders needed to replace the orders in oldOrders with those in newOrders.
+    # Each new order replaces one old order in a single message; extra new orders are sent as they are, and extra old orders are canceled.
+    def requote(self, oldOrders: list, newOrders: list, timestamp: float) -> list:
+        orders: list = list()
+
+        for i in range(len(newOrders)):
+            if i < len(oldOrders):
+                orders.append(self.agent.simulation.makeReplaceOrder(newOrders[i], oldOrders[i].orderID))
+            else:
+                orders.append(newOrders[i])
+
+        for i in range(len(newOrders), len(oldOrders)):
+            orders.append(self.agent.simulation.makeCancelOrder(self.agent, oldOrders[i].orderID, timestamp))
+
+        return orders
+
 # Algorithm which always sends out the same order
 # args = price: float, quantity: int, buy: bool
 class AlgorithmFixedPrice(Algorithm):
@@ -413,9 +815,9 @@ class AlgorithmRandomNormal(Algorithm):
     # returns a list of orders to place
     def getOrders(self, symbol: str, timestamp: float):
         price: float = self.agent.sharePrices[symbol]
-        buy: bool = random.randint(1, 2) == 1
-        quantity: int = random.randint(self.quantityMin, self.quantityMax)
-        order = Order(self.agent, buy, symbol, quantity, round(numpy.random.normal(price, self.spread * price), 2), timestamp)
+        buy: bool = self.agent.random.randint(1, 2) == 1
+        quantity: int = self.agent.random.randint(self.quantityMin, self.quantityMax)
+        order = Order(self.agent, buy, symbol, quantity, round(self.agent.random.normal(price, self.spread * price), 2), timestamp)
         return [order]
 
 # Algorithm which sends an order with price picked from log normal distribution around the last transaction price
@@ -437,9 +839,9 @@ class AlgorithmRandomLogNormal(Algorithm):
     # returns a list of orders to place
     def getOrders(self, symbol: str, timestamp: float):
         price: float = self.agent.sharePrices[symbol]
-        buy: bool = random.random() < self.buyChance
-        quantity: int = random.randint(self.quantityMin, self.quantityMax)
-        order = Order(self.agent, buy, symbol, quantity, round(price * numpy.random.lognormal(0, self.spread), 2), timestamp)
+        buy: bool = self.agent.random.random() < self.buyChance
+        quantity: int = self.agent.random.randint(self.quantityMin, self.quantityMax)
+        order = Order(self.agent, buy, symbol, quantity, round(price * self.agent.random.lognormal(0, self.spread), 2), timestamp)
         return [order]
 
 # Algorithm which sends an order with price picked from uniformly around the last transaction price
@@ -459,9 +861,9 @@ class AlgorithmRandomLinear(Algorithm):
     # returns a list of orders to place
     def getOrders(self, symbol: str, timestamp: float):
         price: float = self.agent.sharePrices[symbol]
-        buy: bool = random.randint(1, 2) == 1
-        quantity: int = random.randint(self.quantityMin, self.quantityMax)
-        order = Order(self.agent, buy, symbol, quantity, round(((random.random() * 2 - 1) * self.spread + 1) * price, 2), timestamp)
+        buy: bool = self.agent.random.randint(1, 2) == 1
+        quantity: int = self.agent.random.randint(self.quantityMin, self.quantityMax)
+        order = Order(self.agent, buy, symbol, quantity, round(((self.agent.random.random() * 2 - 1) * self.spread + 1) * price, 2), timestamp)
         return [order]
 
 # Algorithm which buys or sells when prices pass a certain threshold
@@ -492,7 +894,7 @@ class AlgorithmBuyLowSellHigh(Algorithm):
         else:
             return []
 
-        quantity: int = random.randint(self.quantityMin, self.quantityMax)
+        quantity: int = self.agent.random.randint(self.quantityMin, self.quantityMax)
         order = Order(self.agent, buy, symbol, quantity, round(price, 2), timestamp)
         return [order]
 
@@ -515,18 +917,14 @@ class AlgorithmMeanReversion(Algorithm):
     # returns a list of orders to place
     def getOrders(self, symbol: str, timestamp: float):
         price: float = self.agent.sharePrices[symbol]
-        
-        sum = 0
-        for price in self.agent.pastPrices:
-            sum += price
+        avg: float = self.agent.pastPrices.mean()
 
-        avg = sum / len(self.agent.pastPrices);
         if price <= avg + avg * self.threshold and price >= avg - avg * self.threshold:
             return []
         else:    
             buy = price < avg 
         
-        quantity: int = random.randint(self.quantityMin, self.quantityMax)
+        quantity: int = self.agent.random.randint(self.quantityMin, self.quantityMax)
         order = Order(self.agent, buy, symbol, quantity, round(price, 2), timestamp)
         return [order]
 
@@ -540,35 +938,40 @@ class AlgorithmZI(Algorithm):
         super().__init__(agent)
         self.offsetMin: float = args["offsetmin"]
         self.offsetMax: float = args["offsetmax"]
-        self.privateValue: PrivateValue = PrivateValue(args["positionmax"], args["variation"])
+        self.privateValue: PrivateValue = PrivateValue(args["positionmax"], args["variation"], agent.simulation.rng.stream("privatevalues", agent.name))
         self.orders = list()
 
     def getOrders(self, symbol: str, timestamp: float):
-        price: float = self.agent.simulation.fundamental.getValue(timestamp)
-        position: int = self.agent.shares[symbol]
+        order: Order = AlgorithmZI.makeOrder(self.agent, self.agent.random, symbol, timestamp, self.agent.shares[symbol], self.privateValue.values, self.privateValue.maxPos, self.offsetMin, self.offsetMax)
+
+        # The new order replaces the previous one
+        oldOrders: list = self.orders
+        self.orders = [order]
+        return self.requote(oldOrders, self.orders, timestamp)
+
+    def rejected(self, orders: list):
+        self.orders = [order for order in self.orders if all(order is not r for r in orders)]
+
+    # Creates the order a ZI agent with the given position and private values sends; shared with PopulationZI
+    def makeOrder(agent, random: RandomStream, symbol: str, timestamp: float, position: int, values, maxPos: int, offsetMin: float, offsetMax: float) -> Order:
+        price: float = agent.simulation.fundamental.getValue(timestamp)
 
         buy: bool = random.random() < 0.5
 
-        if position >= self.privateValue.maxPos - 1:
+        if position >= maxPos - 1:
             buy = False
-        elif position <= -self.privateValue.maxPos + 1:
+        elif position <= -maxPos + 1:
             buy = True
         
-        price += self.privateValue.getValue(position, buy)
+        price += PrivateValue.lookup(values, maxPos, position, buy)
 
         mul: int = 1
 
         if buy:
             mul = -1
 
-        cancelOrders = list()
-        for order in self.orders:
-            cancelOrders.append(self.agent.simulation.makeCancelOrder(self.agent, order.orderID, timestamp))
-
-        price += mul * random.random() * (self.offsetMax - self.offsetMin) + self.offsetMin
-        order: Order = Order(self.agent, buy, symbol, 1, round(price, 2), timestamp)
-        self.orders = [order]
-        return self.orders + cancelOrders
+        price += mul * random.random() * (offsetMax - offsetMin) + offsetMin
+        return Order(agent, buy, symbol, 1, round(price, 2), timestamp)
 
 # Market Maker based on as defined here: https://www.jair.org/index.php/jair/article/download/11075/26257
 # spread: float - minimum gap between simulation fundamental and order price sent
@@ -587,46 +990,41 @@ class AlgorithmFundamentalMM(Algorithm):
         #for now, assumes 0 latency
         book: OrderBook = self.agent.simulation.orderbooks[symbol]
 
-        hasBuy: bool = False
-        hasSell: bool = False
-
-        if len(book.buybook) > 0:
-            hasBuy = True
-            bestbuy = heapq.heappop(book.buybook)
-            heapq.heappush(book.buybook, bestbuy)
-
-        if len(book.sellbook) > 0:
-            hasSell = True
-            bestsell = heapq.heappop(book.sellbook)
-            heapq.heappush(book.sellbook, bestsell)
-
-        cancelOrders = list()
-        for order in self.orders:
-            cancelOrders.append(self.agent.simulation.makeCancelOrder(self.agent, order.orderID, timestamp))
+        bestBid: float = book.bestBid(timestamp)
+        bestAsk: float = book.bestAsk(timestamp)
 
+        oldOrders: list = self.orders
         self.orders = list()
         for i in range(self.tickCount):
             p: float = price + self.tickSpread * i + self.spread
             p2: float = price - self.tickSpread * i - self.spread
             #print(str(p) + " " + str(p2))
 
-            if not hasBuy or p < bestbuy[2].price:
+            if bestBid is None or p < bestBid:
                 #bprices.append(round(p, 2))
                 self.orders.append(Order(self.agent, True, symbol, 1, round(p, 2), timestamp))
 
-            if not hasSell or p2 > bestsell[2].price:
+            if bestAsk is None or p2 > bestAsk:
                 #sprices.append(round(p2, 2))
                 self.orders.append(Order(self.agent, False, symbol, 1, round(p2, 2), timestamp))
 
         #print(str(bprices) + " " + str(sprices))
-        return self.orders + cancelOrders
+        return self.requote(oldOrders, self.orders, timestamp)
+
+    def rejected(self, orders: list):
+        self.orders = [order for order in self.orders if all(order is not r for r in orders)]
 
 # Stale Quote Arbitrage agent - attempts to match with "good deal" (stale) orders which no longer reflect the current price
 # Arguments: threshold (float) - threshold difference between simulation fundamental and price to trigger an attempted match
+# timeinforce (str, optional, default "ioc") - time in force of the orders sent (see Order). With "ioc" or "fok", orders for quotes which are already gone never rest in the book.
 class AlgorithmStaleQuoteArbitrage(Algorithm):
     def __init__(self, agent: Agent, args: dict):
         super().__init__(agent)
         self.threshold: float = args["threshold"]
+        self.timeInForce: str = args.get("timeinforce", "ioc")
+
+        # Orders which never rest don't need to be tracked or canceled by the agent
+        agent.executionReports = self.timeInForce == "gtc"
         
     def getOrders(self, symbol: str, timestamp: float):
         orders = list()
@@ -634,18 +1032,18 @@ class AlgorithmStaleQuoteArbitrage(Algorithm):
         price = self.agent.simulation.fundamental.getValue(timestamp)
         
         for order in self.agent.lastBuyBook:
-            if price - order[2].price < self.threshold:
-                orders.append(order[2])
+            if price - order[3].price < self.threshold:
+                orders.append(order[3])
 
         for order in self.agent.lastSellBook:
-            if order[2].price - price < self.threshold:
-                orders.append(order[2])
+            if order[3].price - price < self.threshold:
+                orders.append(order[3])
         
         #print(str(len(self.agent.lastBuyBook) + len(self.agent.lastSellBook)) + " " + str(len(orders)))
 
         submitOrders = list()
         for order in orders:
-            submitOrders.append(Order(self.agent, not order.buy, order.symbol, order.amount, order.price, timestamp))
+            submitOrders.append(Order(self.agent, not order.buy, order.symbol, order.amount, order.price, timestamp, timeInForce=self.timeInForce))
 
         return submitOrders
 
@@ -665,12 +1063,18 @@ class AlgorithmSimpleMarketMaker(Algorithm):
 
     # returns a list of orders to place
     def getOrders(self, symbol: str, timestamp: float):
+        oldOrders = list()
         orders = list()
 
-        if self.lastBuy is not None and self.lastSell is not None:
-            orders.append(self.agent.simulation.makeCancelOrder(self.agent, self.lastBuy.orderID, timestamp))
-            orders.append(self.agent.simulation.makeCancelOrder(self.agent, self.lastSell.orderID, timestamp))
+        # Either quote can be missing, if it was not sent
+        for order in (self.lastBuy, self.lastSell):
+            if order is not None:
+                oldOrders.append(order)
         
+        # Old quotes which are not replaced are canceled
+        self.lastBuy = None
+        self.lastSell = None
+
         if symbol in self.agent.lastBuy and symbol in self.agent.lastSell:
             self.lastBuy = Order(self.agent, True, symbol, self.quantity, self.agent.lastBuy[symbol] + self.distance, timestamp)
             orders.append(self.lastBuy)
@@ -679,7 +1083,13 @@ class AlgorithmSimpleMarketMaker(Algorithm):
                 self.lastSell = Order(self.agent, False, symbol, self.quantity, self.agent.lastSell[symbol] - self.distance, timestamp)
                 orders.append(self.lastSell)
 
-        return orders
+        return self.requote(oldOrders, orders, timestamp)
+
+    def rejected(self, orders: list):
+        if any(order is self.lastBuy for order in orders):
+            self.lastBuy = None
+        if any(order is self.lastSell for order in orders):
+            self.lastSell = None
 
 # Market maker which shapes the price of the stock by sending many buy and sell orders around the desired price curve
 # Key frames are given and interpolated to produce the desired price curve
@@ -710,28 +1120,67 @@ class AlgorithmMarketMakerFixed(Algorithm):
             index = timestamp / self.priceInterval
             price = self.prices[int(index)] * (1 - (index % 1)) + self.prices[int(index + 1)] * (index % 1)
 
-        if self.lastBuy is not None and self.lastSell is not None:
-            orders.append(self.agent.simulation.makeCancelOrder(self.agent, self.lastBuy.orderID, timestamp))
-            orders.append(self.agent.simulation.makeCancelOrder(self.agent, self.lastSell.orderID, timestamp))
+        # Either quote can be missing, if it was not sent
+        oldOrders = list()
+        for order in (self.lastBuy, self.lastSell):
+            if order is not None:
+                oldOrders.append(order)
      
         self.lastBuy = Order(self.agent, True, symbol, self.quantity, price - self.spread / 2, timestamp)
-        orders.append(self.lastBuy)
-
         self.lastSell = Order(self.agent, False, symbol, self.quantity, price + self.spread / 2, timestamp)
-        orders.append(self.lastSell)
+        orders += self.requote(oldOrders, [self.lastBuy, self.lastSell], timestamp)
 
         orders.append(Order(self.agent, True, symbol, 1, price, timestamp))
         orders.append(Order(self.agent, False, symbol, 1, price, timestamp))
 
         return orders
 
+    def rejected(self, orders: list):
+        if any(order is self.lastBuy for order in orders):
+            self.lastBuy = None
+        if any(order is self.lastSell for order in orders):
+            self.lastSell = None
+
 # This class defines a latency distribution function that can be used by an agent
+# Latencies are sampled in blocks (see sampleBlock), as they are drawn once per agent for every trade
 class LatencyFunction:
     def __init__(self, agent: Agent):
         self.agent = agent
 
+        # The agent's random stream for latencies
+        self.random: RandomStream = agent.simulation.rng.stream("latency", agent.name)
+
+        # The current block of latencies and the position of the next one in it
+        self.samples: list = list()
+        self.sampleIndex: int = 0
+
+    # Parses the latency function of an agent (or population) from the agent's json dictionary, using its "latency" and "latencyargs" properties
+    def fromJson(j: dict, agent: Agent) -> 'LatencyFunction':
+        latency: LatencyFunction = None
+        lattype: str = j["latency"]
+        latargs: dict = j["latencyargs"]
+
+        if lattype == "linear":
+            latency = LatencyFunctionLinear(agent, latargs)
+        elif lattype == "normal":
+            latency = LatencyFunctionNormal(agent, latargs)
+        elif lattype == "empirical":
+            latency = LatencyFunctionEmpirical(agent, latargs)
+
+        return latency
+
     # returns a latency value
     def getLatency(self) -> float:
+        if self.sampleIndex == len(self.samples):
+            self.samples = self.sampleBlock(self.random.blockSize).tolist()
+            self.sampleIndex = 0
+
+        latency: float = self.samples[self.sampleIndex]
+        self.sampleIndex += 1
+        return latency
+
+    # returns an array of the given number of latency values, drawn from the latency random stream
+    def sampleBlock(self, count: int) -> numpy.ndarray:
         raise NotImplementedError
 
 # Linear latency function: latency is linearly between min and max parameters
@@ -742,8 +1191,8 @@ class LatencyFunctionLinear(LatencyFunction):
         self.minLatency = args["min"]
         self.maxLatency = args["max"]
 
-    def getLatency(self) -> float:
-        return random.random() * (self.maxLatency - self.minLatency) + self.minLatency
+    def sampleBlock(self, count: int) -> numpy.ndarray:
+        return self.random.generator.uniform(self.minLatency, self.maxLatency, count)
 
 # Normal distribution latency function: latency follows a normal distribution with given mean and deviation
 # args = mean: float, deviation: float
@@ -753,5 +1202,85 @@ class LatencyFunctionNormal(LatencyFunction):
         self.meanLatency = args["mean"]
         self.latencyDeviation = args["deviation"]
 
-    def getLatency(self) -> float:
-        return max(0, numpy.random.normal(self.meanLatency, self.latencyDeviation))
+    def sampleBlock(self, count: int) -> numpy.ndarray:
+        return numpy.maximum(0, self.random.generator.normal(self.meanLatency, self.latencyDeviation, count))
+
+# Empirical latency function: latency follows measured latencies, loaded from a file and sampled with the alias method
+# The file is either a sample file, with one measured latency per line, or a histogram, with a latency and its count per line ("latency,count")
+# Lines starting with "#" are ignored. Relative paths are relative to the simulation's config file.
+# args = samples: str or histogram: str - path of the file, binwidth: float (optional) - width of the histogram bins;
+# if set, latencies are spread uniformly over [latency, latency + binwidth) instead of being exactly the listed values
+class LatencyFunctionEmpirical(LatencyFunction):
+    # Alias tables of files already loaded, as agents of the same group all use the same file
+    # Keyed by the file's size and modification time too, so a file changed since it was loaded is loaded again
+    # Key: (path, histogram, size, modification time) (tuple), Value: (values, probabilities, aliases) (tuple)
+    tables: dict = dict()
+
+    def __init__(self, agent: Agent, args: dict):
+        super().__init__(agent)
+        self.binWidth: float = args.get("binwidth", 0)
+
+        histogram: bool = "histogram" in args
+        path: str = os.path.join(agent.simulation.folder, args["histogram"] if histogram else args["samples"])
+
+        stat = os.stat(path)
+        key: tuple = (path, histogram, stat.st_size, stat.st_mtime_ns)
+
+        if not (key in LatencyFunctionEmpirical.tables):
+            LatencyFunctionEmpirical.tables[key] = LatencyFunctionEmpirical.loadTable(path, histogram)
+
+        (self.values, self.probabilities, self.aliases) = LatencyFunctionEmpirical.tables[key]
+
+    # Reads a sample or histogram file, and builds its alias table
+    def loadTable(path: str, histogram: bool) -> tuple:
+        if histogram:
+            data: numpy.ndarray = numpy.loadtxt(path, delimiter=",", ndmin=2)
+            values: numpy.ndarray = data[:, 0]
+            weights: numpy.ndarray = data[:, 1]
+        else:
+            values = numpy.loadtxt(path, delimiter=",", ndmin=1)
+            weights = numpy.ones(len(values))
+
+        if len(values) == 0 or weights.sum() <= 0:
+            raise Exception("No latencies in " + path)
+
+        (probabilities, aliases) = LatencyFunctionEmpirical.buildAliasTable(weights)
+        return (values, probabilities, aliases)
+
+    # Builds the table of Vose's alias method for the given weights: each entry i is picked with its probability, and otherwise its alias is picked
+    # Sampling then takes a constant time per value, regardless of the number of entries
+    def buildAliasTable(weights: numpy.ndarray) -> tuple:
+        n: int = len(weights)
+        scaled: list = (weights * n / weights.sum()).tolist()
+        probabilities: numpy.ndarray = numpy.ones(n)
+        aliases: numpy.ndarray = numpy.arange(n)
+
+        small: list = [i for i in range(n) if scaled[i] < 1]
+        large: list = [i for i in range(n) if scaled[i] >= 1]
+
+        while len(small) > 0 and len(large) > 0:
+            s: int = small.pop()
+            l: int = large.pop()
+
+            probabilities[s] = scaled[s]
+            aliases[s] = l
+            scaled[l] -= 1 - scaled[s]
+
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # Entries left over only differ from 1 by rounding errors, so they keep probability 1
+        return (probabilities, aliases)
+
+    def sampleBlock(self, count: int) -> numpy.ndarray:
+        generator: numpy.random.Generator = self.random.generator
+        entries: numpy.ndarray = generator.integers(0, len(self.values), count)
+        entries = numpy.where(generator.random(count) < self.probabilities[entries], entries, self.aliases[entries])
+        latencies: numpy.ndarray = self.values[entries]
+
+        if self.binWidth > 0:
+            latencies = latencies + generator.random(count) * self.binWidth
+
+        return latencies
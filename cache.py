@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# Keys of config values which are paths of input files, like the measured latencies of LatencyFunctionEmpirical
+# Output files, like the config's "tapefile", are left out, as what the simulation writes to them doesn't change its results
+inputFileKeys: tuple = ("samples", "histogram")
+
+# Returns the paths of the input files a config refers to (see inputFileKeys), relative to the config's folder
+def inputFiles(j) -> list:
+    files: list = list()
+
+    if isinstance(j, dict):
+        for k in j:
+            if k in inputFileKeys and isinstance(j[k], str):
+                files.append(j[k])
+            else:
+                files += inputFiles(j[k])
+    elif isinstance(j, list):
+        for v in j:
+            files += inputFiles(v)
+
+    return files
+
+# Returns a hash of a simulation config file's contents, and of the contents of the input files it refers to.
+# Formatting and the order of keys don't change the hash.
+def configHash(file: str) -> str:
+    with open(file) as f:
+        j = json.loads(f.read())
+
+    digest = hashlib.sha256(json.dumps(j, sort_keys=True, separators=(",", ":")).encode())
+
+    for path in sorted(set(inputFiles(j))):
+        digest.update(b"\0" + path.encode() + b"\0")
+
+        with open(os.path.join(os.path.dirname(file), path), "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+
+    return digest.hexdigest()
+
+# Returns the seed of a replication of a config, so a replication always produces the same results
+def runSeed(hash: str, index: int) -> int:
+    return int(hashlib.sha256((hash + ":" + str(index)).encode()).hexdigest()[:16], 16)
+
+# A cache of simulation results on disk, so replications which have already been run don't need to be run again.
+# Each replication is stored in its own folder, named by a key made from the config's hash, the replication index and the simulator version.
+# When the cache grows beyond maxSize bytes, the least recently used replications are removed.
+class ResultCache:
+    def __init__(self, folder: str = "cache", maxSize: int = 10 * 1024 ** 3):
+        self.folder: str = folder
+        self.maxSize: int = maxSize
+        os.makedirs(folder, exist_ok=True)
+
+    # Returns the key of a replication, given its config's hash and its index
+    def key(self, hash: str, index: int, version: str) -> str:
+        return hashlib.sha256((hash + ":" + str(index) + ":" + version).encode()).hexdigest()
+
+    # Returns the folder with the cached files of a replication, or None if it is not cached
+    def get(self, key: str) -> str:
+        path: str = os.path.join(self.folder, key)
+
+        if not os.path.isdir(path):
+            return None
+
+        # The folder's modification time marks when it was last used
+        now: float = time.time()
+        os.utime(path, (now, now))
+        return path
+
+    # Stores files of a replication in the cache, given as a dictionary of names in the cache to paths of the files
+    # Returns the replication's folder
+    def put(self, key: str, files: dict) -> str:
+        path: str = os.path.join(self.folder, key)
+
+        # Files are first copied to a temporary folder which is then renamed, so other processes never see a partly written replication
+        staging: str = tempfile.mkdtemp(dir=self.folder, prefix=".staging-")
+
+        for name in files:
+            shutil.copyfile(files[name], os.path.join(staging, name))
+
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another process stored the same replication first
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+        return path
+
+    # Adds a file to a cached replication, like metrics computed from its other files
+    def add(self, key: str, name: str, file: str):
+        shutil.copyfile(file, os.path.join(self.folder, key, name))
+
+    # Removes the least recently used replications until the cache is no larger than maxSize
+    def evict(self):
+        entries: list = list()
+        total: int = 0
+
+        for key in os.listdir(self.folder):
+            path: str = os.path.join(self.folder, key)
+
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+
+            size: int = 0
+
+            for name in os.listdir(path):
+                size += os.path.getsize(os.path.join(path, name))
+
+            entries.append((os.path.getmtime(path), size, path))
+            total += size
+
+        entries.sort()
+
+        for (used, size, path) in entries:
+            if total <= self.maxSize:
+                break
+
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
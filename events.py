@@ -1,7 +1,5 @@
 import heapq
-from order import *
-from orderbook import *
-from agents import *
+import bisect
 
 # Events are what make keep the simulation running
 # They account for the "latency" part of the simulation
@@ -45,18 +43,59 @@ class EventOrder(Event):
         self.orderBook = orderBook
         self.order.receiveTimestamp = time
         self.order.processTimestamp = time
+        self.orderBook.expectOrder(order)
 
     def run(self):
         if self.time - self.orderBook.lastOrderTime >= 1:
-            self.orderBook.lastOrderTime = self.time
-            self.orderBook.input(self.order)
+            self.orderBook.lastOrderTime = self.time + self.getSlots() - 1
+            self.process()
         else:
             self.orderBook.simulation.pushEvent(EventOrderQueued(self.orderBook.lastOrderTime + 1, self))
-            self.orderBook.lastOrderTime += 1
+            self.orderBook.lastOrderTime += self.getSlots()
+
+    # Number of time units the matching engine is busy processing this event
+    def getSlots(self) -> int:
+        return 1
+
+    # Sets the time at which the matching engine gets to this event
+    def setProcessTimestamp(self, time: float):
+        self.order.processTimestamp = time
+
+    # Hands the order to the matching engine
+    def process(self):
+        self.orderBook.input(self.order)
 
     def toString(self):
         return "Order event: time = " + str(self.time) + " from " + self.order.agent.name + "; id " + str(self.order.orderID)
 
+# An event representing a batch of orders (including cancel and replace orders) sent as one message. Sent by agents and processed by the matching engine.
+# The orders are processed one after another. Depending on the simulation's batch cost, the batch takes up the matching engine
+# for one time unit ("batch") or for one time unit per order ("order").
+class EventOrderBatch(EventOrder):
+    def __init__(self, time: float, orders: list, orderBook: 'OrderBook'):
+        super().__init__(time, orders[0], orderBook)
+        self.orders = orders
+
+        for order in orders:
+            order.receiveTimestamp = time
+            order.processTimestamp = time
+            self.orderBook.expectOrder(order)
+
+    def getSlots(self) -> int:
+        if self.orderBook.simulation.batchCost == "order":
+            return len(self.orders)
+        return 1
+
+    def setProcessTimestamp(self, time: float):
+        for order in self.orders:
+            order.processTimestamp = time
+
+    def process(self):
+        self.orderBook.inputBatch(self.orders)
+
+    def toString(self):
+        return "Order batch event: time = " + str(self.time) + " from " + self.order.agent.name + "; " + str(len(self.orders)) + " orders"
+
 # An event signaling that an order cannot be processed directly (the matching engine only processes one order every time unit).
 # The order is placed into a queue where it waits its turn to be processed by the matching engine after other orders are processed.
 # Sent by the matching engine and processed by the matching engine.
@@ -64,17 +103,17 @@ class EventOrderQueued(Event):
     def __init__(self, time: float, event: EventOrder):
         super().__init__(time)
         self.event = event
-        self.event.order.processTimestamp = time
+        self.event.setProcessTimestamp(time)
 
     def run(self):
-        self.event.orderBook.input(self.event.order)
+        self.event.process()
 
     def toString(self):
-        return "Order queued event: time = " + str(self.time) + " from " + self.order.agent.name + "; id " + str(self.order.orderID)
+        return "Order queued event: time = " + str(self.time) + " from " + self.event.order.agent.name + "; id " + str(self.event.order.orderID)
 
 # An event with data from a completed trade. One EventMarketData is produced and sent to each agent for each trade.
 # This is because each agent has a different latency and will receive news of the trade at a different time.
-# Will be sent with an empty trade if there is no market activity, because some agents rely on this event to trigger sending orders.
+# Will be sent with an empty trade if there is no market activity (a heartbeat) to agents which want one, because some agents rely on this event to trigger sending orders.
 class EventMarketData(Event):
     def __init__(self, time: float, trade: 'Trade', target: 'Agent'):
         super().__init__(time)
@@ -90,6 +129,34 @@ class EventMarketData(Event):
         else:
             return "Market data event: time = " + str(self.time) + " for " + self.target.name
 
+# An event with data from all trades produced by one batch of orders, sent to one agent as a single message.
+class EventMarketDataBatch(Event):
+    def __init__(self, time: float, trades: list, target: 'Agent'):
+        super().__init__(time)
+        self.trades = trades
+        self.target = target
+
+    def run(self):
+        for trade in self.trades:
+            self.target.inputData(trade, self.time)
+
+    def toString(self):
+        return "Market data batch event: time = " + str(self.time) + " for " + self.target.name + "; " + str(len(self.trades)) + " trades"
+
+# An event with an execution report (fill, partial fill or cancel confirmation) for one of the target agent's orders.
+# Sent by the matching engine, only to agents which want execution reports, and arrives after the agent's latency.
+class EventExecutionReport(Event):
+    def __init__(self, time: float, report: 'ExecutionReport', target: 'Agent'):
+        super().__init__(time)
+        self.report = report
+        self.target = target
+
+    def run(self):
+        self.target.inputExecutionReport(self.report, self.time)
+
+    def toString(self):
+        return "Execution report event: time = " + str(self.time) + " for " + self.target.name + "; " + self.report.type + " id " + str(self.report.order.orderID)
+
 # An event sent by the Stale Quote Arbitrage agent to request the current state of the order book.
 # Amount specifies how many orders on each side of the book to send.
 # When received by the matching engine, produces an EventSendOrderbook that's sent to the agent that requested it.
@@ -101,40 +168,43 @@ class EventRequestOrderbook(Event):
         self.amount = amount
 
     def run(self):
-        self.agent.simulation.pushEvent(EventSendOrderbook(self.time + self.agent.latencyFunction.getLatency(), self.agent, self.symbol, self.amount))
+        self.agent.simulation.pushEvent(EventSendOrderbook(self.time + self.agent.latencyFunction.getLatency(), self.agent, self.symbol, self.amount, self.time))
 
 # The event the matching engine sends to an agent that requested the order book, with data of the orders in the book.
+# The data is taken when the request is processed (at requestTime), and arrives at the agent later, at the event's time.
 class EventSendOrderbook(Event):
-    def __init__(self, time: float, agent: 'Agent', symbol: str, amount: int):
+    def __init__(self, time: float, agent: 'Agent', symbol: str, amount: int, requestTime: float):
         self.agent = agent
         self.time = time
         self.symbol = symbol
         self.amount = amount
-        self.lastBuyBook = list()
-        self.lastSellBook = list()
 
+        # Orders expired by the time of the request are left out, without removing them from the book
         book = self.agent.simulation.orderbooks[self.symbol] 
-        bb = list()
-        sb = list()
+        self.lastBuyBook = book.getTopOrders(True, amount, requestTime)
+        self.lastSellBook = book.getTopOrders(False, amount, requestTime)
 
-        for i in range(amount):
-            if len(book.buybook) > 0:
-                bb.append(heapq.heappop(book.buybook))
-            
-            if len(book.sellbook) > 0:
-                sb.append(heapq.heappop(book.sellbook))
+    def run(self):
+        self.agent.inputOrderBooks(self.time, self.lastBuyBook, self.lastSellBook)
 
-        for o in bb:
-            heapq.heappush(book.buybook, o)
-            
-        for o in sb:
-            heapq.heappush(book.sellbook, o)
+# A periodic timer event which sends a heartbeat to the agents that want one, if there were no trades since the last heartbeat.
+# Reschedules itself every heartbeat interval.
+class EventHeartbeat(Event):
+    def __init__(self, time: float, simulation: 'Simulation', tradesCount: int):
+        super().__init__(time)
+        self.simulation = simulation
 
-        self.lastBuyBook = bb
-        self.lastSellBook = sb
+        # Number of trades in the simulation when the previous heartbeat ran
+        self.tradesCount = tradesCount
 
     def run(self):
-        self.agent.inputOrderBooks(self.time, self.lastBuyBook, self.lastSellBook)
+        if self.simulation.tradesCount == self.tradesCount:
+            self.simulation.sendHeartbeat(self.time)
+
+        self.simulation.pushEvent(EventHeartbeat(self.time + self.simulation.heartbeatInterval, self.simulation, self.simulation.tradesCount))
+
+    def toString(self):
+        return "Heartbeat event: time = " + str(self.time)
 
 # An event sent by an agent that is processed by that same agent.
 # This is used to schedule an agent to periodically "wake up" and send orders every certain repeating time interval.
@@ -146,6 +216,116 @@ class EventScheduleAgent(Event):
     def run(self):
         self.agent.inputOrders(self.time)
 
+# A timer event which wakes up all agents registered with the timer wheel that are due at this time.
+class EventTimerTick(Event):
+    def __init__(self, time: float, wheel: 'TimerWheel'):
+        super().__init__(time)
+        self.wheel = wheel
+
+    def run(self):
+        self.wheel.tick(self.time)
+
+    def toString(self):
+        return "Timer tick event: time = " + str(self.time)
+
+# Schedules agents which wake up periodically, every certain repeating time interval.
+# Agents due at the same time share one slot, and each slot has a single EventTimerTick in the event queue,
+# so agents with the same interval (or intervals which line up) cost one event per tick instead of one event per agent.
+# An agent's k-th wake up is at start + k * interval, rounded to timeDigits decimal places, rather than adding the interval up again and again,
+# so floating point errors don't build up, and agents due at the same time always land in the same slot.
+class TimerWheel:
+    timeDigits: int = 9
+
+    def __init__(self, simulation: 'Simulation'):
+        self.simulation = simulation
+
+        # Key: time (float), Value: list of tuples with agent, its interval (float), its start time (float) and the number of its next wake up (int),
+        # in the order they were registered
+        self.slots: dict = dict()
+
+        # Time each registered agent is due at next, Key: Agent, Value: time (float)
+        self.nextTimes: dict = dict()
+
+    # Registers an agent to have inputOrders() called every interval, starting at the given time
+    def register(self, agent: 'Agent', interval: float, start: float):
+        self._schedule(agent, interval, start, 0)
+
+    # Stops waking up an agent. Its slot's tick event stays in the event queue, and does nothing if the slot is left empty.
+    def unregister(self, agent: 'Agent'):
+        time: float = self.nextTimes.pop(agent, None)
+
+        if time is None:
+            return
+
+        slot: list = [entry for entry in self.slots[time] if entry[0] is not agent]
+
+        if len(slot) > 0:
+            self.slots[time] = slot
+        else:
+            del self.slots[time]
+
+    def _schedule(self, agent: 'Agent', interval: float, start: float, count: int):
+        time: float = round(start + count * interval, TimerWheel.timeDigits)
+        self.nextTimes[agent] = time
+
+        if time in self.slots:
+            self.slots[time].append((agent, interval, start, count))
+        else:
+            self.slots[time] = [(agent, interval, start, count)]
+            self.simulation.pushEvent(EventTimerTick(time, self))
+
+    # Wakes up all agents due at the given time, after scheduling their next wake up
+    def tick(self, time: float):
+        due: list = self.slots.pop(time, [])
+
+        for agent, interval, start, count in due:
+            self._schedule(agent, interval, start, count + 1)
+
+        for agent, interval, start, count in due:
+            agent.inputOrders(time)
+
+# An event for the next arrival of a Poisson arrival process. Wakes up one agent of the process's group.
+class EventPoissonArrival(Event):
+    def __init__(self, time: float, arrivals: 'PoissonArrivals'):
+        super().__init__(time)
+        self.arrivals = arrivals
+
+    def run(self):
+        self.arrivals.arrive(self.time)
+
+    def toString(self):
+        return "Poisson arrival event: time = " + str(self.time)
+
+# Merged arrival process for a group of Poisson agents.
+# Superposing the agents' independent Poisson processes gives one Poisson process at the summed rate, where each arrival
+# belongs to an agent picked with probability proportional to its rate (uniformly, when all rates are the same).
+# This is statistically the same as scheduling each agent on its own, but needs a single pending event for the whole group.
+# Arrival times and agents are drawn from the given random stream
+class PoissonArrivals:
+    def __init__(self, simulation: 'Simulation', agents: list, random: 'RandomStream'):
+        self.simulation = simulation
+        self.agents: list = agents
+        self.random: 'RandomStream' = random
+
+        # Running totals of the agents' rates, used to pick the agent for each arrival
+        self.cumulativeRates: list = list()
+        self.rate: float = 0
+
+        for agent in agents:
+            self.rate += agent.rate
+            self.cumulativeRates.append(self.rate)
+
+    # Schedules the first arrival
+    def start(self):
+        self.simulation.pushEvent(EventPoissonArrival(self.random.exponential(1 / self.rate), self))
+
+    # Schedules the next arrival, then has the agent this arrival belongs to send orders
+    def arrive(self, time: float):
+        self.simulation.pushEvent(EventPoissonArrival(self.random.exponential(1 / self.rate) + time, self))
+
+        index: int = bisect.bisect_right(self.cumulativeRates, self.random.random() * self.rate)
+        self.agents[min(index, len(self.agents) - 1)].inputOrders(time)
+
 # A queue of events that a simulation has. Events are sorted by timestamp as they arrive on the queue.
 # The event with the smallest time stamp is executed always.
 class EventQueue:
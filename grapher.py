@@ -1,17 +1,27 @@
 import pandas as pd
 import matplotlib.pyplot as plotter
 import numpy as np
+import json
 import multiprocessing
+import os
+import plotting
 
 # Class that graphs metrics of a set of simulations run with the same setup, as it progresses over time
 # Args: directory, number of simulations, sample time interval, list of tuples specifying bounds for certain graphs (metric: str, min: float, max: float) - leave empty to auto scale
+# Optionally, the columns to load (all of them by default), and the number of rows of an output file read at once
+# Resampled runs are cached next to the output files (see loadRun), unless cache is False
+# Lines with more points than plotting.pointBudget are downsampled when plotted (see plotting.downsample)
+# In streaming mode, runs are resampled by worker processes and added to a StreamingAggregator one at a time, instead of being kept in memory,
+# so memory doesn't grow with the number of runs. Percentiles are then estimated, and graphAll is not available.
 class Grapher:
-    def __init__(self, dir: str, amount: int, interval: float, limits: list):
+    def __init__(self, dir: str, amount: int, interval: float, limits: list, streaming: bool = False, columns: list = None, chunkSize: int = 10000, cache: bool = True):
         self.dir: str = dir
         self.amount: int = amount
         self.data = list()
         self.rows = 0
         self.interval = interval
+        self.columns: list = list()
+        self.aggregator: StreamingAggregator = None
         
         self.lowerlimits = dict()
         self.upperlimits = dict()
@@ -19,29 +29,20 @@ class Grapher:
         for l in limits:
             self.addLimits(l[0], l[1], l[2])
 
-        for i in range(amount):
-            df = pd.read_csv(dir + str(i) + ".csv")
+        # Runs are read and resampled by worker processes, one chunk of rows at a time
+        with multiprocessing.Pool() as pool:
+            for (names, values) in pool.imap(loadRun, [(dir + str(i) + ".csv", interval, columns, chunkSize, cache) for i in range(amount)]):
+                self.columns = names[1:]
 
-            indexes = list()
-            i = 0
-            last = 0
+                if streaming:
+                    if self.aggregator is None:
+                        self.rows = len(values)
+                        self.aggregator = StreamingAggregator(self.rows, len(self.columns))
 
-            for col in df["Timestamp"]:
-                if i > 0:
-                    dif = int(col / interval) - int(last / interval)
-                    for j in range(dif):
-                        indexes.append(i - 1)
-                
-                last = col
-
-                i += 1
-
-            self.rows = max(self.rows, len(indexes))
-
-            df2 = df.iloc[indexes]
-            df2.reset_index()
-            self.data.append(df2)
-            del df
+                    self.aggregator.add(values[:, 1:])
+                else:
+                    self.rows = max(self.rows, len(values))
+                    self.data.append(pd.DataFrame(values, columns=names))
 
     # Sets bounds for a specific graph. Useful when comparing multiple graphs, so they all have the same scale.
     def addLimits(self, property: str, lower: float, upper: float):
@@ -50,6 +51,9 @@ class Grapher:
 
     # Graph all runs on one plot
     def graphAll(self, property: str):
+        if self.aggregator is not None:
+            raise Exception("Runs are not kept in streaming mode")
+
         plotter.figure()
         plotter.xlabel("Time")
         plotter.ylabel(property)
@@ -57,7 +61,7 @@ class Grapher:
     
         i: int = 0
         for dataFrame in self.data:
-            plotter.plot(np.array(dataFrame.loc[:, "Timestamp"]), np.array(dataFrame.loc[:, property]), color=colors[(i * 11) % 100])
+            plotting.plotLine(np.array(dataFrame.loc[:, "Timestamp"]), np.array(dataFrame.loc[:, property]), color=colors[(i * 11) % 100])
             i += 1
 
     # Graph a summary of all the runs on one plot, with lines for 5th & 95th percentile, and median
@@ -78,6 +82,14 @@ class Grapher:
         p5 = list()
         p95 = list() 
 
+        if self.aggregator is not None:
+            column: int = self.columns.index(property)
+            timestamps = [j * interval for j in range(self.rows)]
+            plotting.plotLine(timestamps, self.aggregator.quantile(0.5)[:, column], color1)
+            plotting.plotLine(timestamps, self.aggregator.quantile(0.05)[:, column], color2)
+            plotting.plotLine(timestamps, self.aggregator.quantile(0.95)[:, column], color2)
+            return
+
         p5i: tuple = self.getInterpolationNums(self.amount, 0.05)
         p95i: tuple = self.getInterpolationNums(self.amount, 0.95)
         medi: tuple = self.getInterpolationNums(self.amount, 0.505)
@@ -102,25 +114,24 @@ class Grapher:
             p95.append(sorted[p95i[0]] * p95i[1] + sorted[p95i[2]] * p95i[3])
             timestamps.append(time)
         
-        plotter.plot(timestamps, medians, color1)
-        plotter.plot(timestamps, p5, color2)
-        plotter.plot(timestamps, p95, color2)
+        plotting.plotLine(timestamps, medians, color1)
+        plotting.plotLine(timestamps, p5, color2)
+        plotting.plotLine(timestamps, p95, color2)
 
     # Saves summary graphs to files
     def saveAllAvg(self):
         groups = dict()
-        for key in self.data[0].keys():
-            if key != "Timestamp":
-                if "/" in key:
-                    first = key.split("/")[0]
-
-                    if not(first in groups):
-                        groups[first] = list()
-                    
-                    groups[first].append(key)
-                else:
-                    p = multiprocessing.Process(target=self.graphAndSaveOne, args=(key, self.interval,))
-                    p.start()
+        for key in self.columns:
+            if "/" in key:
+                first = key.split("/")[0]
+
+                if not(first in groups):
+                    groups[first] = list()
+                
+                groups[first].append(key)
+            else:
+                p = multiprocessing.Process(target=self.graphAndSaveOne, args=(key, self.interval,))
+                p.start()
 
         for key in groups:
             p = multiprocessing.Process(target=self.graphAndSaveGroup, args=(key, self.interval, groups[key]))
@@ -170,6 +181,184 @@ class Grapher:
         greaternumfrac = 1 - numfrac
         return (numi - 1, numfrac, greaternumi - 1, greaternumfrac)
 
+# Reads a run's output file, and resamples it to one row per interval like Grapher does
+# The file is read in chunks of rows, each resampled before the next is read, so only the resampled run needs to fit in memory
+# Takes a (file, interval, columns, chunk size) tuple, so it can be used with Pool.imap(); columns is None to read all of them
+# Returns the names of the columns (starting with the timestamp), and an array with one row per interval
+def resampleRun(args: tuple) -> tuple:
+    (file, interval, columns, chunkSize) = args
+
+    if columns is None:
+        columns = list(pd.read_csv(file, nrows=0).columns)
+    columns = ["Timestamp"] + [c for c in columns if c != "Timestamp"]
+
+    resampled: list = list()
+
+    # The last row of the previous chunk, and its interval, as an interval gets the last row before the next interval starts
+    lastRow: np.ndarray = None
+    lastCell: np.ndarray = None
+
+    for df in pd.read_csv(file, usecols=columns, chunksize=chunkSize):
+        cells: np.ndarray = (df["Timestamp"].to_numpy() // interval).astype(np.int64)
+        values: np.ndarray = df[columns].to_numpy(dtype=float)
+
+        if lastRow is not None:
+            cells = np.concatenate((lastCell, cells))
+            values = np.concatenate((lastRow, values))
+
+        # Each interval gets the last row before the interval ends
+        rows: np.ndarray = np.searchsorted(cells, np.arange(cells[0], cells[-1]), side="right") - 1
+        resampled.append(values[rows])
+
+        lastRow = values[-1:]
+        lastCell = cells[-1:]
+
+    return (columns, np.concatenate(resampled))
+
+# Returns a run's output file resampled like resampleRun() does, from a cache of the resampled run when possible
+# The cache is kept next to the output file, as an .npy file with the resampled columns one after another, and a .json file with its column names
+# and the key it was made with: the output file's size and modification time, and the interval. It is made again when the key changes.
+# Only the requested columns are resampled and cached. When columns are requested which the cache does not have, it is made again with
+# the columns it had and the requested ones, so alternating between sets of columns does not resample every time.
+# The cache is memory-mapped, so only the requested columns are read.
+# Takes a (file, interval, columns, chunk size, use cache) tuple, so it can be used with Pool.imap()
+def loadRun(args: tuple) -> tuple:
+    (file, interval, columns, chunkSize, cache) = args
+
+    if not cache:
+        return resampleRun((file, interval, columns, chunkSize))
+
+    if columns is None:
+        columns = list(pd.read_csv(file, nrows=0).columns)
+    columns = ["Timestamp"] + [c for c in columns if c != "Timestamp"]
+
+    path: str = file + "." + str(interval)
+    stat = os.stat(file)
+    key: dict = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "interval": interval}
+    names: list = list()
+
+    try:
+        with open(path + ".json") as f:
+            j = json.loads(f.read())
+
+        if all(j[k] == key[k] for k in key):
+            names = j["columns"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if any(c not in names for c in columns):
+        (names, values) = resampleRun((file, interval, names + [c for c in columns if c not in names], chunkSize))
+        np.save(path + ".npy", np.ascontiguousarray(values.T))
+
+        # Written last, so a partly written cache is never used
+        key["columns"] = names
+
+        with open(path + ".json", "w") as f:
+            f.write(json.dumps(key))
+
+    stored: np.ndarray = np.load(path + ".npy", mmap_mode="r")
+    return (columns, stored[[names.index(c) for c in columns]].T)
+
+# Aggregates runs resampled to the same time grid (rows x columns arrays), one run at a time, keeping only running statistics:
+# the mean and variance of each cell, and its quantiles estimated with the P-squared algorithm (Jain & Chlamtac, 1985).
+# Memory only depends on the grid size and the number of quantiles, not on the number of runs.
+# Runs shorter than the grid are extended with their last row, and longer ones are cut.
+class StreamingAggregator:
+    def __init__(self, rows: int, columns: int, quantiles: tuple = (0.05, 0.5, 0.95)):
+        self.rows: int = rows
+        self.columns: int = columns
+        self.count: int = 0
+
+        self.average: np.ndarray = np.zeros((rows, columns))
+        # Sum of squared differences from the average
+        self.squares: np.ndarray = np.zeros((rows, columns))
+
+        # Per quantile: the heights and positions of the 5 markers of each cell, and the desired positions of the markers (the same for all cells)
+        # Until there are 5 runs, the heights are just the runs' values
+        self.quantiles: dict = dict()
+
+        for q in quantiles:
+            self.quantiles[q] = (np.zeros((rows, columns, 5)), np.tile(np.arange(1.0, 6.0), (rows, columns, 1)), np.array([1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5.0]))
+
+    # Adds a run
+    def add(self, values: np.ndarray):
+        if len(values) < self.rows:
+            values = np.concatenate((values, np.repeat(values[-1:], self.rows - len(values), axis=0)))
+
+        values = values[:self.rows]
+        self.count += 1
+
+        delta: np.ndarray = values - self.average
+        self.average += delta / self.count
+        self.squares += delta * (values - self.average)
+
+        for q in self.quantiles:
+            (heights, positions, desired) = self.quantiles[q]
+
+            if self.count <= 5:
+                heights[:, :, self.count - 1] = values
+
+                if self.count == 5:
+                    heights.sort(axis=2)
+                continue
+
+            self.updateMarkers(values, heights, positions)
+            desired += (0, q / 2, q, (1 + q) / 2, 1)
+            self.adjustMarkers(heights, positions, desired)
+
+    # Moves the markers above the new value up by one position, and the outer markers to include the value
+    def updateMarkers(self, values: np.ndarray, heights: np.ndarray, positions: np.ndarray):
+        np.minimum(heights[:, :, 0], values, out=heights[:, :, 0])
+        np.maximum(heights[:, :, 4], values, out=heights[:, :, 4])
+
+        # Number of middle markers the value is at or above, which is the last marker not moved
+        below: np.ndarray = (values[:, :, None] >= heights[:, :, 1:4]).sum(axis=2)
+        positions += np.arange(5) > below[:, :, None]
+
+    # Moves the middle markers towards their desired positions, adjusting their heights with piecewise parabolic interpolation
+    def adjustMarkers(self, heights: np.ndarray, positions: np.ndarray, desired: np.ndarray):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(1, 4):
+                d: np.ndarray = desired[i] - positions[:, :, i]
+                move: np.ndarray = ((d >= 1) & (positions[:, :, i + 1] - positions[:, :, i] > 1)) | ((d <= -1) & (positions[:, :, i - 1] - positions[:, :, i] < -1))
+
+                if not move.any():
+                    continue
+
+                sign: np.ndarray = np.sign(d)
+                h: np.ndarray = heights[:, :, i]
+                hPrev: np.ndarray = heights[:, :, i - 1]
+                hNext: np.ndarray = heights[:, :, i + 1]
+                n: np.ndarray = positions[:, :, i]
+                nPrev: np.ndarray = positions[:, :, i - 1]
+                nNext: np.ndarray = positions[:, :, i + 1]
+
+                parabolic: np.ndarray = h + sign / (nNext - nPrev) * ((n - nPrev + sign) * (hNext - h) / (nNext - n) + (nNext - n - sign) * (h - hPrev) / (n - nPrev))
+                linear: np.ndarray = h + sign * np.where(sign > 0, (hNext - h) / (nNext - n), (hPrev - h) / (nPrev - n))
+                adjusted: np.ndarray = np.where((hPrev < parabolic) & (parabolic < hNext), parabolic, linear)
+
+                heights[:, :, i] = np.where(move, adjusted, h)
+                positions[:, :, i] += np.where(move, sign, 0)
+
+    # Returns the estimated quantile of each cell (one of the quantiles given when the aggregator was created)
+    def quantile(self, q: float) -> np.ndarray:
+        heights: np.ndarray = self.quantiles[q][0]
+
+        # Exact while there are at most 5 runs
+        if self.count <= 5:
+            return np.quantile(heights[:, :, :self.count], q, axis=2)
+        return heights[:, :, 2].copy()
+
+    # Returns the mean of each cell
+    def mean(self) -> np.ndarray:
+        return self.average.copy()
+
+    # Returns the sample variance of each cell
+    def variance(self) -> np.ndarray:
+        if self.count < 2:
+            return np.full((self.rows, self.columns), np.nan)
+        return self.squares / (self.count - 1)
+
 def main():
     limits = list()
 
@@ -181,7 +370,8 @@ def main():
     # You can choose which simulation to graph here
     simulationName = "3speedsqa"
     simulationCount = 100
-    g = Grapher("runs/" + simulationName + "/output", simulationCount, 5000, limits)
+    # Set streaming to True for large numbers of runs, which would not fit in memory otherwise
+    g = Grapher("runs/" + simulationName + "/output", simulationCount, 5000, limits, streaming=False)
     g.saveAllAvg()
 
 if __name__ == "__main__":
@@ -2,8 +2,17 @@ import uuid
 
 # This represents an order an agent sends to buy or cell a certain number of shares at a certain limit price
 # Market orders are not supported, all orders are limit orders
+# An order can be given an expiry time (good-till-time), after which the order book removes it on its own if it is still resting
+
+# An order can also replace (amend) an earlier order: when it reaches the matching engine, the order with ID replaceID is canceled
+# and this order is entered in its place, all in one step
+
+# Time in force options:
+# "gtc" - good till canceled (or until the expiry time, if one is given): whatever doesn't match right away rests in the book
+# "ioc" - immediate or cancel: matches as much as possible right away, and the rest is canceled instead of resting
+# "fok" - fill or kill: matches completely right away, or is canceled entirely without matching
 class Order:
-    def __init__(self, agent: 'Agent', buy: bool, symbol: str, amount: int, price: float, timestamp: float):
+    def __init__(self, agent: 'Agent', buy: bool, symbol: str, amount: int, price: float, timestamp: float, expireTime: float = None, timeInForce: str = "gtc"):
         self.cancel = False
         self.orderID = uuid.uuid4()
         self.agent = agent
@@ -14,6 +23,12 @@ class Order:
         self.timestamp = timestamp
         self.receiveTimestamp = timestamp
         self.processTimestamp = timestamp
+        self.expireTime = expireTime
+        self.timeInForce = timeInForce
+        self.replaceID = None
+
+        # Number of the order in the order it arrived at the order book, set by the book; breaks ties between orders received at the same time
+        self.arrival = None
     
     # A cancel order uses the same orderID as the order it is canceling
 
@@ -1,23 +1,34 @@
 import heapq
-import matplotlib.pyplot as plot
-import mpl_finance as plotf
+import uuid
 from order import Order
-from trade import Trade
+from trade import Trade, ExecutionReport, TradeTape, MatchStats, OHLCVBars
 import numpy
 
 # An OrderBook represents a stock exchange's centralized order book for a share, where all orders involving this share wait until matches can be found.
 class OrderBook:
     def __init__(self, simulation: 'Simulation', price: float, symbol: str):
-        # Stores sell side of order book as tuples with price (float), timestamp (float), and Order.
+        # Stores sell side of order book as tuples with price (float), timestamp (float), arrival number (int), and Order.
         # The lowest sell order is popped first. In the event of a tie, the oldest one should pop first.
+        # Orders received at the same time (like the orders of a batch) pop in the order they arrived in.
         self.sellbook: list = []
 
-        # Stores buy side of order book as tuples with negative price (float), timestamp (float), and Order.
+        # Stores buy side of order book as tuples with negative price (float), timestamp (float), arrival number (int), and Order.
         # The highest buy order is popped first. In the event of a tie, the oldest one should pop first.
         self.buybook: list = []
 
-        # List of all trades transacted, stored as Trade objects
-        self.trades: list = []
+        # All trades transacted, stored in a TradeTape (see the simulation's tape settings)
+        if simulation is not None and simulation.tapeSpill is not None:
+            self.trades: TradeTape = TradeTape(simulation.tapeSpill, simulation.getTapeFile(symbol))
+        else:
+            self.trades: TradeTape = TradeTape()
+
+        # OHLCV bars of the trades, for each of the simulation's bar intervals
+        # Key: interval (float), Value: OHLCVBars
+        self.bars: dict = dict()
+
+        if simulation is not None:
+            for interval in simulation.barIntervals:
+                self.bars[interval] = OHLCVBars(interval)
 
         # List of simulation data points, generated whenever an order is processed, stored as DataPoint objects
         self.datapoints: list = []
@@ -32,160 +43,468 @@ class OrderBook:
 
         self.simulation: 'Simulation' = simulation
 
+        # Orders currently resting in the book, Key: orderID (uuid), Value: Order
+        # Entries in buybook and sellbook whose order is not in here have been canceled and are skipped (lazy deletion).
+        # The top of each book is always kept live, so the best bid and ask can be read directly.
+        self.restingOrders: dict = dict()
+
+        # Total resting quantity at each price level, Key: price (float), Value: amount (int)
+        self.buyDepth: dict = dict()
+        self.sellDepth: dict = dict()
+
+        # Total resting quantity on both sides of the book
+        self.bookSize: int = 0
+
+        # Number of regular orders which have arrived at the book, used to number them in the order they arrive
+        self.arrivals: int = 0
+
+        # Orders currently resting in the book, per agent
+        # Key: Agent, Value: dict with Key: orderID (uuid), Value: Order
+        self.agentOrders: dict = dict()
+
+        # Resting orders with an expiry time, stored as tuples with expiry time (float), arrival number (int) and Order
+        # The order expiring first is popped first. Orders are only expired when the book is next used (see expireOrders).
+        self.expiryHeap: list = []
+
+        # IDs of orders which have been sent to the book but have not reached it yet, because of latency
+        self.inFlight: set = set()
+
+        # IDs of orders in flight whose cancel (or replace) reached the book first. These orders are dropped when they arrive.
+        self.earlyCancels: set = set()
+
+        # Number of canceled entries still sitting in each book, used to decide when to compact it
+        self.buyStale: int = 0
+        self.sellStale: int = 0
+
     # Adds an order to the order book. Used internally, does not try to match orders.
     def _addOrder(self, order: Order):      
         if order.amount <= 0:
             raise Exception("Order amount is 0!")
 
         if order.buy:
-            heapq.heappush(self.buybook, (-order.price, order.receiveTimestamp, order))
+            heapq.heappush(self.buybook, (-order.price, order.receiveTimestamp, order.arrival, order))
+            self.buyDepth[order.price] = self.buyDepth.get(order.price, 0) + order.amount
+        else:
+            heapq.heappush(self.sellbook, (order.price, order.receiveTimestamp, order.arrival, order))
+            self.sellDepth[order.price] = self.sellDepth.get(order.price, 0) + order.amount
+
+        self.restingOrders[order.orderID] = order
+        self.bookSize += order.amount
+
+        if order.agent in self.agentOrders:
+            self.agentOrders[order.agent][order.orderID] = order
         else:
-            heapq.heappush(self.sellbook, (order.price, order.receiveTimestamp, order))
+            self.agentOrders[order.agent] = {order.orderID: order}
+
+    # Takes a resting order out of the depth and size bookkeeping. Its heap entry is removed separately.
+    def _unlistOrder(self, order: Order):
+        del self.restingOrders[order.orderID]
+        self.bookSize -= order.amount
+
+        orders: dict = self.agentOrders[order.agent]
+        del orders[order.orderID]
+        if len(orders) == 0:
+            del self.agentOrders[order.agent]
+
+        depth: dict = self.buyDepth if order.buy else self.sellDepth
+        remaining: int = depth[order.price] - order.amount
+
+        if remaining > 0:
+            depth[order.price] = remaining
+        else:
+            del depth[order.price]
+
+    # Removes and returns the best order on one side of the book, which must not be empty
+    def _popOrder(self, buy: bool) -> Order:
+        book: list = self.buybook if buy else self.sellbook
+        order: Order = heapq.heappop(book)[3]
+        self._unlistOrder(order)
+        self._pruneBook(buy)
+        return order
+
+    # Removes a resting order from the book, wherever it is. Returns the removed order, or None if it was not resting.
+    def _removeOrder(self, orderID: uuid.UUID) -> Order:
+        order: Order = self.restingOrders.get(orderID)
+
+        if order is None:
+            return None
+
+        self._unlistOrder(order)
+
+        # The heap entry stays behind and is skipped once it reaches the top
+        if order.buy:
+            self.buyStale += 1
+        else:
+            self.sellStale += 1
+
+        self._pruneBook(order.buy)
+        return order
+
+    # Drops canceled entries from the top of a book, and rebuilds the book once canceled entries make up most of it
+    def _pruneBook(self, buy: bool):
+        book: list = self.buybook if buy else self.sellbook
+        stale: int = 0
+
+        while len(book) > 0 and not (book[0][3].orderID in self.restingOrders):
+            heapq.heappop(book)
+            stale += 1
+
+        if buy:
+            self.buyStale -= stale
+            if self.buyStale > 0 and self.buyStale * 2 > len(book):
+                self.buybook = [o for o in book if o[3].orderID in self.restingOrders]
+                heapq.heapify(self.buybook)
+                self.buyStale = 0
+        else:
+            self.sellStale -= stale
+            if self.sellStale > 0 and self.sellStale * 2 > len(book):
+                self.sellbook = [o for o in book if o[3].orderID in self.restingOrders]
+                heapq.heapify(self.sellbook)
+                self.sellStale = 0
+
+    # Market data: price of the highest resting buy order, or None if there are no buy orders
+    # Expired orders are only removed when the book is next used, so the market data functions can still show them.
+    # To leave them out, pass the current time; orders expired by then are skipped, but not removed from the book.
+    def bestBid(self, time: float = None) -> float:
+        order: Order = self._bestOrder(True, time)
+
+        if order is None:
+            return None
+        return order.price
+
+    # Market data: price of the lowest resting sell order, or None if there are no sell orders
+    def bestAsk(self, time: float = None) -> float:
+        order: Order = self._bestOrder(False, time)
+
+        if order is None:
+            return None
+        return order.price
+
+    # Market data: gap between best ask and best bid, or None if either side of the book is empty
+    def spread(self, time: float = None) -> float:
+        bid: float = self.bestBid(time)
+        ask: float = self.bestAsk(time)
+
+        if bid is None or ask is None:
+            return None
+        return ask - bid
+
+    # Market data: midpoint between best bid and best ask, or None if either side of the book is empty
+    def mid(self, time: float = None) -> float:
+        bid: float = self.bestBid(time)
+        ask: float = self.bestAsk(time)
+
+        if bid is None or ask is None:
+            return None
+        return (ask + bid) / 2
+
+    # Market data: total resting quantity at a price on one side of the book
+    def depthAtPrice(self, price: float, buy: bool, time: float = None) -> int:
+        depth: dict = self.buyDepth if buy else self.sellDepth
+        amount: int = depth.get(price, 0)
+
+        if time is not None and amount > 0:
+            for (expireTime, arrival, order) in self.expiryHeap:
+                if expireTime <= time and order.buy == buy and order.price == price and order.orderID in self.restingOrders:
+                    amount -= order.amount
+
+        return amount
+
+    # Returns whether an order has expired by the given time (never, if the time is None), even if it has not been removed yet
+    def _expired(self, order: Order, time: float) -> bool:
+        return time is not None and order.expireTime is not None and order.expireTime <= time
+
+    # Returns the best resting order on one side of the book which has not expired by the given time, or None if there is none
+    def _bestOrder(self, buy: bool, time: float = None) -> Order:
+        book: list = self.buybook if buy else self.sellbook
+
+        if len(book) == 0:
+            return None
+
+        if not self._expired(book[0][3], time):
+            return book[0][3]
+
+        top: list = self.getTopOrders(buy, 1, time)
+
+        if len(top) == 0:
+            return None
+        return top[0][3]
+
+    # Returns the orders an agent currently has resting in the book, Key: orderID (uuid), Value: Order
+    # The returned dict must not be modified
+    def getAgentOrders(self, agent: 'Agent') -> dict:
+        return self.agentOrders.get(agent, {})
+
+    # Returns the number of orders an agent currently has resting in the book
+    def getAgentOrderCount(self, agent: 'Agent') -> int:
+        if agent in self.agentOrders:
+            return len(self.agentOrders[agent])
+        return 0
+
+    # Returns up to "amount" of the best resting entries on one side of the book, best first
+    # Entries are tuples of (price key, timestamp, arrival number, Order), as stored in the book
+    # When a time is given, orders which have expired by then are left out (see bestBid)
+    def getTopOrders(self, buy: bool, amount: int, time: float = None) -> list:
+        book: list = self.buybook if buy else self.sellbook
+        popped: list = list()
+        top: list = list()
+
+        while len(top) < amount and len(book) > 0:
+            o = heapq.heappop(book)
+            popped.append(o)
+
+            if o[3].orderID in self.restingOrders and not self._expired(o[3], time):
+                top.append(o)
+
+        for o in popped:
+            heapq.heappush(book, o)
+
+        return top
+
+    # Iterates over the live entries of one side of the book, in heap order
+    def _liveEntries(self, buy: bool):
+        book: list = self.buybook if buy else self.sellbook
+        for o in book:
+            if o[3].orderID in self.restingOrders:
+                yield o
+
+    # Removes all resting orders whose expiry time is at or before the given time
+    # Called whenever the book is used, so expired orders never match or show up in order book snapshots
+    def expireOrders(self, time: float):
+        while len(self.expiryHeap) > 0 and self.expiryHeap[0][0] <= time:
+            order: Order = heapq.heappop(self.expiryHeap)[2]
+
+            # Orders which have already matched or been canceled are just dropped from the heap
+            if self._removeOrder(order.orderID) is None or order.agent is None:
+                continue
+
+            order.agent.canceledOrders += order.amount
+
+            if self.simulation is not None and order.agent.executionReports:
+                self.simulation.sendExecutionReport(ExecutionReport(order, "expired", order.amount, 0, order.price, time))
+
+    # Called when an order is sent to the book, so a cancel arriving before the order itself can still cancel it
+    def expectOrder(self, order: Order):
+        if not order.cancel:
+            self.inFlight.add(order.orderID)
 
     # Function used to input an order into the order book, which will either match or result in the order being added
     def input(self, order: Order):
+        trades: list = self._processOrder(order)
+
+        # Send information of the trades to every agent
+        if self.simulation is not None:
+            self.simulation.broadcastTradeInfo(trades)
+
+        # Add a new data point whenever a new order is submitted
+        if not order.cancel:
+            self.datapoints.append(DataPoint(self, order.processTimestamp))
+
+    # Inputs a batch of orders (including cancel and replace orders) one after another, as a single message
+    # Trades from the whole batch are broadcast together, and only one data point is added for the batch
+    def inputBatch(self, orders: list):
+        trades: list = list()
+        regular: bool = False
+
+        for order in orders:
+            trades += self._processOrder(order)
+            regular = regular or not order.cancel
+
+        if self.simulation is not None:
+            self.simulation.broadcastTradeBatch(trades)
+
+        if regular:
+            self.datapoints.append(DataPoint(self, orders[len(orders) - 1].processTimestamp))
+
+    # Processes a cancel, replace or regular order, and returns the trades it produced
+    def _processOrder(self, order: Order) -> list:
         self.lastUnqueueTime = order.receiveTimestamp
+        self.expireOrders(order.processTimestamp)
 
         # If the order is a cancel request, try to find the order in the order book that it's trying to cancel, and remove that order from the book
         if order.cancel:
-            for o in self.sellbook:
-                order2: Order = o[2]
-                if order2.orderID == order.orderID:
-                    order2.agent.canceledOrders += order2.amount
-                    self.sellbook.remove(o)
-            
-            for o in self.buybook:
-                order2: Order = o[2]
-                if order2.orderID == order.orderID:
-                    order2.agent.canceledOrders += order2.amount
-                    self.buybook.remove(o)
-        else:
-            # The order is a regular order
-            if order.agent is not None:
-                order.agent.sentOrders += order.amount
-    
-            # Try to match the order with other orders in the order book
-            trades: list = self._matchOrder(order)
-            for trade in trades:
-                # Process transactions (exchange of cash and shares) for all trades that were produced
-                if not (self.simulation is None):
-                    trade.process() 
+            self._cancelOrder(order.orderID, order.processTimestamp)
+            return []
 
-                    # The share's market price is defined here as the last trade's price
-                    self.price = trade.price
+        # A replace order first cancels the order it replaces, then is processed like a regular order
+        if order.replaceID is not None:
+            self._cancelOrder(order.replaceID, order.processTimestamp)
 
-                self.trades.append(trade)
+        # The order is a regular order
+        if order.agent is not None:
+            order.agent.sentOrders += order.amount
 
-            self.lastOrder = order
+        self.inFlight.discard(order.orderID)
+        order.arrival = self.arrivals
+        self.arrivals += 1
 
-            # Add a new data point whenever a new order is submitted
-            self.datapoints.append(DataPoint(self, order.processTimestamp))
+        # The order was canceled before it arrived
+        if order.orderID in self.earlyCancels:
+            self.earlyCancels.remove(order.orderID)
+            self._cancelRemainder(order)
+            return []
+
+        # Try to match the order with other orders in the order book
+        trades: list = self._matchOrder(order)
+        for trade in trades:
+            # Process transactions (exchange of cash and shares) for all trades that were produced
+            if not (self.simulation is None):
+                trade.process() 
+
+                # The share's market price is defined here as the last trade's price
+                self.price = trade.price
+
+            self.trades.append(trade)
+
+            for bars in self.bars.values():
+                bars.add(trade.timestamp, trade.price, trade.amount)
+
+        if self.simulation is not None:
+            self._reportTrades(trades)
+
+        self.lastOrder = order
+        return trades
+
+    # Removes the resting order with the given ID from the book, if it is still there
+    def _cancelOrder(self, orderID: uuid.UUID, time: float):
+        order: Order = self._removeOrder(orderID)
+
+        if order is None and orderID in self.inFlight:
+            self.earlyCancels.add(orderID)
+
+        if order is not None and order.agent is not None:
+            order.agent.canceledOrders += order.amount
+
+            if self.simulation is not None and order.agent.executionReports:
+                self.simulation.sendExecutionReport(ExecutionReport(order, "canceled", order.amount, 0, order.price, time))
+
+    # Sends execution reports to the owners of all orders filled by the given trades, if they want them
+    # Trades are walked backwards so that each report carries the quantity the order had left right after that trade
+    def _reportTrades(self, trades: list):
+        filledLater: dict = dict()
+        reports: list = list()
+
+        for trade in reversed(trades):
+            for order in (trade.buyOrder, trade.sellOrder):
+                filled: int = filledLater.get(order.orderID, 0)
+                remaining: int = order.amount + filled
+                filledLater[order.orderID] = filled + trade.amount
+
+                if order.agent is not None and order.agent.executionReports:
+                    type: str = "partial" if remaining > 0 else "fill"
+                    reports.append(ExecutionReport(order, type, trade.amount, remaining, trade.price, trade.timestamp))
+
+        for report in reversed(reports):
+            self.simulation.sendExecutionReport(report)
 
     # Second function involved in processing orders
     # Takes in an order and tries to match it
     # Returns list of Trade objects, describing all trades that were generated
     def _matchOrder(self, order: Order) -> list:
         trades: list = list()
-        if order.buy: # If the order is a buy order, look in the sell book for things to match with
+
+        # A fill-or-kill order which can't be filled completely right away is canceled without matching at all
+        if order.timeInForce == "fok" and self._fillableAmount(order) < order.amount:
+            self._cancelRemainder(order)
+        elif order.buy: # If the order is a buy order, look in the sell book for things to match with
             while order.amount > 0: 
                 if len(self.sellbook) > 0:
                     # Removes the "best deal" sell order from the order book, to test if it can match
-                    other = heapq.heappop(self.sellbook)[2]
+                    other = self._popOrder(False)
                     # Tries to match with the best deal. If the newly submitted order fully matches, stop looking for the next best deal.
-                    if self._inputOrder(order, other, other.price, trades):
+                    if self._inputOrder(order, other, other.price, trades, order):
                         break
                 else: # If there are no orders in the sell book, add the order to the order book
-                    self._addOrder(order)
+                    self._restOrder(order)
                     break                
         else: # If the order is a sell order, look in the buy book for things to match with
             while order.amount > 0:
                 if len(self.buybook) > 0:
                     # Removes the "best deal" buy order from the order book, to test if it can match
-                    other = heapq.heappop(self.buybook)[2]
+                    other = self._popOrder(True)
                     # Tries to match with the best deal. If the newly submitted order fully matches, stop looking for the next best deal.
-                    if self._inputOrder(other, order, other.price, trades):
+                    if self._inputOrder(other, order, other.price, trades, order):
                         break
                 else: # If there are no orders in the buy book, add the order to the order book
-                    self._addOrder(order)
+                    self._restOrder(order)
                     break
 
-        # Send information of the trade to every agent
-        if not (self.simulation is None):
-            self.simulation.broadcastTradeInfo(trades)
- 
         return trades
     
     # Third function involved in processing orders
-    # This function operates in terms of the "buy order" and "sell order" instead of the "best deal" and "newly submitted" order
+    # This function operates in terms of the "buy order" and "sell order"; "incoming" is whichever of the two was newly submitted
     # Returns True when the newly submitted order has finished matching with the other orders to signal to stop trying to match the newly sumbitted order with other orders
-    def _inputOrder(self, buyOrder: Order, sellOrder: Order, price: float, trades) -> bool:
+    def _inputOrder(self, buyOrder: Order, sellOrder: Order, price: float, trades, incoming: Order) -> bool:
+        resting: Order = sellOrder if incoming is buyOrder else buyOrder
+
         if sellOrder.price <= buyOrder.price: # Makes sure the best deal can actually match with the submitted order
-            if sellOrder.amount > buyOrder.amount: # The buy order "runs out" first
-                trades.append(Trade(buyOrder.agent, sellOrder.agent, buyOrder, sellOrder, price, buyOrder.symbol, buyOrder.amount, max(buyOrder.processTimestamp, sellOrder.processTimestamp)))
-                
-                # Reduce the sell order's amount by the number which matched
-                sellOrder.amount -= buyOrder.amount
-                # All the buy orders matched
-                buyOrder.amount = 0
-
-                # If the buy order is the newly submitted one, return the partially matched sell order to the order book (thus returning True)
-                if buyOrder.receiveTimestamp > sellOrder.receiveTimestamp:
-                    self._addOrder(sellOrder)
-
-                return buyOrder.receiveTimestamp > sellOrder.receiveTimestamp
-            elif sellOrder.amount == buyOrder.amount: # Both orders have perfectly match
-                trades.append(Trade(buyOrder.agent, sellOrder.agent, buyOrder, sellOrder, price, buyOrder.symbol, buyOrder.amount, max(buyOrder.processTimestamp, sellOrder.processTimestamp)))
-                sellOrder.amount = 0
-                buyOrder.amount = 0
-
-                # There is no more matching to do
-                return True
-            else: # The sell order "runs out" first
-                trades.append(Trade(buyOrder.agent, sellOrder.agent, buyOrder, sellOrder, price, buyOrder.symbol, sellOrder.amount, max(buyOrder.processTimestamp, sellOrder.processTimestamp)))
-                
-                # Reduce the sell order's amount by the number which matched
-                buyOrder.amount -= sellOrder.amount
-                # All the buy orders matched
-                sellOrder.amount = 0
-
-                # If the sell order is the newly submitted one, return the partially matched sell order to the order book (thus returning True)
-                if buyOrder.receiveTimestamp < sellOrder.receiveTimestamp:
-                    self._addOrder(buyOrder)
-
-                return buyOrder.receiveTimestamp < sellOrder.receiveTimestamp
+            # The order with less quantity "runs out" first, and both orders are reduced by that amount
+            amount: int = min(buyOrder.amount, sellOrder.amount)
+            trades.append(Trade(buyOrder.agent, sellOrder.agent, buyOrder, sellOrder, price, buyOrder.symbol, amount, max(buyOrder.processTimestamp, sellOrder.processTimestamp)))
+            buyOrder.amount -= amount
+            sellOrder.amount -= amount
+
+            # If the best deal only partially matched, the newly submitted order has run out, so return the rest of the best deal to the order book
+            if resting.amount > 0:
+                self._addOrder(resting)
+
+            # Keep matching only while the newly submitted order has some quantity left
+            return incoming.amount == 0
 
         else: # If the best deal cannot match (prices are incompatible), add the best deal back to the order book (it had been removed previously), and add the submitted order too
-            self._addOrder(sellOrder)
-            self._addOrder(buyOrder)
+            self._addOrder(resting)
+            self._restOrder(incoming)
             return True   
 
+    # Adds what is left of a newly submitted order to the order book, or cancels it if the order may not rest (immediate-or-cancel and fill-or-kill)
+    def _restOrder(self, order: Order):
+        if order.timeInForce == "gtc":
+            self._addOrder(order)
+
+            # Orders put back into the book after a partial match keep this entry, so it is only added once
+            if order.expireTime is not None:
+                heapq.heappush(self.expiryHeap, (order.expireTime, order.arrival, order))
+        else:
+            self._cancelRemainder(order)
+
+    # Cancels the unmatched quantity of a newly submitted order which may not rest in the book
+    def _cancelRemainder(self, order: Order):
+        if order.agent is None:
+            return
+
+        order.agent.canceledOrders += order.amount
+
+        if self.simulation is not None and order.agent.executionReports:
+            self.simulation.sendExecutionReport(ExecutionReport(order, "canceled", order.amount, 0, order.price, order.processTimestamp))
+
+    # Returns the quantity resting on the other side of the book at prices an order can match with
+    def _fillableAmount(self, order: Order) -> int:
+        amount: int = 0
+
+        if order.buy:
+            for price in self.sellDepth:
+                if price <= order.price:
+                    amount += self.sellDepth[price]
+        else:
+            for price in self.buyDepth:
+                if price >= order.price:
+                    amount += self.buyDepth[price]
+
+        return amount
+
     def toString(self) -> str:
         s = "Sell orders: \n"
 
-        orders = list()
-        
-        while len(self.sellbook) > 0:
-            order = heapq.heappop(self.sellbook)
-            orders.append(order)
-            o: Order = order[2]
+        for order in sorted(self._liveEntries(False)):
+            o: Order = order[3]
             s += "Price: " + str(o.price) + ", Quantity: " + str(o.amount) + ", Time: " + str(o.timestamp) + " " + str(o.orderID) + "\n" 
 
-        for order in orders:
-            heapq.heappush(self.sellbook, order)
-
         s += "\nBuy orders: \n"
 
-        orders = list()
-        
-        while len(self.buybook) > 0:
-            order = heapq.heappop(self.buybook)
-            orders.append(order)
-            o: Order = order[2]
+        for order in sorted(self._liveEntries(True)):
+            o: Order = order[3]
             s += "Price: " + str(o.price) + ", Quantity: " + str(o.amount) + ", Time: " + str(o.timestamp) + " " + str(o.orderID) + "\n"
 
-        for order in orders:
-            heapq.heappush(self.buybook, order)
-
         return s
     
     def toStringShort(self) -> str:
@@ -193,41 +512,45 @@ class OrderBook:
         
         minsell = float("inf")
         maxsell = -float("inf")
+        sellcount = 0
 
-        for order in self.sellbook:
-            o: Order = order[2]
+        for order in self._liveEntries(False):
+            o: Order = order[3]
             minsell = min(minsell, o.price)
             maxsell = max(maxsell, o.price)
+            sellcount += 1
 
         minbuy = float("inf")
         maxbuy = -float("inf")
+        buycount = 0
 
-        s += "Amount = " + str(len(self.sellbook)) + ", " + str(minsell) + "-" + str(maxsell)
+        s += "Amount = " + str(sellcount) + ", " + str(minsell) + "-" + str(maxsell)
 
         s += "\nBuy orders: \n"
 
-        for order in self.buybook:
-            o: Order = order[2]
+        for order in self._liveEntries(True):
+            o: Order = order[3]
             minbuy = min(minbuy, o.price)
             maxbuy = max(maxbuy, o.price)
+            buycount += 1
 
-        s += "Amount = " + str(len(self.buybook)) + ", " + str(minbuy) + "-" + str(maxbuy)
+        s += "Amount = " + str(buycount) + ", " + str(minbuy) + "-" + str(maxbuy)
 
         return s
 
     # These are used for testing as an easy way to verify that the order book works as intended
     def _getBuyList(self) -> list:
         l = list()
-        for order in self.buybook:
-            o = order[2]
+        for order in self._liveEntries(True):
+            o = order[3]
             l.append(o.amount)
             l.append(o.price)
         return l
 
     def _getSellList(self) -> list:
         l = list()
-        for order in self.sellbook:
-            o = order[2]
+        for order in self._liveEntries(False):
+            o = order[3]
             l.append(o.amount)
             l.append(o.price)
         return l
@@ -235,195 +558,71 @@ class OrderBook:
     def _getTrades(self) -> list:
         l = list()
         for trade in self.trades:
-            l.append(trade.amount)
-            l.append(trade.price)
+            l.append(int(trade["amount"]))
+            l.append(float(trade["price"]))
         return l
 
+    # The plot methods below are implemented in plotting.py, which (along with matplotlib) is only imported once something is plotted
+
     # Plot price over time for a simulation
     def plotPrice(self):
-        times = list()
-        data = list()
-
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-            data.append(datapoint.price)
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("price")
-        plot.plot(times, data)   
+        import plotting
+        plotting.plotPrice(self)
 
     # Like the previous function, but uses a candlestick (open high low close) type plot, for a given time interval
     def plotPriceCandlestick(self, interval: float):
-        data = list()
-
-        last: int = 0
-
-        start: float = -1
-        current: float = 0
-        low: float = current
-        high: float = current
-
-        for datapoint in self.datapoints:
-            if start < 0:
-                start = datapoint.price
-                current = datapoint.price
-                low = datapoint.price
-                high = datapoint.price
-
-            l = int((datapoint.timestamp) / interval)
-
-            if l > last:
-                data.append((l * interval, start, high, low, current))
-                start = current
-                low = current
-                high = current
-                last = l
-
-            current = datapoint.price
-            low = min(datapoint.price, low)
-            high = max(datapoint.price, high)
-
-        fig, ax = plot.subplots()
-
-        plot.figure()
-        ax.set_xlabel('time')
-        ax.set_ylabel('price')
-        plotf.candlestick_ohlc(ax, data)   
+        import plotting
+        plotting.plotPriceCandlestick(self, interval)
 
     # Plots order book size (liquidity) over time for a simulation
     def plotBookSize(self):
-        times = list()
-        data = list()
-
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-            data.append(datapoint.bookSize)
+        import plotting
+        plotting.plotBookSize(self)
 
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("book size")
-        plot.plot(times, data)   
-
-    # Plots order book price gap (bid-ask spread) over time for a simulation. 
-    # When one or more sides of the order book are empty, uses the last known gap.
+    # Plots order book price gap (bid-ask spread) over time for a simulation
     def plotGap(self):
-        times = list()
-        data = list()
-
-        gap = 0
-        for datapoint in self.datapoints:
-            if datapoint.gap != -1:
-                gap = datapoint.gap
-
-            times.append(datapoint.timestamp)
-            data.append(gap)
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("gap")
-        plot.plot(times, data)   
+        import plotting
+        plotting.plotGap(self)
 
-    # Plots order book queue (how many orders are waiting due to the simulation only processing one per time unit) size over time for a simulation.
+    # Plots order book queue size over time for a simulation
     def plotQueueSize(self):
-        times = list()
-        data = list()
+        import plotting
+        plotting.plotQueueSize(self)
 
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-            data.append(datapoint.queueSize)
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("queue size")
-        plot.plot(times, data)   
-
-    # Plots volatility over time for a simulation. 
-    # Must run calculateVolatility() first
+    # Plots volatility over time for a simulation. Must run calculateVolatility() first
     def plotVolatility(self):
-        times = list()
-        data = list()
-        
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-            data.append(datapoint.volatility)
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("volatility")
-        plot.plot(times, data)   
+        import plotting
+        plotting.plotVolatility(self)
 
     # Plot all agent cash over time for a simulation
-    # Does not include agents whose name starts with "marketmaker"
     def plotBalances(self):
-        times: list = list()
-        data: dict = dict()
-        
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-
-            for a in datapoint.agentBalances:
-                if not a.startswith("marketmaker"):
-                    if not (a in data):
-                        data[a] = list()
+        import plotting
+        plotting.plotBalances(self)
 
-                    data[a].append(datapoint.agentBalances[a])
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("balance")
-        plot.legend(data)
-
-        for a in data:
-            plot.plot(times, data[a])   
-    
     # Plot number of shares each agent has over time for a simulation
-    # Does not include agents whose name starts with "marketmaker"
     def plotShares(self):
-        times: list = list()
-        data: dict = dict()
-        
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-
-            for a in datapoint.agentShares:
-                if not a.startswith("marketmaker"):
-                    if not (a in data):
-                        data[a] = list()
-
-                    data[a].append(datapoint.agentShares[a])
-
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("shares")
-        plot.legend(data)
-
-        for a in data:
-            plot.plot(times, data[a])   
+        import plotting
+        plotting.plotShares(self)
 
     # Plot net worth (# shares * value of share + total cash) each agent has over time for a simulation
-    # Does not include agents whose name starts with "marketmaker"
     def plotNetWorth(self):
-        times: list = list()
-        data: dict = dict()
-        
-        for datapoint in self.datapoints:
-            times.append(datapoint.timestamp)
-
-            for a in datapoint.agentShares:
-                if not a.startswith("marketmaker"):
-                    if not (a in data):
-                        data[a] = list()
+        import plotting
+        plotting.plotNetWorth(self)
 
-                    data[a].append(datapoint.agentShares[a] * datapoint.price + datapoint.agentBalances[a])
+    # Yields the cash, shares, and sent, matched and canceled order counts of all agents at each data point, as arrays in the order of the simulation's agents
+    # Data points only store what changed in populations, so the values are rebuilt by applying their snapshots in order
+    def agentValues(self):
+        accounts: list = self.simulation.accounts
+        current: list = [account.startingValues(self.symbol) for account in accounts]
 
-        plot.figure()
-        plot.xlabel("time")
-        plot.ylabel("net worth")
-        plot.legend(data)
+        for datapoint in self.datapoints:
+            for i in range(len(accounts)):
+                accounts[i].applySnapshot(current[i], datapoint.accounts[i])
 
-        for a in data:
-            plot.plot(times, data[a]) 
+            if len(current) == 0:
+                yield [numpy.zeros(0) for i in range(5)]
+            else:
+                yield [numpy.concatenate([values[i] for values in current]) for i in range(5)]
 
     # Calculates volatility over time for prices, by calculating standard deviation of prices over the given time period
     # Stores this in a "volatility" variable in the data points
@@ -473,8 +672,29 @@ class OrderBook:
 
         f.write(bar + "\n")
 
-        for datapoint in self.datapoints:
-            f.write(datapoint.toCsvLine() + "\n")
+        # Order counts are not written for agents whose name starts with "_"
+        counted: numpy.ndarray = numpy.array([not agent.name.startswith("_") for agent in self.simulation.agents], dtype=bool)
+
+        for (datapoint, values) in zip(self.datapoints, self.agentValues()):
+            f.write(datapoint.toCsvLine(values, counted) + "\n")
+
+        f.close()
+
+    # Returns the OHLCV bars of the given interval: the bars kept during the simulation if the interval is one of the simulation's
+    # bar intervals, or else bars made from the trade tape
+    def getBars(self, interval: float) -> OHLCVBars:
+        if interval in self.bars:
+            return self.bars[interval]
+        return OHLCVBars.fromTape(self.trades, interval)
+
+    # Saves the OHLCV bars of all of the simulation's bar intervals to a given file in CSV format
+    def writeBars(self, file: str):
+        f = open(file, "w")
+        f.write("Interval,Time,Open,High,Low,Close,Volume\n")
+
+        for interval in self.bars:
+            for row in self.bars[interval].toArray().tolist():
+                f.write(str(interval) + "," + ",".join([str(value) for value in row]) + "\n")
 
         f.close()
     
@@ -489,34 +709,27 @@ class OrderBook:
 
         f.write(bar + "\n")
         for agent in self.simulation.agents:
-            f.write(agent.name + "," + str(numpy.average(agent.pricesMatched)) + "," + str(numpy.average(agent.pricesMatchedBuy)) + "," + str(numpy.average(agent.pricesMatchedSell)))
+            stats: MatchStats = agent.matchStats
+            f.write(agent.name + "," + str(stats.mean(MatchStats.allRow)) + "," + str(stats.mean(MatchStats.buyAllRow)) + "," + str(stats.mean(MatchStats.sellAllRow)))
             f.write("," + str(numpy.average(agent.sentOrders)) + "," + str(numpy.average(agent.matchedOrders)) + "," + str(numpy.average(agent.canceledOrders)))
 
-            standingOrders: int = 0
-
-            for o in self.buybook:
-                if o[2].agent == agent:
-                    standingOrders += 1
-
-            for o in self.sellbook:
-                if o[2].agent == agent:
-                    standingOrders += 1
+            standingOrders: int = self.getAgentOrderCount(agent)
 
             f.write("," + str(standingOrders))
 
-            for agent2 in self.simulation.agentGroups:
-                if agent2 in agent.agentsMatched:
-                    f.write("," + str(agent.agentsMatched[agent2]))
-                else:
-                    f.write(",0")
+            for group in range(len(self.simulation.agentGroups)):
+                buyRow: int = stats.buyRow(group)
+                sellRow: int = stats.sellRow(group)
 
-                if agent2 in agent.agentsMatchedBuy:
-                    f.write("," + str(agent.agentsMatchedBuy[agent2]) + "," + str(numpy.average(agent.agentPricesMatchedBuy[agent2])))
+                f.write("," + str(stats.amount(buyRow) + stats.amount(sellRow)))
+
+                if stats.count(buyRow) > 0:
+                    f.write("," + str(stats.amount(buyRow)) + "," + str(stats.mean(buyRow)))
                 else:
                     f.write(",0,0")
 
-                if agent2 in agent.agentsMatchedSell:
-                    f.write("," + str(agent.agentsMatchedSell[agent2]) + "," + str(numpy.average(agent.agentPricesMatchedSell[agent2])))
+                if stats.count(sellRow) > 0:
+                    f.write("," + str(stats.amount(sellRow)) + "," + str(stats.mean(sellRow)))
                 else:
                     f.write(",0,0")
 
@@ -528,69 +741,36 @@ class DataPoint:
     def __init__(self, orderBook: OrderBook, timestamp: float):
         self.price: float = orderBook.price
         self.timestamp: float = timestamp
-        self.bookSize: int = 0
+        self.bookSize: int = orderBook.bookSize
         self.queueSize: int = timestamp - orderBook.lastUnqueueTime
-        self.agentBalances: dict = dict()
-        self.agentShares: dict = dict()
-        self.agentOrdersSent = dict()
-        self.agentOrdersMatched = dict()
-        self.agentOrdersCanceled = dict()
-
-        for o in orderBook.buybook:
-            self.bookSize += o[2].amount
 
-        for o in orderBook.sellbook:
-            self.bookSize += o[2].amount
+        # Snapshot of the cash, shares and order counts of the simulation's agents (see Simulation's snapshotAccounts)
+        # The complete values are rebuilt by the order book's agentValues()
+        self.accounts: list = list()
 
         if orderBook.simulation is not None:
-            for a in orderBook.simulation.agents:
-                self.agentBalances[a.name] = a.balance
-                self.agentShares[a.name] = a.shares[orderBook.symbol]
-                self.agentOrdersSent[a.name] = a.sentOrders
-                self.agentOrdersMatched[a.name] = a.matchedOrders
-                self.agentOrdersCanceled[a.name] = a.canceledOrders
-
-        if len(orderBook.sellbook) == 0 or len(orderBook.buybook) == 0:
-            self.gap = -1
-        else:
-            s = heapq.heappop(orderBook.sellbook)
-            heapq.heappush(orderBook.sellbook, s)
+            self.accounts = orderBook.simulation.snapshotAccounts(orderBook.symbol)
 
-            b = heapq.heappop(orderBook.buybook)
-            heapq.heappush(orderBook.buybook, b)
+        spread: float = orderBook.spread()
 
-            self.gap = (s[0] + b[0])
+        if spread is None:
+            self.gap = -1
+        else:
+            self.gap = spread
     
     def toString(self) -> str:
         return str(self.timestamp) + " data point: price = " + str(self.price) + ", book size = " + str(self.bookSize) + ", gap = " + str(self.gap)
 
     # Each data point becomes one line in a CSV file
-    def toCsvLine(self) -> str:
+    # Takes the agents' values at this data point, as produced by the order book's agentValues(), and which agents' order counts are written
+    def toCsvLine(self, values: list, counted: numpy.ndarray) -> str:
         s: str = str(self.timestamp) + "," + str(self.price) + "," + str(self.bookSize) + "," + str(self.gap) + "," + str(self.volatility) + "," + str(self.queueSize)
 
-        for a in self.agentBalances:
-            s += "," + str(self.agentBalances[a])
-
-        for a in self.agentShares:
-            s += "," + str(self.agentShares[a])
-
-        for a in self.agentShares:
-            s += "," + str(self.agentShares[a] * self.price + self.agentBalances[a])
-
-        for a in self.agentOrdersSent:
-            if not (a.startswith("_")):
-                s += "," + str(self.agentOrdersSent[a])
+        (balances, shares, sent, matched, canceled) = values
+        columns: list = [balances, shares, shares * self.price + balances, sent[counted], matched[counted], canceled[counted]]
 
-        for a in self.agentOrdersMatched:
-            if not (a.startswith("_")):
-                s += "," + str(self.agentOrdersMatched[a])
-
-        for a in self.agentOrdersSent:
-            if not (a.startswith("_")):
-                s += "," + str(self.agentOrdersCanceled[a])
+        for c in columns:
+            for value in c.tolist():
+                s += "," + str(value)
 
         return s
-
-        
-    
-    
\ No newline at end of file
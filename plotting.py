@@ -0,0 +1,165 @@
+import matplotlib.pyplot as plot
+import numpy
+
+# Plots of the data points of an order book after a simulation has run.
+# This module is only imported when something is plotted (see the plot methods of OrderBook), so simulations don't need matplotlib.
+# mpl_finance is only imported for candlestick plots.
+
+# Largest number of points plotted for a line; longer lines are downsampled first (see downsample), so plotting time stays bounded.
+# Set to None to plot every point.
+pointBudget: int = 4000
+
+# Downsamples a line to at most budget points with min/max envelope decimation: the x range is split into buckets of equal width,
+# as many as half the budget, and only the lowest and highest points of each bucket are kept, along with the first and last points.
+# Unlike keeping every n-th point, spikes stay visible. Returns the x and y values of the points kept, as arrays.
+def downsample(x, y, budget: int) -> tuple:
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+
+    if budget is None or len(x) <= budget:
+        return (x, y)
+
+    buckets: int = max(1, (budget - 2) // 2)
+    edges: numpy.ndarray = x[0] + (x[-1] - x[0]) * numpy.arange(1, buckets) / buckets
+
+    # x is sorted, so each bucket is a run of points; empty buckets are skipped
+    starts: numpy.ndarray = numpy.unique(numpy.concatenate(([0], numpy.searchsorted(x, edges, side="right"))))
+    starts = starts[starts < len(x)]
+    bucket: numpy.ndarray = numpy.repeat(numpy.arange(len(starts)), numpy.diff(starts, append=len(x)))
+
+    # First lowest and highest point of each bucket
+    lowest: numpy.ndarray = numpy.flatnonzero(y == numpy.minimum.reduceat(y, starts)[bucket])
+    highest: numpy.ndarray = numpy.flatnonzero(y == numpy.maximum.reduceat(y, starts)[bucket])
+    lowest = lowest[numpy.unique(bucket[lowest], return_index=True)[1]]
+    highest = highest[numpy.unique(bucket[highest], return_index=True)[1]]
+
+    kept: numpy.ndarray = numpy.unique(numpy.concatenate((lowest, highest, [0, len(x) - 1])))
+    return (x[kept], y[kept])
+
+# Plots a line, downsampled to the point budget
+def plotLine(x, y, *args, **kwargs):
+    (x, y) = downsample(x, y, pointBudget)
+    plot.plot(x, y, *args, **kwargs)
+
+# Plot price over time for a simulation
+def plotPrice(book: 'OrderBook'):
+    times = list()
+    data = list()
+
+    for datapoint in book.datapoints:
+        times.append(datapoint.timestamp)
+        data.append(datapoint.price)
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel("price")
+    plotLine(times, data)
+
+# Like the previous function, but uses a candlestick (open high low close) type plot, for a given time interval
+# Uses the order book's OHLCV bars of that interval (see OrderBook's getBars)
+def plotPriceCandlestick(book: 'OrderBook', interval: float):
+    import mpl_finance as plotf
+
+    data = [tuple(row[:5]) for row in book.getBars(interval).toArray().tolist()]
+
+    fig, ax = plot.subplots()
+
+    plot.figure()
+    ax.set_xlabel('time')
+    ax.set_ylabel('price')
+    plotf.candlestick_ohlc(ax, data)
+
+# Plots order book size (liquidity) over time for a simulation
+def plotBookSize(book: 'OrderBook'):
+    times = list()
+    data = list()
+
+    for datapoint in book.datapoints:
+        times.append(datapoint.timestamp)
+        data.append(datapoint.bookSize)
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel("book size")
+    plotLine(times, data)
+
+# Plots order book price gap (bid-ask spread) over time for a simulation.
+# When one or more sides of the order book are empty, uses the last known gap.
+def plotGap(book: 'OrderBook'):
+    times = list()
+    data = list()
+
+    gap = 0
+    for datapoint in book.datapoints:
+        if datapoint.gap != -1:
+            gap = datapoint.gap
+
+        times.append(datapoint.timestamp)
+        data.append(gap)
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel("gap")
+    plotLine(times, data)
+
+# Plots order book queue (how many orders are waiting due to the simulation only processing one per time unit) size over time for a simulation.
+def plotQueueSize(book: 'OrderBook'):
+    times = list()
+    data = list()
+
+    for datapoint in book.datapoints:
+        times.append(datapoint.timestamp)
+        data.append(datapoint.queueSize)
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel("queue size")
+    plotLine(times, data)
+
+# Plots volatility over time for a simulation.
+# Must run calculateVolatility() first
+def plotVolatility(book: 'OrderBook'):
+    times = list()
+    data = list()
+
+    for datapoint in book.datapoints:
+        times.append(datapoint.timestamp)
+        data.append(datapoint.volatility)
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel("volatility")
+    plotLine(times, data)
+
+# Plot all agent cash over time for a simulation
+# Does not include agents whose name starts with "marketmaker"
+def plotBalances(book: 'OrderBook'):
+    plotAgentValues(book, "balance", lambda datapoint, values: values[0])
+
+# Plot number of shares each agent has over time for a simulation
+# Does not include agents whose name starts with "marketmaker"
+def plotShares(book: 'OrderBook'):
+    plotAgentValues(book, "shares", lambda datapoint, values: values[1])
+
+# Plot net worth (# shares * value of share + total cash) each agent has over time for a simulation
+# Does not include agents whose name starts with "marketmaker"
+def plotNetWorth(book: 'OrderBook'):
+    plotAgentValues(book, "net worth", lambda datapoint, values: values[1] * datapoint.price + values[0])
+
+# Plots a value of each agent over time
+# Takes a function of a data point and the agents' values at it (see agentValues()), returning an array of one value per agent
+# Does not include agents whose name starts with "marketmaker"
+def plotAgentValues(book: 'OrderBook', label: str, function):
+    times: list = [datapoint.timestamp for datapoint in book.datapoints]
+    shown: list = [i for i in range(len(book.simulation.agents)) if not book.simulation.agents[i].name.startswith("marketmaker")]
+    data: numpy.ndarray = numpy.array([function(datapoint, values)[shown] for (datapoint, values) in zip(book.datapoints, book.agentValues())])
+
+    plot.figure()
+    plot.xlabel("time")
+    plot.ylabel(label)
+    plot.legend([book.simulation.agents[i].name for i in shown])
+
+    # Each agent's line is downsampled on its own, so the spikes of every agent stay visible
+    if len(times) > 0:
+        for i in range(data.shape[1]):
+            plotLine(times, data[:, i])
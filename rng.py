@@ -0,0 +1,117 @@
+import math
+import numpy
+import zlib
+
+# Random number service of a simulation. Hands out independent random streams, all derived from one seed,
+# so that a simulation run with the same seed is reproducible. Without a seed, fresh entropy is used and every run is different.
+# Streams are named by what they are used for ("fundamental", "arrivals", "privatevalues", "latency", "algorithm"),
+# and by who uses them, like an agent's name. A named stream only depends on the seed, its name and its key,
+# so adding an agent group or changing a parameter doesn't change the draws of the other streams.
+# Pinned streams are derived from the common seed instead of the seed. Simulations of different setups with the same common seed
+# then get the same draws for those streams (common random numbers), so differences between the setups are not hidden by noise.
+# Paired streams are derived from the pair seed instead, which both replications of an antithetic pair share.
+class RandomService:
+    def __init__(self, seed: int = None, blockSize: int = 512, commonSeed: int = None):
+        self.seed: int = seed
+        self.seedSequence: numpy.random.SeedSequence = numpy.random.SeedSequence(seed)
+
+        # Number of draws generated at once for each distribution of a stream
+        self.blockSize: int = blockSize
+
+        # Seed of the pinned streams; when not set, pinned streams are derived from the seed like the others
+        self.commonSeed: int = commonSeed
+
+        # Names of the pinned streams
+        self.pinned: set = set()
+
+        # Seed of the paired streams, and their names
+        self.pairSeed: int = None
+        self.paired: set = set()
+
+        # Names of the streams whose draws are mirrored (see RandomStream)
+        self.mirrored: set = set()
+
+    # Creates a new independent stream with the given name, and key of any number of names or numbers.
+    # Unnamed streams are derived in the order they are created instead, so the same setup always gets the same streams.
+    def stream(self, name: str = None, *key) -> 'RandomStream':
+        if name is None:
+            return RandomStream(numpy.random.default_rng(self.seedSequence.spawn(1)[0]), self.blockSize)
+
+        return RandomStream(numpy.random.default_rng(self.streamSeed(name, *key)), self.blockSize, name in self.mirrored)
+
+    # Returns the seed sequence a named stream's generator is created from (see stream)
+    def streamSeed(self, name: str, *key) -> numpy.random.SeedSequence:
+        entropy = self.seedSequence.entropy
+
+        if name in self.paired and self.pairSeed is not None:
+            entropy = self.pairSeed
+        elif name in self.pinned and self.commonSeed is not None:
+            entropy = self.commonSeed
+
+        spawnKey: tuple = tuple(zlib.crc32(str(k).encode()) for k in (name,) + key)
+        return numpy.random.SeedSequence(entropy, spawn_key=spawnKey)
+
+# A stream of random numbers backed by a numpy Generator
+# Scalar draws are served from blocks which are generated all at once per distribution, as each numpy call has a large overhead compared to reading a list.
+# For many draws at once, use the generator directly.
+# A mirrored stream gives the antithetic normal draws of the same stream unmirrored (-z instead of z).
+# Runs using a stream and its mirror are negatively correlated, so the average of such a pair varies less than that of two independent runs.
+# Uniform draws are not mirrored, as they decide things like whether a shock happens at all, which should be the same in both runs.
+# Exponential draws and draws from the generator directly are not mirrored either.
+class RandomStream:
+    def __init__(self, generator: numpy.random.Generator, blockSize: int, mirrored: bool = False):
+        self.generator: numpy.random.Generator = generator
+        self.blockSize: int = blockSize
+        self.mirrored: bool = mirrored
+
+        # Blocks of standard uniform, normal and exponential draws, and the position of the next draw in each
+        # Blocks are only generated once a distribution is used
+        self.uniform: list = list()
+        self.uniformIndex: int = 0
+        self.normals: list = list()
+        self.normalIndex: int = 0
+        self.exponentials: list = list()
+        self.exponentialIndex: int = 0
+
+    # Returns a float uniformly distributed in [0, 1), like random.random()
+    def random(self) -> float:
+        if self.uniformIndex == len(self.uniform):
+            self.uniform = self.generator.random(self.blockSize).tolist()
+            self.uniformIndex = 0
+
+        value: float = self.uniform[self.uniformIndex]
+        self.uniformIndex += 1
+        return value
+
+    # Returns an integer uniformly distributed between low and high, both included, like random.randint()
+    def randint(self, low: int, high: int) -> int:
+        return low + int(self.random() * (high - low + 1))
+
+    # Returns a value from a normal distribution with the given mean and standard deviation
+    def normal(self, mean: float = 0, deviation: float = 1) -> float:
+        if self.normalIndex == len(self.normals):
+            block: numpy.ndarray = self.generator.standard_normal(self.blockSize)
+
+            if self.mirrored:
+                block = -block
+
+            self.normals = block.tolist()
+            self.normalIndex = 0
+
+        value: float = self.normals[self.normalIndex]
+        self.normalIndex += 1
+        return mean + deviation * value
+
+    # Returns a value from a log normal distribution, with the given mean and standard deviation of the underlying normal distribution
+    def lognormal(self, mean: float = 0, sigma: float = 1) -> float:
+        return math.exp(self.normal(mean, sigma))
+
+    # Returns a value from an exponential distribution with the given mean, like the time until the next arrival of a Poisson process
+    def exponential(self, mean: float = 1) -> float:
+        if self.exponentialIndex == len(self.exponentials):
+            self.exponentials = self.generator.standard_exponential(self.blockSize).tolist()
+            self.exponentialIndex = 0
+
+        value: float = self.exponentials[self.exponentialIndex]
+        self.exponentialIndex += 1
+        return mean * value
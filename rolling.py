@@ -0,0 +1,113 @@
+import math
+import statistics
+from collections import deque
+
+# scipy is optional; it gives exact Student's t quantiles for RunningStats' confidence intervals
+try:
+    import scipy.stats
+except ImportError:
+    scipy = None
+
+# The values seen during the last "length" time units, with running statistics, so that adding a value and reading
+# the statistics take constant time regardless of the window's length.
+# Values are added in time order; older ones drop out of the window as newer ones are added.
+# When emaHalfLife is set, an exponential moving average is kept too, in which a value's weight halves every emaHalfLife time units.
+class RollingWindow:
+    def __init__(self, length: float, emaHalfLife: float = None):
+        self.length: float = length
+        self.emaHalfLife: float = emaHalfLife
+
+        # Values in the window, as (time, value) tuples, oldest first
+        self.values: deque = deque()
+        self.sum: float = 0
+        self.sumSquares: float = 0
+
+        self.ema: float = None
+        self.emaTime: float = None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    # Adds a value seen at the given time, and drops the values which are now too old
+    def add(self, time: float, value: float):
+        self.values.append((time, value))
+        self.sum += value
+        self.sumSquares += value * value
+
+        if self.emaHalfLife is not None:
+            if self.ema is None:
+                self.ema = value
+            else:
+                self.ema += (1 - 0.5 ** ((time - self.emaTime) / self.emaHalfLife)) * (value - self.ema)
+
+            self.emaTime = time
+
+        self.evict(time)
+
+    # Drops the values older than the window's length at the given time
+    def evict(self, time: float):
+        while len(self.values) > 0 and time - self.values[0][0] > self.length:
+            (oldTime, value) = self.values.popleft()
+            self.sum -= value
+            self.sumSquares -= value * value
+
+        # Start over from exact sums, so rounding errors don't add up over a long run
+        if len(self.values) == 0:
+            self.sum = 0
+            self.sumSquares = 0
+
+    # Average of the values in the window (None if it is empty)
+    def mean(self) -> float:
+        if len(self.values) == 0:
+            return None
+        return self.sum / len(self.values)
+
+    # Variance of the values in the window (None if it is empty)
+    def variance(self) -> float:
+        if len(self.values) == 0:
+            return None
+        return max(0, self.sumSquares / len(self.values) - self.mean() ** 2)
+
+# Running mean and variance of a stream of values, using Welford's algorithm,
+# which stays accurate over many values unlike keeping the sums of the values and of their squares
+class RunningStats:
+    def __init__(self):
+        self.count: int = 0
+        self.average: float = 0
+        # Sum of squared differences from the average
+        self.squares: float = 0
+
+    def add(self, value: float):
+        self.count += 1
+        delta: float = value - self.average
+        self.average += delta / self.count
+        self.squares += delta * (value - self.average)
+
+    # Average of the values (None if there are none)
+    def mean(self) -> float:
+        if self.count == 0:
+            return None
+        return self.average
+
+    # Sample variance of the values (None if there are less than 2)
+    def variance(self) -> float:
+        if self.count < 2:
+            return None
+        return self.squares / (self.count - 1)
+
+    # Width of the confidence interval of the mean, at the given confidence level (None if there are less than 2 values)
+    def intervalWidth(self, confidence: float = 0.95) -> float:
+        if self.count < 2:
+            return None
+
+        n: int = self.count - 1
+
+        if scipy is not None:
+            t: float = scipy.stats.t.ppf((1 + confidence) / 2, n)
+        else:
+            # Student's t quantile, from the normal quantile with the Cornish-Fisher expansion
+            # It is too low with less than about 10 values (by 24% with 2 values, 3% with 3), so more values are needed to stop on it
+            z: float = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+            t = z + (z ** 3 + z) / (4 * n) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * n ** 2) + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * n ** 3)
+
+        return 2 * t * math.sqrt(self.variance() / self.count)
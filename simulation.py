@@ -1,19 +1,65 @@
-from events import *
-from agents import *
-import numpy as np
 import json
+import os
+import uuid
+from order import Order
+from orderbook import OrderBook
+from trade import Trade, ExecutionReport
+from events import Event, EventQueue, TimerWheel, PoissonArrivals, EventHeartbeat, EventMarketData, EventMarketDataBatch, EventExecutionReport
+from agents import Agent, AgentAccounts, PoissonAgent, PopulationZI, PopulationMember
+from rng import RandomService, RandomStream
+
+# Version of the simulator's behavior. Change it whenever a change makes the same config and seed give different results,
+# so that results cached from older versions are not used.
+version: str = "7"
 
 # This class represents a financial exchange simulation. A config file path can be passed as an argument.
+# A seed can be passed to make the simulation reproducible; without one, every run is different.
+# The replication index is the common seed of the random streams pinned by the config's "commonrandom" (see loadFile),
+# so simulations of different setups with the same replication index share those streams.
 class Simulation:
-    def __init__(self, file: str = None):
+    def __init__(self, file: str = None, seed: int = None, replication: int = None):
+        # All randomness in the simulation comes from named streams of this service (see RandomService)
+        self.rng: RandomService = RandomService(seed, commonSeed=replication)
+        self.replication: int = replication
+
         self.eventQueue: EventQueue = EventQueue(self)
-        self.agents: list = list() # list of Agent
+        self.timerWheel: TimerWheel = TimerWheel(self)
+        self.agents: list = list() # list of Agent (or PopulationMember)
+        self.listeners: list = list() # list of Agent or PopulationZI, which receive market data
+        self.accounts: list = list() # list of AgentAccounts or PopulationZI, covering self.agents in order
         self.agentGroups: list = list() # list of str
         self.orderbooks: dict = dict() # symbol (str) -> OrderBook
         self.startingPrices: dict = dict() # symbol (str) -> price (float)
         self.maxTime: float = 0
+
+        # Folder of the config file, which files referenced in the config are relative to
+        self.folder: str = ""
         self.debugPrint: bool = False
 
+        # When set, agents send all orders they produce at once as one batch message
+        self.batchOrders: bool = False
+
+        # Matching engine time taken by a batch: "batch" (one time unit per batch) or "order" (one time unit per order in it)
+        self.batchCost: str = "batch"
+
+        # Agents which want heartbeats (market data without a trade) when the market is idle
+        self.heartbeatAgents: list = list() # list of Agent
+
+        # When set, a heartbeat is sent every this many time units if there were no trades since the last one
+        self.heartbeatInterval: float = None
+
+        # When set, each group of Poisson agents shares one merged arrival process instead of each agent scheduling itself
+        self.mergePoisson: bool = True
+
+        # When set, order books keep at most this many trades in memory, and move older ones to a memory-mapped file (see TradeTape)
+        self.tapeSpill: int = None
+
+        # Files the trades are moved to, one per symbol named like "tapefile.A"; temporary files are used if not set
+        self.tapeFile: str = None
+
+        # Lengths of the intervals order books keep OHLCV bars for (see OHLCVBars)
+        self.barIntervals: list = list() # list of float
+
         if file is not None:
             self.loadFile(file)
 
@@ -34,51 +80,161 @@ class Simulation:
         # prob (float) - probability per time unit for the price to change at all
     # symbols (dict) - dict of symbols, symbol name (str) -> symbol starting price (float)
     # agents (dict) - all the simulation agents. See Agent's fromJson() for more.
+    # batchorders (bool, optional) - if true, agents send the orders they produce at once as one batch message
+    # batchcost (str, optional) - "batch" (default) if a batch takes the matching engine one time unit, "order" if it takes one time unit per order
+    # heartbeat (float, optional) - interval of the periodic heartbeat timer. Without it, heartbeats are only sent when no events are left at all.
+    # mergepoisson (bool, optional) - true (default) to drive each group of Poisson agents with one merged arrival process, false for one process per agent
+    # tapespill (int, optional) - number of trades each order book keeps in memory before moving them to a memory-mapped file
+    # tapefile (str, optional) - path of the files trades are moved to (one per symbol, with the symbol appended), relative to this file; temporary files by default
+    # bars (list, optional) - lengths of the time intervals order books keep open/high/low/close/volume bars for, as trades happen
+    # commonrandom (list, optional) - names of the random streams which are the same in all setups for the same replication index:
+        # "fundamental", "arrivals", "privatevalues", "latency" and/or "algorithm"
+    # antithetic (bool, optional) - if true, replications are paired (0 and 1, 2 and 3, etc.), and the second of a pair gets the
+        # mirrored fundamental shock sizes of the first (see RandomStream). Only the fundamental is shared within a pair.
+    # An agent group with "population": true is stored as one PopulationZI (only for poisson agents with the zi algorithm)
     def loadFile(self, file: str):
         with open(file) as f:
             j = json.loads(f.read())
+
+        self.folder = os.path.dirname(file)
         
         self.maxTime = j["runtime"]
+        self.batchOrders = j.get("batchorders", False)
+        self.batchCost = j.get("batchcost", "batch")
+        self.heartbeatInterval = j.get("heartbeat", None)
+        self.mergePoisson = j.get("mergepoisson", True)
+        self.tapeSpill = j.get("tapespill", None)
+        self.barIntervals = j.get("bars", [])
+
+        self.rng.pinned = set(j.get("commonrandom", []))
+
+        if j.get("antithetic", False) and self.replication is not None:
+            self.rng.paired.add("fundamental")
+            self.rng.pairSeed = self.replication // 2
+
+            if self.replication % 2 == 1:
+                self.rng.mirrored.add("fundamental")
+
+        if "tapefile" in j:
+            self.tapeFile = os.path.join(self.folder, j["tapefile"])
 
         if j["fundamental"]:
             f = j["fundamental"]
-            self.fundamental = FundamentalValue(f["kappa"], f["mean"], f["shock"], f["prob"])
+            self.fundamental = FundamentalValue(f["kappa"], f["mean"], f["shock"], f["prob"], self.rng.stream("fundamental"))
 
 
         for s in j["symbols"]:
             self.orderbooks[s] = OrderBook(self, (j["symbols"])[s], s)
             self.startingPrices[s] = (j["symbols"])[s]
 
+        # All groups are known before any agent is created, as agents keep statistics per group
+        for s in j["agents"]:
+            self.agentGroups.append(s["name"])
+
         for s in j["agents"]:
             count = 1
 
             if "count" in s:
                 count = s["count"]
 
-            self.agentGroups.append(s["name"])
-            
-            for i in range(count):
-                p: str = ""
+            group: list = list()
+
+            if s.get("population", False):
+                population: PopulationZI = PopulationZI(s, self)
+                group = population.members
+                self.listeners.append(population)
+                self.accounts.append(population)
+            else:
+                for i in range(count):
+                    p: str = ""
+
+                    if count > 1:
+                        p = str(i)
+
+                    group.append(Agent.fromJson(s, self, p))
+
+                self.listeners += group
+
+                if len(self.accounts) > 0 and isinstance(self.accounts[-1], AgentAccounts):
+                    self.accounts[-1].agents += group
+                else:
+                    self.accounts.append(AgentAccounts(list(group)))
 
-                if count > 1:
-                    p = str(i)
+            self.agents += group
 
-                self.agents.append(Agent.fromJson(s, self, p))
+            # Poisson agents are woken up by arrival processes, one for the whole group or one per agent
+            poissonAgents: list = [a for a in group if isinstance(a, (PoissonAgent, PopulationMember))]
 
-        for a in self.agents:
+            if self.mergePoisson and len(poissonAgents) > 0:
+                PoissonArrivals(self, poissonAgents, self.rng.stream("arrivals", s["name"])).start()
+            else:
+                for a in poissonAgents:
+                    PoissonArrivals(self, [a], self.rng.stream("arrivals", a.name)).start()
+
+        for i in range(len(self.agents)):
+            self.agents[i].agentID = i
+
+        for a in self.listeners:
             for s in self.startingPrices:
                 a.sharePrices[s] = self.startingPrices[s]
 
+            if a.heartbeat:
+                self.heartbeatAgents.append(a)
+
+        if self.heartbeatInterval is not None:
+            self.pushEvent(EventHeartbeat(self.heartbeatInterval, self, 0))
+
+    # Returns the file the trade tape of the given symbol moves trades to, or None to use a temporary file
+    def getTapeFile(self, symbol: str) -> str:
+        if self.tapeFile is None:
+            return None
+        return self.tapeFile + "." + symbol
+
     # Information about each trade will be sent to each agent. 
     # One event per agent per trade (as each agent receives information about the trade at a different time).
+    # A population receives it once for all of its members.
     def broadcastTradeInfo(self, trades):
         for trade in trades:
             self.tradesCount = self.tradesCount + 1
-            for agent in self.agents:
+            for agent in self.listeners:
                 latency: float = agent.latencyFunction.getLatency()
                 if trade.timestamp + latency > agent.orderBlockTime:
                     self.eventQueue.queueEvent(EventMarketData(trade.timestamp + latency, trade, agent))
 
+    # Information about all trades from one batch of orders is sent to each agent as a single message.
+    def broadcastTradeBatch(self, trades: list):
+        if len(trades) == 0:
+            return
+
+        self.tradesCount += len(trades)
+        timestamp: float = trades[len(trades) - 1].timestamp
+
+        for agent in self.listeners:
+            latency: float = agent.latencyFunction.getLatency()
+            if timestamp + latency > agent.orderBlockTime:
+                self.eventQueue.queueEvent(EventMarketDataBatch(timestamp + latency, trades, agent))
+
+    # Sends a heartbeat: an empty trade at the current price of each symbol, only to agents which want heartbeats.
+    # Agents which are ignoring market data at the given time are skipped.
+    def sendHeartbeat(self, timestamp: float):
+        for o in self.orderbooks:
+            trade: Trade = Trade(None, None, None, None, self.orderbooks[o].price, o, 0, timestamp)
+
+            for agent in self.heartbeatAgents:
+                latency: float = agent.latencyFunction.getLatency()
+                if timestamp + latency > agent.orderBlockTime:
+                    self.eventQueue.queueEvent(EventMarketData(timestamp + latency, trade, agent))
+
+    # Sends an execution report to the agent owning the reported order, which receives it after its latency
+    def sendExecutionReport(self, report: 'ExecutionReport'):
+        agent: 'Agent' = report.order.agent
+        self.eventQueue.queueEvent(EventExecutionReport(report.timestamp + agent.latencyFunction.getLatency(), report, agent))
+
+    # Takes a snapshot of the cash, shares of the given symbol, and order counts of all agents, one record per entry in self.accounts
+    # Populations only record the members which changed since the last snapshot for the symbol
+    def snapshotAccounts(self, symbol: str) -> list:
+        return [account.snapshot(symbol) for account in self.accounts]
+
     # Add an event to the event queue
     def pushEvent(self, event: Event):
         self.eventQueue.queueEvent(event)
@@ -90,6 +246,11 @@ class Simulation:
         o.orderID = cancelID
         return o
 
+    # Turns an order into a replace order, which cancels the order with the specified order ID and takes its place in one message.
+    def makeReplaceOrder(self, order: Order, replaceID: uuid) -> Order:
+        order.replaceID = replaceID
+        return order
+
     # Runs the simulation
     def run(self):
         events = 0
@@ -99,16 +260,25 @@ class Simulation:
 
         while True:
             if self.eventQueue.isEmpty():
-                for o in self.orderbooks:
-                    self.broadcastTradeInfo([Trade(None, None, None, None, self.orderbooks[o].price, o, 0, timestamp)])
-
-            if self.eventQueue.isEmpty():
+                # Nothing is scheduled, so skip ahead to the earliest time a heartbeat agent accepts market data again, and wake it up
                 t: float = float("inf")
 
-                for a in self.agents:
-                    t = min(a.orderBlockTime, t)
-                
+                for a in self.heartbeatAgents:
+                    t = min(max(a.orderBlockTime, timestamp), t)
+
+                # If no agent can ever be woken up, nothing else will happen
+                if t > self.maxTime:
+                    break
+
                 timestamp = t
+
+                for o in self.orderbooks:
+                    trade: Trade = Trade(None, None, None, None, self.orderbooks[o].price, o, 0, timestamp)
+
+                    for a in self.heartbeatAgents:
+                        if a.orderBlockTime <= timestamp:
+                            self.eventQueue.queueEvent(EventMarketData(timestamp + a.latencyFunction.getLatency(), trade, a))
+
                 continue
 
             events += 1
@@ -128,22 +298,23 @@ class Simulation:
 
 # Some agents as described in an article use a global simulation fundamental to model the price instead of using market data.    
 class FundamentalValue:
-    def __init__(self, kappa: float, mean: float, shock: float, shockProb: float):
+    def __init__(self, kappa: float, mean: float, shock: float, shockProb: float, random: RandomStream):
         self.kappa = kappa
         self.mean = mean
         self.shock = shock
         self.shockProb = shockProb
+        self.random = random
 
         self.series = list()
-        self.series.append(np.random.normal(self.mean, self.shock))
+        self.series.append(self.random.normal(self.mean, self.shock))
 
     # Calculates the fundamental's value up to the given time
     def computeTo(self, num: int):
         while len(self.series) < num:
             last: float = self.series[len(self.series) - 1]
 
-            if random.random() < self.shockProb:
-                self.series.append(np.random.normal(self.mean * self.kappa + last * (1 - self.kappa), self.shock))
+            if self.random.random() < self.shockProb:
+                self.series.append(self.random.normal(self.mean * self.kappa + last * (1 - self.kappa), self.shock))
             else:
                 self.series.append(last)
 
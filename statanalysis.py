@@ -2,62 +2,69 @@ import pandas as pd
 import numpy as np
 
 # This class compiles and prints statistics from multiple runs of a given simulation, after they have all been run.
+# Stats files are read in chunks of chunkSize rows, so only the compiled statistics need to fit in memory.
+# The breakdown by agent group can be limited to some groups, in which case only their columns are read.
 class StatsAnalyzer:
-    def __init__(self, dir: str, amount: int):
+    def __init__(self, dir: str, amount: int, groups: list = None, chunkSize: int = 10000):
         self.dir: str = dir
         self.amount: int = amount
         self.data = dict()
         self.rows = 0
 
-        df0 = df = pd.read_csv(dir + "0.csv")
+        df0 = pd.read_csv(dir + "0.csv", nrows=0)
         self.agentGroups = list()
 
         for i in range(len(df0.columns)):
             if i - 8 >= 0 and (i - 8) % 5 == 0:
-                self.agentGroups.append(df0.columns.values[i])
+                if groups is None or df0.columns.values[i] in groups:
+                    self.agentGroups.append(df0.columns.values[i])
 
-        for i in range(amount):
-            df = pd.read_csv(dir + str(i) + ".csv")
-            
-            index = 0
-
-            for row in df["Agent"]:
-                if not(row in self.data):
-                    self.data[row] = AgentStats(row, self.agentGroups)
-
-                self.data[row].ordersSent += df.loc[index, "OrdersSent"]
-                self.data[row].ordersMatched += df.loc[index, "OrdersMatched"]
-                self.data[row].ordersCanceled += df.loc[index, "OrdersCanceled"]
-                self.data[row].ordersStanding += df.loc[index, "OrdersStanding"]
-
-                if not np.isnan(df.loc[index, "AveragePriceTraded"]): # fix amounts
-                    self.data[row].transactPriceSum += df.loc[index, "AveragePriceTraded"]
-                    self.data[row].tradedPresentCount += 1
-
-                if not np.isnan(df.loc[index, "AveragePriceBuy"]):
-                    self.data[row].transactPriceSumBuy += df.loc[index, "AveragePriceBuy"]
-                    self.data[row].boughtPresentCount += 1
+        columns = list(df0.columns.values[:8])
 
-                if not np.isnan(df.loc[index, "AveragePriceSell"]):
-                    self.data[row].transactPriceSumSell += df.loc[index, "AveragePriceSell"]
-                    self.data[row].soldPresentCount += 1
+        for agent in self.agentGroups:
+            columns += [agent, agent + "BuyCount", agent + "BuyPrice", agent + "SellCount", agent + "SellPrice"]
 
-                for agent in self.data[row].transactAgents:
-                    self.data[row].transactAgents[agent] += df.loc[index, agent]
-                    self.data[row].transactAgentBuyCount[agent] += df.loc[index, agent + "BuyCount"]
-                    self.data[row].transactAgentSellCount[agent] += df.loc[index, agent + "SellCount"]
-
-                    if not np.isnan(df.loc[index, agent + "BuyPrice"]):
-                        self.data[row].transactAgentBuyPrices[agent] += df.loc[index, agent + "BuyPrice"]
-                        self.data[row].agentBoughtPresentCount[agent] += 1
-
-                    if not np.isnan(df.loc[index, agent + "SellPrice"]):
-                        self.data[row].transactAgentSellPrices[agent] += df.loc[index, agent + "SellPrice"]
-                        self.data[row].agentSoldPresentCount[agent] += 1
-
-                index += 1
-
-            del df
+        for i in range(amount):
+            for df in pd.read_csv(dir + str(i) + ".csv", usecols=columns, chunksize=chunkSize):
+                self.addRows(df)
+
+    # Adds the stats of a chunk of agents from one run
+    def addRows(self, df):
+        for index in df.index:
+            row = df.loc[index, "Agent"]
+
+            if not(row in self.data):
+                self.data[row] = AgentStats(row, self.agentGroups)
+
+            self.data[row].ordersSent += df.loc[index, "OrdersSent"]
+            self.data[row].ordersMatched += df.loc[index, "OrdersMatched"]
+            self.data[row].ordersCanceled += df.loc[index, "OrdersCanceled"]
+            self.data[row].ordersStanding += df.loc[index, "OrdersStanding"]
+
+            if not np.isnan(df.loc[index, "AveragePriceTraded"]): # fix amounts
+                self.data[row].transactPriceSum += df.loc[index, "AveragePriceTraded"]
+                self.data[row].tradedPresentCount += 1
+
+            if not np.isnan(df.loc[index, "AveragePriceBuy"]):
+                self.data[row].transactPriceSumBuy += df.loc[index, "AveragePriceBuy"]
+                self.data[row].boughtPresentCount += 1
+
+            if not np.isnan(df.loc[index, "AveragePriceSell"]):
+                self.data[row].transactPriceSumSell += df.loc[index, "AveragePriceSell"]
+                self.data[row].soldPresentCount += 1
+
+            for agent in self.data[row].transactAgents:
+                self.data[row].transactAgents[agent] += df.loc[index, agent]
+                self.data[row].transactAgentBuyCount[agent] += df.loc[index, agent + "BuyCount"]
+                self.data[row].transactAgentSellCount[agent] += df.loc[index, agent + "SellCount"]
+
+                if not np.isnan(df.loc[index, agent + "BuyPrice"]):
+                    self.data[row].transactAgentBuyPrices[agent] += df.loc[index, agent + "BuyPrice"]
+                    self.data[row].agentBoughtPresentCount[agent] += 1
+
+                if not np.isnan(df.loc[index, agent + "SellPrice"]):
+                    self.data[row].transactAgentSellPrices[agent] += df.loc[index, agent + "SellPrice"]
+                    self.data[row].agentSoldPresentCount[agent] += 1
 
     # For each agent, prints numbers of orders sent, matched, canceled, and remaining in the order book;
     # average price at which the agent traded in general, 
@@ -1,10 +1,13 @@
-from agents import *
-from order import *
-from orderbook import *
-from trade import *
-from simulation import *
-from tests import *
+from simulation import Simulation, version
+from cache import ResultCache, configHash, runSeed
+from rolling import RunningStats
+import csv
+import json
+import math
 import multiprocessing
+import os
+import queue
+import shutil
 
 # File structure:
 # All simulations and simulation data are stored in the /runs folder
@@ -13,28 +16,248 @@ import multiprocessing
 # When n simulations of a setup are run, their results are saved in CSV files.
 # The CSV files starting with "output" save metrics as they change over time
 # Those starting with "stats" save single value metrics from the whole simulation, after it has been finished
+# Those starting with "bars" save the OHLCV bars of the intervals set in the config's "bars", if any
+# Results are also kept in the /cache folder, keyed by the hash of the config file, the run index and the simulator version,
+# so running a setup again only runs the simulations whose results are not there yet
 
 # Runs a simulation inside the "runs" folder, with the given name and run index
-def runSimulation(name: str, num: int):
+# The run's seed is derived from the config file and the run index, so each run can be reproduced
+# If a result cache is given and it already has the run's results, those are copied instead of running the simulation again
+# Returns the paths of the output and stats files
+def runSimulation(name: str, num: int, cache: ResultCache = None) -> tuple:
+    file: str = "runs/" + name + "/simulation.json"
+    output: str = "runs/" + name + "/output" + str(num) + ".csv"
+    stats: str = "runs/" + name + "/stats" + str(num) + ".csv"
+    bars: str = "runs/" + name + "/bars" + str(num) + ".csv"
+
+    hash: str = configHash(file)
+
+    if cache is not None:
+        key: str = cache.key(hash, num, version)
+        path: str = cache.get(key)
+
+        if path is not None:
+            print("Using cached simulation " + str(num))
+            shutil.copyfile(path + "/output.csv", output)
+            shutil.copyfile(path + "/stats.csv", stats)
+
+            if os.path.exists(path + "/bars.csv"):
+                shutil.copyfile(path + "/bars.csv", bars)
+
+            return (output, stats)
+
     print("Running simulation " + str(num))
-    simulation = Simulation("runs/" + name + "/simulation.json")
+    simulation = Simulation(file, runSeed(hash, num), num)
     simulation.run()
     simulation.orderbooks["A"].calculateVolatility(20000)
-    simulation.orderbooks["A"].write("runs/" + name + "/output" + str(num) + ".csv")
-    simulation.orderbooks["A"].writeStats("runs/" + name + "/stats" + str(num) + ".csv")
+    simulation.orderbooks["A"].write(output)
+    simulation.orderbooks["A"].writeStats(stats)
+    files: dict = {"output.csv": output, "stats.csv": stats}
+
+    if len(simulation.orderbooks["A"].bars) > 0:
+        simulation.orderbooks["A"].writeBars(bars)
+        files["bars.csv"] = bars
+
+    if cache is not None:
+        cache.put(key, files)
 
     print("Finished simulation " + str(num))
+    return (output, stats)
+
+# Reads single value metrics of a run from its output file:
+# "Average <metric>" and "Final <metric>" for each market metric, like "Average Gap" for the average spread,
+# and "Final <metric>/<group>" for the final cash, shares and net worth of each agent group, averaged over the group's agents
+def runMetrics(file: str, output: str) -> dict:
+    with open(file) as f:
+        j = json.loads(f.read())
+
+    # Agents are named like in Agent's fromJson(), by their group's name, followed by their index if there are several of them
+    groups: dict = dict()
+
+    for s in j["agents"]:
+        count: int = s.get("count", 1)
+
+        for i in range(count):
+            p: str = ""
+
+            if count > 1:
+                p = str(i)
+
+            groups[s["name"] + p] = s["name"]
+
+    with open(output) as f:
+        reader = csv.reader(f)
+        header: list = next(reader)
+
+        market: list = [i for i in range(1, len(header)) if "/" not in header[i]]
+
+        # The gap is -1 while one side of the book is empty, which is left out of its average
+        sentinel: list = [header[i] == "Gap" for i in range(len(header))]
+        sums: list = [0.0] * len(header)
+        counts: list = [0] * len(header)
+        last: list = None
+
+        for row in reader:
+            for i in market:
+                value: float = float(row[i])
+
+                if math.isfinite(value) and not (sentinel[i] and value < 0):
+                    sums[i] += value
+                    counts[i] += 1
+
+            last = row
+
+    metrics: dict = dict()
+
+    if last is None:
+        return metrics
+
+    for i in market:
+        metrics["Average " + header[i]] = sums[i] / counts[i] if counts[i] > 0 else math.nan
+        metrics["Final " + header[i]] = float(last[i])
+
+    totals: dict = dict()
+
+    for i in range(len(header)):
+        if header[i].startswith(("Cash/", "Shares/", "Net Worth/")):
+            (metric, agent) = header[i].split("/", 1)
+
+            if agent in groups:
+                key: str = "Final " + metric + "/" + groups[agent]
+                (total, count) = totals.get(key, (0.0, 0))
+                totals[key] = (total + float(last[i]), count + 1)
+
+    for key in totals:
+        metrics[key] = totals[key][0] / totals[key][1]
+
+    return metrics
+
+# Runs a simulation like runSimulation(), and returns its run index and metrics
+# Metrics are kept in the cache too, next to the run's results
+def runReplication(name: str, num: int, cache: ResultCache = None) -> tuple:
+    file: str = "runs/" + name + "/simulation.json"
+    (output, stats) = runSimulation(name, num, cache)
+
+    path: str = None
+
+    if cache is not None:
+        key: str = cache.key(configHash(file), num, version)
+        path = cache.get(key)
+
+        if path is not None and os.path.exists(path + "/metrics.json"):
+            with open(path + "/metrics.json") as f:
+                return (num, json.loads(f.read()))
+
+    metrics: dict = runMetrics(file, output)
+
+    if path is not None:
+        metricsFile: str = "runs/" + name + "/metrics" + str(num) + ".json"
+
+        with open(metricsFile, "w") as f:
+            f.write(json.dumps(metrics))
+
+        cache.add(key, "metrics.json", metricsFile)
+
+    return (num, metrics)
+
+# Smallest number of values (runs, or antithetic pairs) runAdaptive stops after
+# With fewer, the interval width itself is too uncertain to stop on, and the t quantile approximation is too low without scipy (see RunningStats)
+minSamples: int = 10
+
+# Runs simulations of a setup in parallel until the chosen metrics are known precisely enough, instead of a fixed number of times
+# Metrics are given as a dict of metric name (see runMetrics()) -> target width of the metric's confidence interval
+# Simulations are run until every metric's interval is at most its target width, with at least minRuns (and minSamples values) and at most maxRuns simulations
+# Metrics are aggregated in order of run index, so the same runs are used no matter which ones finish first
+# With an antithetic config, the runs of a pair are not independent, so each pair is aggregated as one value, the average of its runs,
+# and simulations only stop after whole pairs (maxRuns is rounded down to whole pairs)
+# Returns a dict of metric name -> RunningStats of the metric over the runs (or pairs)
+def runAdaptive(name: str, metrics: dict, minRuns: int = 10, maxRuns: int = 100, confidence: float = 0.95, processes: int = None, cache: ResultCache = None) -> dict:
+    if cache is None:
+        cache = ResultCache()
+
+    with open("runs/" + name + "/simulation.json") as f:
+        j = json.loads(f.read())
+
+    # Number of runs aggregated together
+    size: int = 2 if j.get("antithetic", False) else 1
+    maxRuns -= maxRuns % size
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    stats: dict = dict()
+
+    for metric in metrics:
+        stats[metric] = RunningStats()
+
+    pool = multiprocessing.Pool(processes)
+
+    # Finished runs, or errors, are put in this queue by the pool
+    finished: queue.Queue = queue.Queue()
+
+    # Finished runs which can't be aggregated yet, as a run with a lower index hasn't finished
+    pending: dict = dict()
+    started: int = 0
+    aggregated: int = 0
+
+    while started < min(processes, maxRuns):
+        pool.apply_async(runReplication, (name, started, cache), callback=finished.put, error_callback=finished.put)
+        started += 1
+
+    try:
+        while aggregated < started:
+            result = finished.get()
+
+            if isinstance(result, BaseException):
+                raise result
+
+            pending[result[0]] = result[1]
+
+            while all(aggregated + i in pending for i in range(size)):
+                group: list = [pending.pop(aggregated + i) for i in range(size)]
+
+                for metric in metrics:
+                    if any(metric not in values for values in group):
+                        raise Exception("Unknown metric " + metric)
+
+                    stats[metric].add(sum(values[metric] for values in group) / size)
+
+                aggregated += size
+
+            if aggregated >= max(minRuns, minSamples * size) and all(stats[metric].intervalWidth(confidence) <= metrics[metric] for metric in metrics):
+                break
+
+            if started < maxRuns:
+                pool.apply_async(runReplication, (name, started, cache), callback=finished.put, error_callback=finished.put)
+                started += 1
+    finally:
+        # Simulations which are still running are not needed
+        pool.terminate()
+        pool.join()
+
+    print("Finished after " + str(aggregated) + " simulations")
+
+    for metric in metrics:
+        print(metric + ": " + str(stats[metric].mean()) + " +- " + str(stats[metric].intervalWidth(confidence) / 2))
+
+    return stats
 
 # Runs multiple simulations of the same configuration in parallel
 # This will use up your CPU and RAM quite intensely, especially if running large numbers of simulations
-def runMultipleSimulations(name: str, count: int):
+# Runs which are already in the cache are not run again
+def runMultipleSimulations(name: str, count: int, cache: ResultCache = None):
+    if cache is None:
+        cache = ResultCache()
+
     for i in range(count):
-        p = multiprocessing.Process(target=runSimulation, args=(name, i,))
+        p = multiprocessing.Process(target=runSimulation, args=(name, i, cache,))
         p.start()
 
 def main():
     # Edit this line to specify which setup you want to run simulations for, and how many simulations to run
     runMultipleSimulations("3speedsqa", 100)
+    # Or, to run simulations only until the metrics you care about are precise enough (at most 100 here):
+    # runAdaptive("3speedsqa", {"Average Gap": 1, "Final Net Worth/sqa-agent": 1000}, 10, 100)
     # After running this, run the tester and grapher files to compile an analysis of the simulations' data
 
 if __name__ == '__main__':
@@ -1,7 +1,22 @@
 import unittest
-from simulation import Simulation
+import contextlib
+import io
+import os
+import tempfile
+import json
+import numpy
+from grapher import StreamingAggregator, resampleRun, loadRun
+from plotting import downsample
+from simulation import Simulation, FundamentalValue
+from events import EventHeartbeat, EventSendOrderbook, PoissonArrivals
 from order import Order
 from orderbook import OrderBook
+from trade import Trade, TradeTape, MatchStats, OHLCVBars
+from agents import Agent, PopulationZI, AlgorithmZI, LatencyFunctionLinear, LatencyFunctionEmpirical
+from rng import RandomService
+from rolling import RollingWindow, RunningStats
+from cache import ResultCache, configHash, runSeed
+from tester import runMetrics, runAdaptive
 
 # Tests to verify the matching engine is working correctly
 
@@ -149,4 +164,749 @@ class Tests(unittest.TestCase):
         self.assertEqual(book._getSellList(), [5, 100])
         self.assertEqual(book._getTrades(), [35, 80, 20, 90, 5, 100])
 
+    def testMarketData(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        self.assertEqual(book.bestBid(), None)
+        self.assertEqual(book.spread(), None)
+
+        book.input(Order(None, True, "A", 10, 98, 1))
+        book.input(Order(None, True, "A", 20, 98, 2))
+        book.input(Order(None, True, "A", 30, 97, 3))
+        book.input(Order(None, False, "A", 40, 102, 4))
+        self.assertEqual(book.bestBid(), 98)
+        self.assertEqual(book.bestAsk(), 102)
+        self.assertEqual(book.spread(), 4)
+        self.assertEqual(book.mid(), 100)
+        self.assertEqual(book.depthAtPrice(98, True), 30)
+        self.assertEqual(book.depthAtPrice(98, False), 0)
+        self.assertEqual(book.bookSize, 100)
+
+        book.input(Order(None, False, "A", 25, 98, 5))
+        self.assertEqual(book.bestBid(), 98)
+        self.assertEqual(book.depthAtPrice(98, True), 5)
+        self.assertEqual(book.bookSize, 75)
+
+    def testCancel(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        best: Order = Order(None, True, "A", 10, 98, 1)
+        book.input(best)
+        book.input(Order(None, True, "A", 20, 97, 2))
+        book.input(Simulation().makeCancelOrder(None, best.orderID, 3))
+        self.assertEqual(book.bestBid(), 97)
+        self.assertEqual(book.depthAtPrice(98, True), 0)
+        self.assertEqual(book._getBuyList(), [20, 97])
+
+    def testAgentOrders(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        agent1: Agent = Agent("a1", None, 0, {"A": 0})
+        agent2: Agent = Agent("a2", None, 0, {"A": 0})
+        order: Order = Order(agent1, True, "A", 10, 98, 1)
+        book.input(order)
+        book.input(Order(agent1, True, "A", 10, 97, 2))
+        book.input(Order(agent2, False, "A", 10, 98, 3))
+        self.assertEqual(book.getAgentOrderCount(agent1), 1)
+        self.assertEqual(book.getAgentOrderCount(agent2), 0)
+        self.assertFalse(order.orderID in book.getAgentOrders(agent1))
+
+        book.input(Order(agent2, False, "A", 5, 99, 4))
+        self.assertEqual(book.getAgentOrderCount(agent2), 1)
+
+    def testExpiry(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        book.input(Order(None, True, "A", 10, 98, 1, 5))
+        book.input(Order(None, True, "A", 10, 97, 2, 10))
+        book.input(Order(None, False, "A", 5, 98, 3))
+        self.assertEqual(book._getTrades(), [5, 98])
+
+        book.input(Order(None, False, "A", 5, 98, 6))
+        self.assertEqual(book._getTrades(), [5, 98])
+        self.assertEqual(book._getBuyList(), [10, 97])
+        self.assertEqual(book._getSellList(), [5, 98])
+
+        book.expireOrders(10)
+        self.assertEqual(book._getBuyList(), [])
+        self.assertEqual(book.bookSize, 5)
+
+    def testExpiryPartialFills(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        book.input(Order(None, True, "A", 10, 98, 1, 20))
+
+        for i in range(4):
+            book.input(Order(None, False, "A", 1, 98, 2 + i))
+
+        self.assertEqual(len(book.expiryHeap), 1)
+        self.assertEqual(book.bestBid(), 98)
+        self.assertEqual(book.bestBid(20), None)
+        self.assertEqual(book.depthAtPrice(98, True, 20), 0)
+
+        # Market data only skips expired orders; they are removed when the book is next used
+        self.assertEqual(book.depthAtPrice(98, True), 6)
+        book.expireOrders(20)
+        self.assertEqual(book.bestBid(), None)
+
+    def testExpiredSnapshot(self):
+        simulation: Simulation = Simulation(seed=1)
+        book: OrderBook = OrderBook(simulation, 100, "A")
+        simulation.orderbooks["A"] = book
+        simulation.agentGroups.append("a")
+        agent: Agent = Agent("a", simulation, 10000, {"A": 100})
+        agent.groupID = 0
+        book.input(Order(agent, True, "A", 10, 98, 1, 150))
+        book.input(Order(agent, True, "A", 10, 97, 1))
+
+        # A snapshot requested at 100 and delivered at 200 still has the order expiring at 150, which stays in the book
+        snapshot: EventSendOrderbook = EventSendOrderbook(200, agent, "A", 5, 100)
+        self.assertEqual([o[3].price for o in snapshot.lastBuyBook], [98, 97])
+        self.assertEqual(book.bestBid(), 98)
+        self.assertEqual(book.bestBid(150), 97)
+        self.assertEqual([o[3].price for o in EventSendOrderbook(300, agent, "A", 5, 150).lastBuyBook], [97])
+
+        # It can still be matched until it expires
+        book.input(Order(agent, False, "A", 4, 98, 149))
+        self.assertEqual(book._getTrades(), [4, 98])
+        book.input(Order(agent, False, "A", 4, 98, 150))
+        self.assertEqual(book._getTrades(), [4, 98])
+        self.assertEqual(book._getBuyList(), [10, 97])
+
+    def testImmediateOrCancel(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        book.input(Order(None, False, "A", 10, 100, 1))
+        book.input(Order(None, False, "A", 10, 102, 2))
+        book.input(Order(None, True, "A", 15, 101, 3, timeInForce="ioc"))
+        self.assertEqual(book._getTrades(), [10, 100])
+        self.assertEqual(book._getBuyList(), [])
+        self.assertEqual(book._getSellList(), [10, 102])
+
+        book.input(Order(None, True, "A", 5, 99, 4, timeInForce="ioc"))
+        self.assertEqual(book._getBuyList(), [])
+
+    def testFillOrKill(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        book.input(Order(None, False, "A", 10, 100, 1))
+        book.input(Order(None, False, "A", 10, 102, 2))
+        book.input(Order(None, True, "A", 15, 101, 3, timeInForce="fok"))
+        self.assertEqual(book._getTrades(), [])
+        self.assertEqual(book._getSellList(), [10, 100, 10, 102])
+
+        book.input(Order(None, True, "A", 15, 102, 4, timeInForce="fok"))
+        self.assertEqual(book._getTrades(), [10, 100, 5, 102])
+        self.assertEqual(book._getSellList(), [5, 102])
+        self.assertEqual(book._getBuyList(), [])
+
+    def testReplace(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        old: Order = Order(None, True, "A", 10, 98, 1)
+        book.input(old)
+        book.input(Order(None, False, "A", 5, 101, 2))
+
+        new: Order = Order(None, True, "A", 8, 101, 3)
+        new.replaceID = old.orderID
+        book.input(new)
+        self.assertEqual(book._getTrades(), [5, 101])
+        self.assertEqual(book._getBuyList(), [3, 101])
+        self.assertEqual(book.depthAtPrice(98, True), 0)
+
+    def testBatch(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        resting: Order = Order(None, True, "A", 10, 98, 1)
+        book.input(resting)
+        book.inputBatch([Order(None, False, "A", 5, 101, 2), Order(None, True, "A", 10, 101, 2), Simulation().makeCancelOrder(None, resting.orderID, 2)])
+        self.assertEqual(book._getTrades(), [5, 101])
+        self.assertEqual(book._getBuyList(), [5, 101])
+        self.assertEqual(len(book.datapoints), 2)
+
+    def testExecutionReports(self):
+        simulation: Simulation = Simulation(seed=1)
+        simulation.maxTime = 100
+        book: OrderBook = OrderBook(simulation, 100, "A")
+        simulation.orderbooks["A"] = book
+        simulation.agentGroups.append("a")
+        reports: dict = dict()
+
+        for name in ("seller", "buyer"):
+            agent: Agent = Agent(name, simulation, 10000, {"A": 10})
+            agent.groupID = 0
+            agent.executionReports = True
+            agent.latencyFunction = LatencyFunctionLinear(agent, {"min": 1, "max": 1})
+            reports[name] = list()
+            agent.inputExecutionReport = lambda report, timestamp, name=name: reports[name].append(report)
+            simulation.agents.append(agent)
+
+        seller: Agent = simulation.agents[0]
+        buyer: Agent = simulation.agents[1]
+        book.input(Order(seller, False, "A", 10, 100, 1))
+        book.input(Order(buyer, True, "A", 4, 100, 2))
+        book.input(Order(buyer, True, "A", 8, 101, 3))
+        simulation.run()
+
+        self.assertEqual([(r.type, r.amount, r.remaining, r.price) for r in reports["seller"]], [("partial", 4, 6, 100), ("fill", 6, 0, 100)])
+        self.assertEqual([(r.type, r.amount, r.remaining, r.price) for r in reports["buyer"]], [("fill", 4, 0, 100), ("partial", 6, 2, 100)])
+        self.assertEqual([r.timestamp for r in reports["buyer"]], [2, 3])
+        self.assertEqual(book._getBuyList(), [2, 101])
+
+    def testEarlyCancel(self):
+        book: OrderBook = OrderBook(None, 0, "A")
+        order: Order = Order(None, True, "A", 10, 98, 1)
+        book.expectOrder(order)
+        book.input(Simulation().makeCancelOrder(None, order.orderID, 2))
+        book.input(order)
+        self.assertEqual(book._getBuyList(), [])
+        self.assertEqual(len(book.earlyCancels), 0)
+
+    def testRejectedReplace(self):
+        simulation: Simulation = Simulation(seed=1)
+        simulation.maxTime = 100
+        book: OrderBook = OrderBook(simulation, 100, "A")
+        simulation.orderbooks["A"] = book
+        simulation.fundamental = FundamentalValue(0, 100, 0, 0, simulation.rng.stream("fundamental"))
+
+        agent: Agent = Agent("a", simulation, 50, {"A": 1})
+        agent.sharePrices["A"] = 100
+        agent.latencyFunction = LatencyFunctionLinear(agent, {"min": 1, "max": 1})
+        agent.algorithm = AlgorithmZI(agent, {"offsetmin": 0, "offsetmax": 1, "positionmax": 2, "variation": 0})
+        first: list = agent.attemptCreateOrders(1.5, agent.algorithm.getOrders("A", 1.5), "A")
+        self.assertEqual(len(first), 1)
+
+        # The agent can now afford neither side, so its replace order is dropped, but the old order is still canceled
+        agent.shares["A"] = 0
+        self.assertEqual(agent.attemptCreateOrders(2.5, agent.algorithm.getOrders("A", 2.5), "A"), [])
+        self.assertEqual(agent.algorithm.orders, [])
+
+        simulation.run()
+        self.assertEqual(book.getAgentOrderCount(agent), 0)
+        self.assertEqual(agent.canceledOrders, 1)
+
+    def testBatchQueuePosition(self):
+        # Orders received at the same time keep the order they arrived in, whatever their IDs are
+        for i in range(20):
+            book: OrderBook = OrderBook(None, 0, "A")
+            first: Order = Order(None, True, "A", 5, 100, 1)
+            second: Order = Order(None, True, "A", 5, 100, 1)
+            book.inputBatch([first, second])
+            book.input(Order(None, False, "A", 5, 100, 2))
+            self.assertEqual(first.amount, 0)
+            self.assertEqual(second.amount, 5)
+
+    def testPopulation(self):
+        simulation: Simulation = Simulation()
+        book: OrderBook = OrderBook(simulation, 100, "A")
+        simulation.orderbooks["A"] = book
+        simulation.agentGroups.append("zi")
+        population: PopulationZI = PopulationZI({"name": "zi", "count": 3, "balance": 1000, "shares": {"A": 0}, "type": "poisson", "typeargs": {"reentryrate": 1},
+            "algorithm": "zi", "algorithmargs": {"offsetmin": 0, "offsetmax": 1, "positionmax": 5, "variation": 1}, "latency": "linear", "latencyargs": {"min": 1, "max": 1}}, simulation)
+        simulation.agents += population.members
+        simulation.accounts.append(population)
+
+        book.input(Order(population.members[0], True, "A", 2, 100, 1))
+        book.input(Order(population.members[1], False, "A", 2, 100, 2))
+        self.assertEqual(population.members[0].shares["A"], 2)
+        self.assertEqual(population.members[1].balance, 1200)
+        self.assertEqual(population.members[1].matchedOrders, 2)
+        self.assertEqual(population.members[1].matchStats.amount(population.members[1].matchStats.sellRow(0)), 2)
+
+        values: list = list(book.agentValues())
+        self.assertEqual(values[0][0].tolist(), [1000, 1000, 1000])
+        self.assertEqual(values[1][0].tolist(), [800, 1200, 1000])
+        self.assertEqual(values[1][2].tolist(), [2, 2, 0])
+
+    def testPopulationMatchesAgents(self):
+        # With constant latency, a population trades exactly like the same group of separate agents
+        folder: str = tempfile.mkdtemp()
+        runs: list = list()
+
+        for population in (False, True):
+            config: str = os.path.join(folder, "population.json" if population else "agents.json")
+
+            with open(config, "w") as f:
+                f.write(json.dumps({"runtime": 2000, "fundamental": {"kappa": 0.05, "mean": 100, "shock": 1, "prob": 0.2}, "symbols": {"A": 100},
+                    "agents": [{"name": "zi", "count": 4, "balance": 1000, "shares": {"A": 0}, "type": "poisson", "typeargs": {"reentryrate": 0.05},
+                    "algorithm": "zi", "algorithmargs": {"offsetmin": 0, "offsetmax": 2, "positionmax": 5, "variation": 1},
+                    "latency": "linear", "latencyargs": {"min": 1, "max": 1}, "population": population}]}))
+
+            simulation: Simulation = Simulation(config, seed=5)
+            simulation.run()
+            runs.append([(float(t["time"]), float(t["price"]), int(t["amount"]), int(t["buyer"]), int(t["seller"])) for t in simulation.orderbooks["A"].trades])
+
+        self.assertGreater(len(runs[0]), 10)
+        self.assertEqual(runs[0], runs[1])
+
+    def testHeartbeat(self):
+        for interval in (None, 25):
+            simulation: Simulation = Simulation(seed=1)
+            simulation.maxTime = 100
+            simulation.heartbeatInterval = interval
+            simulation.orderbooks["A"] = OrderBook(simulation, 100, "A")
+            times: dict = {"idle": list(), "quiet": list()}
+
+            for name in times:
+                agent: Agent = Agent(name, simulation, 0, {"A": 0})
+                agent.latencyFunction = LatencyFunctionLinear(agent, {"min": 1, "max": 1})
+                simulation.listeners.append(agent)
+
+            # Only the first agent wants heartbeats; it ignores market data for 30 time units after each one
+            def inputData(trade: Trade, timestamp: float, agent: Agent = simulation.listeners[0]):
+                times[agent.name].append(timestamp)
+                agent.orderBlockTime = timestamp + 30
+
+            simulation.listeners[0].inputData = inputData
+            simulation.listeners[1].inputData = lambda trade, timestamp: times["quiet"].append(timestamp)
+            simulation.heartbeatAgents.append(simulation.listeners[0])
+
+            if interval is not None:
+                simulation.pushEvent(EventHeartbeat(interval, simulation, 0))
+
+            simulation.run()
+            self.assertEqual(times["quiet"], [])
+
+            if interval is None:
+                # With nothing scheduled, the simulation skips ahead to when the agent accepts market data again
+                self.assertEqual(times["idle"], [1, 32, 63, 94])
+            else:
+                # Heartbeats at 25 and 50 arrive while the agent is blocked
+                self.assertEqual(times["idle"], [26, 76])
+
+    def testTimerWheel(self):
+        simulation: Simulation = Simulation(seed=1)
+        simulation.maxTime = 600
+        times: dict = dict()
+        agents: dict = dict()
+
+        for name, interval in (("a", 10), ("b", 10), ("c", 250)):
+            agents[name] = Agent(name, simulation, 0, {"A": 0})
+            times[name] = list()
+            agents[name].inputOrders = lambda timestamp, name=name: times[name].append(timestamp)
+            simulation.timerWheel.register(agents[name], interval, interval)
+
+        # Agents due at the same time share one tick event
+        self.assertEqual(len(simulation.eventQueue.queue), 2)
+
+        # The second agent stops its timer when it wakes up at 30
+        def inputOrders(timestamp: float):
+            times["b"].append(timestamp)
+
+            if timestamp == 30:
+                simulation.timerWheel.unregister(agents["b"])
+
+        agents["b"].inputOrders = inputOrders
+        simulation.run()
+
+        self.assertEqual(times["a"], [10 * i for i in range(1, 61)])
+        self.assertEqual(times["b"], [10, 20, 30])
+        self.assertEqual(times["c"], [250, 500])
+
+        # Unregistering the only agent of a slot removes the slot, and unregistering twice does nothing
+        simulation.timerWheel.unregister(agents["c"])
+        simulation.timerWheel.unregister(agents["c"])
+        self.assertEqual(list(simulation.timerWheel.slots), [610])
+
+    def testTimerWheelDrift(self):
+        simulation: Simulation = Simulation(seed=1)
+        simulation.maxTime = 100
+        times: dict = dict()
+
+        # The same interval, started one period apart
+        for name, start in (("a", 0.1), ("b", 0.2)):
+            agent: Agent = Agent(name, simulation, 0, {"A": 0})
+            times[name] = list()
+            agent.inputOrders = lambda timestamp, name=name: times[name].append(timestamp)
+            simulation.timerWheel.register(agent, 0.1, start)
+
+        ticks: list = list()
+        tick = simulation.timerWheel.tick
+
+        def countTicks(time: float):
+            ticks.append(time)
+            tick(time)
+
+        simulation.timerWheel.tick = countTicks
+        simulation.run()
+
+        # Both agents share every tick, and don't drift away from multiples of the interval
+        self.assertEqual(len(ticks), 1000)
+        self.assertEqual(times["a"], [round(0.1 * k, 9) for k in range(1, 1001)])
+        self.assertEqual(times["b"], times["a"][1:])
+
+    def testPoissonArrivals(self):
+        runs: list = list()
+
+        for i in range(2):
+            simulation: Simulation = Simulation(seed=3)
+            simulation.maxTime = 2000
+            arrivals: list = list()
+
+            for name, rate in (("a", 1), ("b", 3)):
+                agent: Agent = Agent(name, simulation, 0, {"A": 0})
+                agent.rate = rate
+                agent.inputOrders = lambda timestamp, name=name: arrivals.append((timestamp, name))
+                simulation.agents.append(agent)
+
+            PoissonArrivals(simulation, simulation.agents, simulation.rng.stream("arrivals", "group")).start()
+            simulation.run()
+            runs.append(arrivals)
+
+        # The merged process arrives at the summed rate, and picks agents in proportion to their rates
+        arrivals: list = runs[0]
+        self.assertAlmostEqual(len(arrivals) / 2000, 4, delta=0.2)
+        self.assertAlmostEqual(sum(1 for a in arrivals if a[1] == "b") / len(arrivals), 0.75, delta=0.03)
+        self.assertTrue(all(arrivals[i][0] < arrivals[i + 1][0] for i in range(len(arrivals) - 1)))
+
+        # The same seed gives the same arrivals
+        self.assertEqual(runs[0], runs[1])
+
+    def testRandomStreams(self):
+        service1: RandomService = RandomService(5, 4)
+        service2: RandomService = RandomService(5, 4)
+        draws1: list = [service1.stream().random() for i in range(3)]
+        draws2: list = [service2.stream().random() for i in range(3)]
+        self.assertEqual(draws1, draws2)
+        self.assertEqual(len(set(draws1)), 3)
+
+        stream = service1.stream()
+        values: list = [stream.randint(1, 3) for i in range(10)]
+        self.assertTrue(all(1 <= v <= 3 for v in values))
+        self.assertTrue(all(stream.exponential(2) >= 0 for i in range(10)))
+
+    def testCommonRandomNumbers(self):
+        service1: RandomService = RandomService(1, 16, 6)
+        service2: RandomService = RandomService(2, 16, 7)
+
+        # An antithetic pair: replications 6 and 7, with pinned latencies
+        for service in (service1, service2):
+            service.pinned.add("latency")
+            service.paired.add("fundamental")
+            service.pairSeed = 3
+
+        service2.mirrored.add("fundamental")
+
+        # Named streams don't depend on the order they are created in
+        self.assertEqual(service1.stream("algorithm", "a").random(), RandomService(1, 16, 6).stream("algorithm", "a").random())
+
+        # Only the fundamental is shared within a pair
+        self.assertNotEqual(service1.stream("latency", "a").random(), service2.stream("latency", "a").random())
+
+        stream1 = service1.stream("fundamental")
+        stream2 = service2.stream("fundamental")
+
+        for i in range(40):
+            self.assertAlmostEqual(stream1.normal(100, 2) - 100, 100 - stream2.normal(100, 2))
+            self.assertEqual(stream1.random(), stream2.random())
+
+    def testEmpiricalLatency(self):
+        agent: Agent = Agent("a", Simulation(seed=1), 0, {"A": 0})
+        path: str = os.path.join(tempfile.mkdtemp(), "latency.csv")
+
+        with open(path, "w") as f:
+            f.write("# latency,count\n5,3\n10,1\n20,0\n")
+
+        latency: LatencyFunctionEmpirical = LatencyFunctionEmpirical(agent, {"histogram": path})
+        samples: list = [latency.getLatency() for i in range(4000)]
+        self.assertEqual(set(samples), {5, 10})
+        self.assertAlmostEqual(samples.count(5) / len(samples), 0.75, delta=0.03)
+
+        # A changed file is loaded again
+        with open(path, "w") as f:
+            f.write("# latency,count\n7,1\n")
+
+        latency = LatencyFunctionEmpirical(agent, {"histogram": path})
+        self.assertEqual(set(latency.getLatency() for i in range(100)), {7})
+
+    def testTradeTape(self):
+        tape: TradeTape = TradeTape(3, None, 2)
+
+        for i in range(7):
+            tape.append(Trade(None, None, None, None, 100 + i, "A", i + 1, i))
+
+        self.assertEqual(len(tape), 7)
+        self.assertEqual(tape.spilled, 6)
+        self.assertEqual(tape.column("price").tolist(), [100, 101, 102, 103, 104, 105, 106])
+        self.assertEqual([int(trade["amount"]) for trade in tape], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(tape.toArray()["buyer"].tolist(), [-1] * 7)
+
+    def testMatchStats(self):
+        stats: MatchStats = MatchStats(2)
+        stats.addBuy(1, 100, 5)
+        stats.addBuy(1, 102, 1)
+        stats.addSell(0, 99, 2)
+
+        self.assertEqual(stats.count(MatchStats.allRow), 3)
+        self.assertAlmostEqual(stats.mean(MatchStats.buyAllRow), 101)
+        self.assertAlmostEqual(stats.variance(stats.buyRow(1)), 1)
+        self.assertEqual(stats.amount(stats.buyRow(1)), 6)
+        self.assertEqual(stats.count(stats.buyRow(0)), 0)
+        self.assertEqual((stats.min(MatchStats.allRow), stats.max(MatchStats.allRow)), (99, 102))
+
+    def testRollingWindow(self):
+        window: RollingWindow = RollingWindow(10, 5)
+        window.add(0, 4)
+        window.add(5, 6)
+        self.assertEqual(window.mean(), 5)
+        self.assertEqual(window.variance(), 1)
+        self.assertAlmostEqual(window.ema, 4 + (1 - 0.5 ** 1) * 2)
+
+        window.add(12, 9)
+        self.assertEqual(len(window), 2)
+        self.assertEqual(window.mean(), 7.5)
+
+        window.add(30, 1)
+        self.assertEqual(window.mean(), 1)
+
+    def testResultCache(self):
+        folder: str = tempfile.mkdtemp()
+        config: str = os.path.join(folder, "a.json")
+        output: str = os.path.join(folder, "output.csv")
+
+        with open(config, "w") as f:
+            f.write('{"b": 1, "a": [1, 2]}')
+        hash: str = configHash(config)
+        with open(config, "w") as f:
+            f.write('{\n  "a": [1, 2],\n  "b": 1\n}')
+        self.assertEqual(configHash(config), hash)
+        self.assertEqual(runSeed(hash, 3), runSeed(hash, 3))
+        self.assertNotEqual(runSeed(hash, 3), runSeed(hash, 4))
+
+        # Input files the config refers to are part of the hash
+        with open(os.path.join(folder, "latency.csv"), "w") as f:
+            f.write("5\n10\n")
+        with open(config, "w") as f:
+            f.write('{"agents": [{"latency": "empirical", "latencyargs": {"samples": "latency.csv"}}]}')
+        latencyHash: str = configHash(config)
+        self.assertEqual(configHash(config), latencyHash)
+
+        with open(os.path.join(folder, "latency.csv"), "w") as f:
+            f.write("5\n11\n")
+        self.assertNotEqual(configHash(config), latencyHash)
+
+        with open(output, "w") as f:
+            f.write("x" * 100)
+
+        cache: ResultCache = ResultCache(os.path.join(folder, "cache"), 250)
+        keys: list = [cache.key(hash, i, "1") for i in range(3)]
+        self.assertNotEqual(cache.key(hash, 0, "2"), keys[0])
+        self.assertIsNone(cache.get(keys[0]))
+
+        cache.put(keys[0], {"output.csv": output})
+        cache.put(keys[1], {"output.csv": output})
+        os.utime(cache.get(keys[0]), (0, 0))
+        cache.get(keys[1])
+        cache.put(keys[2], {"output.csv": output})
+
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertIsNotNone(cache.get(keys[1]))
+        with open(os.path.join(cache.get(keys[2]), "output.csv")) as f:
+            self.assertEqual(f.read(), "x" * 100)
+
+    def testRunningStats(self):
+        stats: RunningStats = RunningStats()
+        self.assertIsNone(stats.mean())
+        stats.add(1e9 + 1)
+        self.assertIsNone(stats.intervalWidth())
+
+        stats.add(1e9 + 2)
+        stats.add(1e9 + 3)
+        self.assertEqual(stats.mean(), 1e9 + 2)
+        self.assertEqual(stats.variance(), 1)
+        # Student's t quantile with 2 degrees of freedom is 4.30
+        self.assertAlmostEqual(stats.intervalWidth(0.95), 2 * 4.30 / 3 ** 0.5, delta=0.2)
+
+        for i in range(1000):
+            stats.add(1e9 + 2)
+        self.assertAlmostEqual(stats.intervalWidth(0.95), 2 * 1.96 * (2 / 1002 / 1002) ** 0.5, delta=1e-4)
+
+    def testRunMetrics(self):
+        folder: str = tempfile.mkdtemp()
+        config: str = os.path.join(folder, "simulation.json")
+        output: str = os.path.join(folder, "output0.csv")
+
+        with open(config, "w") as f:
+            f.write(json.dumps({"agents": [{"name": "zi", "count": 2}, {"name": "mm"}]}))
+
+        with open(output, "w") as f:
+            f.write("Timestamp,Price,Gap,Cash/zi0,Cash/zi1,Cash/mm,Net Worth/mm\n")
+            f.write("0,102,-1,10,20,30,40\n")
+            f.write("1,100,nan,10,20,30,40\n")
+            f.write("2,102,2,50,70,90,110\n")
+            f.write("3,104,4,60,80,100,120\n")
+
+        metrics: dict = runMetrics(config, output)
+        self.assertEqual(metrics["Average Price"], 102)
+
+        # The gap's -1 while one side of the book is empty is left out of its average
+        self.assertEqual(metrics["Final Price"], 104)
+        self.assertEqual(metrics["Average Gap"], 3)
+        self.assertEqual(metrics["Final Cash/zi"], 70)
+        self.assertEqual(metrics["Final Cash/mm"], 100)
+        self.assertEqual(metrics["Final Net Worth/mm"], 120)
+        self.assertNotIn("Average Cash/zi0", metrics)
+
+    def testRunAdaptive(self):
+        folder: str = tempfile.mkdtemp()
+        cache: ResultCache = ResultCache(os.path.join(folder, "cache"))
+        config: dict = {"symbols": {"A": 100}, "fundamental": {"mean": 100, "shock": 1, "kappa": 0.05, "prob": 1}, "runtime": 2000, "agents": [{"count": 5, "name": "zi",
+            "balance": 100000, "type": "poisson", "typeargs": {"reentryrate": 0.01}, "shares": {"A": 0}, "algorithm": "zi",
+            "algorithmargs": {"offsetmin": 0, "offsetmax": 1, "positionmax": 10, "variation": 1}, "latency": "linear", "latencyargs": {"min": 1, "max": 2}}]}
+
+        for name in ("adaptive", "antithetic"):
+            os.makedirs(os.path.join(folder, "runs", name))
+
+            with open(os.path.join(folder, "runs", name, "simulation.json"), "w") as f:
+                f.write(json.dumps(config))
+
+            config["antithetic"] = True
+
+        cwd: str = os.getcwd()
+        os.chdir(folder)
+        self.addCleanup(os.chdir, cwd)
+
+        # The runs' progress messages are not needed
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Stops as soon as the interval is narrow enough, but not before minRuns and minSamples
+            stats: dict = runAdaptive("adaptive", {"Average Price": 1e9}, 12, 20, processes=1, cache=cache)
+            self.assertEqual(stats["Average Price"].count, 12)
+            stats = runAdaptive("adaptive", {"Average Price": 1e9}, 3, 20, processes=1, cache=cache)
+            self.assertEqual(stats["Average Price"].count, 10)
+
+            # Never runs more than maxRuns
+            stats = runAdaptive("adaptive", {"Average Price": 0}, 3, 5, processes=2, cache=cache)
+            self.assertEqual(stats["Average Price"].count, 5)
+            self.assertFalse(os.path.exists(os.path.join(folder, "runs", "adaptive", "output12.csv")))
+
+            # Antithetic runs are aggregated in pairs, and only whole pairs are run
+            stats = runAdaptive("antithetic", {"Average Price": 0}, 2, 7, processes=2, cache=cache)
+            self.assertEqual(stats["Average Price"].count, 3)
+            self.assertFalse(os.path.exists(os.path.join(folder, "runs", "antithetic", "output6.csv")))
+
+            # Each pair counts once, as the average of its runs
+            pairs: RunningStats = RunningStats()
+
+            for i in range(3):
+                with open(os.path.join(folder, "runs", "antithetic", "metrics" + str(2 * i) + ".json")) as f:
+                    first: float = json.loads(f.read())["Average Price"]
+                with open(os.path.join(folder, "runs", "antithetic", "metrics" + str(2 * i + 1) + ".json")) as f:
+                    second: float = json.loads(f.read())["Average Price"]
+
+                pairs.add((first + second) / 2)
+
+            self.assertAlmostEqual(stats["Average Price"].mean(), pairs.mean())
+            self.assertAlmostEqual(stats["Average Price"].variance(), pairs.variance())
+
+    def testBars(self):
+        book: OrderBook = OrderBook(None, 100, "A")
+        book.bars[10] = OHLCVBars(10)
+        book.input(Order(None, False, "A", 5, 100, 3))
+        book.input(Order(None, True, "A", 2, 100, 4))
+        book.input(Order(None, True, "A", 1, 100, 8))
+        book.input(Order(None, False, "A", 4, 99, 30))
+        book.input(Order(None, True, "A", 4, 102, 35))
+
+        expected: list = [[0, 100, 100, 100, 100, 3], [10, 100, 100, 100, 100, 0], [20, 100, 100, 100, 100, 0], [30, 99, 99, 99, 99, 4]]
+        self.assertEqual(book.bars[10].toArray().tolist(), expected)
+        self.assertEqual(OHLCVBars.fromTape(book.trades, 10).toArray().tolist(), expected)
+        self.assertEqual(book.getBars(20).toArray().tolist(), [[0, 100, 100, 100, 100, 3], [20, 99, 99, 99, 99, 4]])
+
+    def testStreamingAggregator(self):
+        values: numpy.ndarray = numpy.random.default_rng(4).normal(size=(2000, 3, 2))
+        aggregator: StreamingAggregator = StreamingAggregator(3, 2)
+
+        for i in range(5):
+            aggregator.add(values[i])
+
+        # Exact while there are at most 5 runs
+        self.assertTrue(numpy.allclose(aggregator.quantile(0.5), numpy.percentile(values[:5], 50, axis=0)))
+
+        for i in range(5, len(values)):
+            aggregator.add(values[i])
+
+        for q in (0.05, 0.5, 0.95):
+            self.assertTrue(numpy.allclose(aggregator.quantile(q), numpy.percentile(values, q * 100, axis=0), atol=0.1))
+
+        self.assertTrue(numpy.allclose(aggregator.mean(), values.mean(axis=0)))
+        self.assertTrue(numpy.allclose(aggregator.variance(), values.var(axis=0, ddof=1)))
+
+    def testChunkedResample(self):
+        path: str = os.path.join(tempfile.mkdtemp(), "output.csv")
+        times: numpy.ndarray = numpy.cumsum(numpy.random.default_rng(5).exponential(3, 500))
+
+        with open(path, "w") as f:
+            f.write("Timestamp,Price,Spread\n")
+
+            for i in range(len(times)):
+                f.write(str(times[i]) + "," + str(100 + i % 7) + "," + str(i % 3) + "\n")
+
+        (columns, whole) = resampleRun((path, 10, None, 100000))
+        self.assertEqual(columns, ["Timestamp", "Price", "Spread"])
+        self.assertEqual(len(whole), int(times[-1] // 10) - int(times[0] // 10))
+
+        for chunkSize in (1, 7, 64):
+            (chunkedColumns, chunked) = resampleRun((path, 10, None, chunkSize))
+            self.assertEqual(chunkedColumns, columns)
+            self.assertTrue(numpy.array_equal(chunked, whole))
+
+        (columns, selected) = resampleRun((path, 10, ["Spread"], 7))
+        self.assertEqual(columns, ["Timestamp", "Spread"])
+        self.assertTrue(numpy.array_equal(selected, whole[:, [0, 2]]))
+
+    def testResampleCache(self):
+        path: str = os.path.join(tempfile.mkdtemp(), "output.csv")
+
+        with open(path, "w") as f:
+            f.write("Timestamp,Price,Volume\n")
+
+            for i in range(100):
+                f.write(str(i * 2.5) + "," + str(100 + i % 5) + "," + str(i) + "\n")
+
+        (columns, values) = loadRun((path, 10, ["Price"], 1000, True))
+        self.assertTrue(os.path.exists(path + ".10.npy"))
+        self.assertTrue(os.path.exists(path + ".10.json"))
+        self.assertEqual(columns, ["Timestamp", "Price"])
+        self.assertTrue(numpy.array_equal(values, resampleRun((path, 10, ["Price"], 1000))[1]))
+
+        # Only the requested columns are cached
+        with open(path + ".10.json") as f:
+            self.assertEqual(json.loads(f.read())["columns"], ["Timestamp", "Price"])
+
+        # Loaded from the cache while the output file is unchanged
+        numpy.save(path + ".10.npy", numpy.zeros((2, len(values))))
+        self.assertTrue(numpy.array_equal(loadRun((path, 10, ["Price"], 1000, True))[1], numpy.zeros((len(values), 2))))
+
+        # Made again when the output file's modification time changes
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(numpy.array_equal(loadRun((path, 10, ["Price"], 1000, True))[1], values))
+
+        # Made again with the columns it had and the requested ones when it lacks some, and only the requested columns are returned
+        (columns, volume) = loadRun((path, 10, ["Volume"], 1000, True))
+        self.assertEqual(columns, ["Timestamp", "Volume"])
+        self.assertTrue(numpy.array_equal(volume, resampleRun((path, 10, ["Volume"], 1000))[1]))
+
+        with open(path + ".10.json") as f:
+            self.assertEqual(json.loads(f.read())["columns"], ["Timestamp", "Price", "Volume"])
+
+        # Made again when its size changes, even with the same modification time
+        with open(path, "a") as f:
+            f.write("250,200,100\n")
+
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        (columns, resized) = loadRun((path, 10, None, 1000, True))
+        self.assertEqual(columns, ["Timestamp", "Price", "Volume"])
+        self.assertEqual(len(resized), len(values) + 1)
+
+    def testDownsample(self):
+        x: numpy.ndarray = numpy.cumsum(numpy.random.default_rng(6).exponential(1, 100000))
+        y: numpy.ndarray = numpy.random.default_rng(7).normal(size=100000)
+        y[31337] = 50
+        y[70001] = -50
+
+        for budget in (10, 101, 4000):
+            (xs, ys) = downsample(x, y, budget)
+            self.assertLessEqual(len(xs), budget)
+            self.assertEqual(ys.max(), 50)
+            self.assertEqual(ys.min(), -50)
+            self.assertEqual((xs[0], xs[-1]), (x[0], x[-1]))
+            self.assertTrue(numpy.all(numpy.diff(xs) > 0))
+            self.assertTrue(numpy.array_equal(ys, y[numpy.searchsorted(x, xs)]))
+
+        # Short lines are kept as they are
+        (xs, ys) = downsample(x[:50], y[:50], 4000)
+        self.assertTrue(numpy.array_equal(ys, y[:50]))
+
     #make more of these
\ No newline at end of file
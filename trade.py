@@ -1,5 +1,7 @@
-from agents import *
-from order import *
+import array
+import numpy
+import os
+import tempfile
 
 # This class is instantiated whenever two orders match, and represents the trade between those two orders
 class Trade:
@@ -24,31 +26,270 @@ class Trade:
         self.seller.matchedOrders += self.amount
         self.completed = True
 
-        self.buyer.pricesMatched.append(self.price)
-        self.seller.pricesMatched.append(self.price)
-        
-        self.buyer.pricesMatchedBuy.append(self.price)
-        self.seller.pricesMatchedSell.append(self.price)
+        self.buyer.matchStats.addBuy(self.seller.groupID, self.price, self.amount)
+        self.seller.matchStats.addSell(self.buyer.groupID, self.price, self.amount)
 
-        if not(self.seller.groupName in self.buyer.agentsMatched):
-            self.buyer.agentsMatched[self.seller.groupName] = 0
+# Running statistics of the trades an agent matched in: in total, as buyer, as seller, and as buyer and seller per counterparty agent group.
+# Stored in one flat array of doubles, so the memory used does not grow with the number of trades.
+# Each row holds the number of trades, the amount traded, and the sum, sum of squares, minimum and maximum of the prices.
+class MatchStats:
+    # Rows for all trades, buys and sells; the rows per group follow these (see buyRow and sellRow)
+    allRow: int = 0
+    buyAllRow: int = 1
+    sellAllRow: int = 2
 
-        if not(self.seller.groupName in self.buyer.agentsMatchedBuy):
-            self.buyer.agentsMatchedBuy[self.seller.groupName] = 0
-            self.buyer.agentPricesMatchedBuy[self.seller.groupName] = list()
+    fields: int = 6
+    emptyRow: list = [0, 0, 0, 0, float("inf"), float("-inf")]
 
-        if not(self.buyer.groupName in self.seller.agentsMatched):
-            self.seller.agentsMatched[self.buyer.groupName] = 0
+    # Takes the number of agent groups in the simulation
+    def __init__(self, groups: int):
+        self.groups: int = groups
+        self.values: array.array = array.array("d", MatchStats.emptyRow * (3 + 2 * groups))
 
-        if not(self.buyer.groupName in self.seller.agentsMatchedSell):
-            self.seller.agentsMatchedSell[self.buyer.groupName] = 0
-            self.seller.agentPricesMatchedSell[self.buyer.groupName] = list()
+    # Rows for trades as buyer and as seller against agents of the group with the given ID
+    def buyRow(self, group: int) -> int:
+        return 3 + 2 * group
 
-        self.buyer.agentsMatched[self.seller.groupName] += self.amount
-        self.seller.agentsMatched[self.buyer.groupName] += self.amount
+    def sellRow(self, group: int) -> int:
+        return 4 + 2 * group
 
-        self.buyer.agentsMatchedBuy[self.seller.groupName] += self.amount
-        self.seller.agentsMatchedSell[self.buyer.groupName] += self.amount
-        
-        self.buyer.agentPricesMatchedBuy[self.seller.groupName].append(self.price)
-        self.seller.agentPricesMatchedSell[self.buyer.groupName].append(self.price)
+    def add(self, row: int, price: float, amount: int):
+        v: array.array = self.values
+        i: int = row * MatchStats.fields
+
+        v[i] += 1
+        v[i + 1] += amount
+        v[i + 2] += price
+        v[i + 3] += price * price
+
+        if price < v[i + 4]:
+            v[i + 4] = price
+
+        if price > v[i + 5]:
+            v[i + 5] = price
+
+    # Records a trade in which the agent bought from an agent of the given group (-1 if it has none)
+    def addBuy(self, group: int, price: float, amount: int):
+        self.add(MatchStats.allRow, price, amount)
+        self.add(MatchStats.buyAllRow, price, amount)
+
+        if group >= 0:
+            self.add(self.buyRow(group), price, amount)
+
+    # Records a trade in which the agent sold to an agent of the given group (-1 if it has none)
+    def addSell(self, group: int, price: float, amount: int):
+        self.add(MatchStats.allRow, price, amount)
+        self.add(MatchStats.sellAllRow, price, amount)
+
+        if group >= 0:
+            self.add(self.sellRow(group), price, amount)
+
+    # Number of trades in a row
+    def count(self, row: int) -> int:
+        return int(self.values[row * MatchStats.fields])
+
+    # Amount of shares traded in a row
+    def amount(self, row: int) -> int:
+        return int(self.values[row * MatchStats.fields + 1])
+
+    # Average price of the trades in a row (nan if there are none)
+    def mean(self, row: int) -> float:
+        count: int = self.count(row)
+
+        if count == 0:
+            return float("nan")
+        return self.values[row * MatchStats.fields + 2] / count
+
+    # Variance of the prices of the trades in a row (nan if there are none)
+    def variance(self, row: int) -> float:
+        count: int = self.count(row)
+
+        if count == 0:
+            return float("nan")
+        return max(0, self.values[row * MatchStats.fields + 3] / count - self.mean(row) ** 2)
+
+    def min(self, row: int) -> float:
+        return self.values[row * MatchStats.fields + 4]
+
+    def max(self, row: int) -> float:
+        return self.values[row * MatchStats.fields + 5]
+
+# Sent by the exchange to the agent owning an order whenever that order fills, partially fills, or is canceled
+# type (str) - "fill" when the order has no quantity left, "partial" when part of it is still resting, "canceled", or "expired"
+# amount (int) - quantity filled by this execution, or quantity removed from the book when canceled
+# remaining (int) - quantity of the order still resting in the book after this report
+class ExecutionReport:
+    def __init__(self, order: 'Order', type: str, amount: int, remaining: int, price: float, timestamp: float):
+        self.order = order
+        self.type = type
+        self.amount = amount
+        self.remaining = remaining
+        self.price = price
+        self.timestamp = timestamp
+
+# Layout of one trade in a TradeTape
+# Agents are stored by their agentID (-1 if there is none), and orders by the bytes of their orderID
+tradeDtype = numpy.dtype([("time", "f8"), ("price", "f8"), ("amount", "i8"), ("buyer", "i8"), ("seller", "i8"), ("buyOrderID", "V16"), ("sellOrderID", "V16")])
+
+# A record of all trades of an order book, stored compactly as a structured NumPy array (see tradeDtype) instead of as Trade objects.
+# When spillSize is set, the trades in memory are appended to a file whenever there are that many, and read back from it with a memory map.
+# The file is spillFile if given, otherwise a temporary file which is deleted along with the tape.
+class TradeTape:
+    def __init__(self, spillSize: int = None, spillFile: str = None, blockSize: int = 4096):
+        self.spillSize: int = spillSize
+        self.spillFile: str = spillFile
+        self.temporary: bool = False
+
+        # Trades which are still in memory; the array grows as needed
+        self.records: numpy.ndarray = numpy.zeros(blockSize, dtype=tradeDtype)
+        self.count: int = 0
+
+        # Number of trades in the spill file, and a memory map of them, opened when they are first read
+        self.spilled: int = 0
+        self.mapped: numpy.ndarray = None
+
+    def __len__(self) -> int:
+        return self.spilled + self.count
+
+    # Iterates over all trades, as records with the fields of tradeDtype
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+    def append(self, trade: Trade):
+        if self.count == len(self.records):
+            self.records = numpy.concatenate([self.records, numpy.zeros(len(self.records), dtype=tradeDtype)])
+
+        self.records[self.count] = (trade.timestamp, trade.price, trade.amount, TradeTape.agentID(trade.buyer), TradeTape.agentID(trade.seller),
+                                    TradeTape.orderID(trade.buyOrder), TradeTape.orderID(trade.sellOrder))
+        self.count += 1
+
+        if self.spillSize is not None and self.count >= self.spillSize:
+            self.spill()
+
+    def agentID(agent: 'Agent') -> int:
+        if agent is None:
+            return -1
+        return agent.agentID
+
+    def orderID(order: 'Order') -> bytes:
+        if order is None:
+            return bytes(16)
+        return order.orderID.bytes
+
+    # Moves the trades in memory to the end of the spill file
+    def spill(self):
+        if self.spillFile is None:
+            (handle, self.spillFile) = tempfile.mkstemp(suffix=".tape")
+            os.close(handle)
+            self.temporary = True
+
+        mode: str = "ab"
+
+        if self.spilled == 0:
+            mode = "wb"
+
+        with open(self.spillFile, mode) as f:
+            f.write(self.records[:self.count].tobytes())
+
+        self.spilled += self.count
+        self.count = 0
+        self.mapped = None
+
+    # Yields the trades as arrays of at most the given size: first those in the spill file, then those in memory
+    def chunks(self, size: int = 65536):
+        if self.spilled > 0:
+            if self.mapped is None:
+                self.mapped = numpy.memmap(self.spillFile, dtype=tradeDtype, mode="r", shape=(self.spilled,))
+
+            for start in range(0, self.spilled, size):
+                yield self.mapped[start:start + size]
+
+        for start in range(0, self.count, size):
+            yield self.records[start:min(start + size, self.count)]
+
+    # Returns one field (see tradeDtype) of all trades as an array
+    def column(self, name: str) -> numpy.ndarray:
+        return numpy.concatenate([numpy.zeros(0, dtype=tradeDtype[name])] + [chunk[name] for chunk in self.chunks()])
+
+    # Returns all trades as one array in memory
+    def toArray(self) -> numpy.ndarray:
+        return numpy.concatenate([numpy.zeros(0, dtype=tradeDtype)] + list(self.chunks()))
+
+    def __del__(self):
+        if self.temporary:
+            self.mapped = None
+
+            if os.path.exists(self.spillFile):
+                os.remove(self.spillFile)
+
+# Open, high, low and close prices and volume of the trades of an order book, in consecutive time intervals of the given length.
+# Updated as trades happen, so bars don't need to be made by going through the data points afterwards.
+# Each field is stored in a flat array of doubles, one value per bar. The first bar is the interval of the first trade;
+# intervals without trades get a bar at the last close price, with no volume.
+class OHLCVBars:
+    def __init__(self, interval: float):
+        self.interval: float = interval
+
+        # Index of the first bar's interval (its start time divided by the interval length)
+        self.start: int = None
+
+        self.open: array.array = array.array("d")
+        self.high: array.array = array.array("d")
+        self.low: array.array = array.array("d")
+        self.close: array.array = array.array("d")
+        self.volume: array.array = array.array("d")
+
+    def __len__(self) -> int:
+        return len(self.close)
+
+    # Adds a trade; trades must be added in time order
+    def add(self, time: float, price: float, amount: int):
+        bar: int = int(time // self.interval)
+
+        if self.start is None:
+            self.start = bar
+
+        index: int = bar - self.start
+
+        while len(self.close) < index:
+            last: float = self.close[-1]
+            self.open.append(last)
+            self.high.append(last)
+            self.low.append(last)
+            self.close.append(last)
+            self.volume.append(0)
+
+        if len(self.close) == index:
+            self.open.append(price)
+            self.high.append(price)
+            self.low.append(price)
+            self.close.append(price)
+            self.volume.append(amount)
+        else:
+            if price > self.high[index]:
+                self.high[index] = price
+            if price < self.low[index]:
+                self.low[index] = price
+            self.close[index] = price
+            self.volume[index] += amount
+
+    # Returns the start time of each bar
+    def times(self) -> numpy.ndarray:
+        if self.start is None:
+            return numpy.zeros(0)
+        return (self.start + numpy.arange(len(self.close))) * self.interval
+
+    # Returns the bars as an array with one row per bar: start time, open, high, low, close and volume
+    def toArray(self) -> numpy.ndarray:
+        return numpy.column_stack((self.times(), numpy.frombuffer(self.open), numpy.frombuffer(self.high), numpy.frombuffer(self.low), numpy.frombuffer(self.close), numpy.frombuffer(self.volume)))
+
+    # Makes bars of the given interval from the trades of a trade tape
+    def fromTape(tape: TradeTape, interval: float) -> 'OHLCVBars':
+        bars: OHLCVBars = OHLCVBars(interval)
+
+        for chunk in tape.chunks():
+            for (time, price, amount) in zip(chunk["time"].tolist(), chunk["price"].tolist(), chunk["amount"].tolist()):
+                bars.add(time, price, amount)
+
+        return bars